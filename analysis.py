@@ -1,9 +1,104 @@
+from collections import deque
 from datetime import datetime
 import numpy as np
-import os
 import pandas as pd
 from pathlib import Path
+import metrics
 import re
+import storage
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def evaluate_trend(
+        #スイングの分類のコード(0: スイングハイ、1: スイングロウ)
+        category: np.ndarray,
+        high: np.ndarray,
+        low: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    ハイとロウが交互になったスイングの配列から、Dow.environmental_awarenessと同じ判定で
+    スイングごとのトレンドのコード(1: 上昇、-1: 下降、0: なし)、転換値、直近目標値の配列を返す関数
+    numbaがインストールされている場合はJITコンパイルして実行する
+    """
+    swing_count = category.size
+    trend = np.zeros(swing_count, dtype=np.int8)
+    conversion_values = np.full(swing_count, np.nan)
+    target_values = np.full(swing_count, np.nan)
+
+    current_trend = 0
+    #現在のデータよりも前に最低３つデータが必要のため、4つ目のデータから判定する
+    for count in range(3, swing_count):
+        target_data = high[count] if category[count] == 0 else low[count]
+        latest = count - 1
+
+        #validate_trendと同じ判定
+        if current_trend == 0:
+            conversion_value = np.nan
+            target_value = np.nan
+
+            #直近がスイングロウの場合は安値と高値が切り上がっていれば上昇トレンド
+            if category[latest] == 1:
+                if low[count - 3] < low[latest] and high[count - 2] < target_data:
+                    current_trend = 1
+                    conversion_value = low[latest]
+                    target_value = target_data
+
+            #直近がスイングハイの場合は安値と高値が切り下がっていれば下降トレンド
+            elif low[count - 2] > target_data and high[count - 3] > high[latest]:
+                current_trend = -1
+                conversion_value = high[latest]
+                target_value = target_data
+
+        #validate_up_trendと同じ判定
+        elif current_trend == 1:
+            conversion_value = conversion_values[latest]
+            target_value = target_values[latest]
+
+            if category[latest] == 0:
+                #安値が転換値を下回った場合はトレンドの転換
+                if not conversion_value <= target_data:
+                    current_trend = 0
+                    conversion_value = np.nan
+                    target_value = np.nan
+
+            elif target_value <= target_data:
+                conversion_value = low[latest]
+                target_value = target_data
+
+        #validate_down_trendと同じ判定
+        else:
+            conversion_value = conversion_values[latest]
+            target_value = target_values[latest]
+
+            if category[latest] == 0:
+                if target_value > target_data:
+                    conversion_value = high[latest]
+                    target_value = target_data
+
+            #高値が転換値を超えた場合はトレンドの転換
+            elif conversion_value > target_data:
+                conversion_value = target_data
+                target_value = low[latest]
+
+            else:
+                current_trend = 0
+                conversion_value = np.nan
+                target_value = np.nan
+
+        trend[count] = current_trend
+        conversion_values[count] = conversion_value
+        target_values[count] = target_value
+
+    return trend, conversion_values, target_values
+
+
+if njit is not None:
+    evaluate_trend = njit(cache=True)(evaluate_trend)
+
 
 #ダウ理論
 class Dow():
@@ -17,73 +112,270 @@ class Dow():
             #トレンド予測したいローソク足のデータ
             PATH: Path,
             backtest: bool = False,
+            #分析結果を保存しておく量。Noneの場合はconfigのRETENTIONから決める
+            retention: storage.RetentionPolicy | None = None,
+            #分析するローソク足のDataFrame(KlineResamplerで作成した上位足など)
+            #Noneの場合はPATHから読み込む
+            klines_df: pd.DataFrame | None = None,
+            #スイングを検証する左右の期間数
+            period: int = PERIOD,
         ) -> None:
         super().__init__()
 
-        #分析するローソク足のデータのDataframe
-        self.target_klines_df = pd.read_csv(
-                                    PATH,
-                                    header=0,
-                                    index_col=0,
-                                )
+        self.period = period
 
-        #csvを保存するpath
-        #analysis/(分析する通貨名)/(ローソク足の時間).csvに保存する
-        target = re.findall('data/(.*?)/(.*?).csv', str(PATH))
+        #分析結果を保存するpath
+        #analysis/(分析する通貨名)/(ローソク足の時間).(ローソク足と同じ拡張子)に保存する
+        #.binのストレージはローソク足だけを保存できるため、分析結果はcsvに保存する
+        target = re.findall('data/(.*?)/(.*?)(\\.csv|\\.parquet|\\.feather|\\.bin)', Path(PATH).as_posix())
         self.PATH = Path(
             'analysis',
             target[0][0],
-            f'{target[0][1]}.csv'
+            f'{target[0][1]}{target[0][2] if target[0][2] != ".bin" else ".csv"}'
+        )
+        self.storage = storage.open_storage(self.PATH)
+        self.retention = retention if retention is not None else storage.retention_for(
+            symbol=target[0][0].split('-')[0],
+            interval=target[0][1].replace('MinutesKlines', '')
         )
+        #計測結果につけるラベル
+        self.labels = {
+            'symbol': target[0][0].split('-')[0],
+            'interval': target[0][1].replace('MinutesKlines', '')
+        }
 
-        #pathのcsvファイルがすでに存在する場合はcsvをDataFrameに変換
-        if not backtest and os.path.isfile(self.PATH):
-            self.df = pd.read_csv(
-                self.PATH,
-                header=0,
-                index_col=0,
-            )
+        #分析するローソク足のデータのDataframe
+        if klines_df is None:
+            with metrics.span('dow.read', **self.labels):
+                self.target_klines_df = storage.open_storage(PATH).read()
+        else:
+            self.target_klines_df = klines_df.reset_index(drop=True)
 
-            #現在の相場を分析結果のデータフレームから取得
-            self.trend = self.df.iloc[-1]['トレンド']
+        #pathにデータがすでに保存されている場合は分析結果を読み込む
+        if not backtest and self.storage.exists():
+            with metrics.span('dow.read', **self.labels):
+                self.swings = SwingRecords.from_frame(df=self.storage.read())
+
+            #現在の相場を分析結果から取得
+            self.trend = self.swings[-1]['トレンド'] if len(self.swings) > 0 else np.nan
 
         #過去に分析していない通貨のローソク足のデータがPATHに入っているため、
         #渡されたデータをもとにスイングハイ、スイングロウを定義する
         else:
-            self.df = self.analysis_dow()
-            
-            self.trend = np.nan
-            counter = len(self.df)
-
-            for count in range(counter):
-                #現在のデータよりも前に最低３つデータが必要のため
-                #ない場合はスキップする
-                if count <= 2:
-                    pass
-
-                else:
-                    target_df = self.df.iloc[count].copy()
-                    target_data = float(target_df['高値']) if target_df['分類'] == 'スイングハイ' else float(target_df['安値'])
-                    latest_data = self.df.iloc[count - 1]
-                    
-                    conversion_value, target_value = self.environmental_awareness(
-                                                        target_data=target_data,
-                                                        latest_data=latest_data,
-                                                        count=count
-                                                    )
-                    
-                    self.df.iloc[count, self.ANALYSIS_TREND_COLUMNS.index('トレンド')] = self.trend
-                    self.df.iloc[count, self.ANALYSIS_TREND_COLUMNS.index('転換値')] = conversion_value
-                    self.df.iloc[count, self.ANALYSIS_TREND_COLUMNS.index('直近目標値')] = target_value
-
-            self.save_csv(df=self.df)
+            metrics.increment('dow.rows', len(self.target_klines_df), **self.labels)
+
+            with metrics.span('dow.swings', **self.labels):
+                self.swings = self.analysis_swings(period=self.period)
+
+            #スイングの配列からトレンド、転換値、直近目標値をまとめて計算して一度に書き込む
+            with metrics.span('dow.trend', **self.labels):
+                self.swings.trend, self.swings.conversion_value, self.swings.target_value = evaluate_trend(
+                    category=self.swings.category,
+                    high=self.swings.high,
+                    low=self.swings.low
+                )
+
+            #現在の相場を分析結果から取得
+            self.trend = self.swings[-1]['トレンド'] if len(self.swings) > 0 else np.nan
+
+            with metrics.span('dow.save', **self.labels):
+                self.save(df=self.df)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """
+        分析結果を['開始時刻', '分類', '高値', '安値', 'トレンド', '転換値', '直近目標値']の
+        DataFrameにして返す関数
+        分析中は型付きの配列(self.swings)を使い、保存や可視化のときだけDataFrameを作成する
+        """
+        return self.swings.to_frame()
+
+    @df.setter
+    def df(
+            self,
+            df: pd.DataFrame,
+        ) -> None:
+        self.swings = SwingRecords.from_frame(df=df)
 
     def analysis_dow(
             self,
             #見比べる左右のデータ数
             period: int = PERIOD,
+            #Trueの場合は1行ずつ検証する従来のループで計算する(検証用)
+            reference: bool = False,
             ) -> pd.DataFrame:
         """
+        分析するローソク足のDataframeから左右の期間のデータと比べてスイングハイ、スイングロウを定義して、
+        分析結果をDataframeにして返す関数
+        通常はNumPyのスライディングウィンドウで一括計算し、referenceがTrueの場合は
+        従来の1行ずつ比較するループで計算する
+        """
+        if reference:
+            analysis_trend_df = self.analysis_dow_reference(period=period)
+        else:
+            analysis_trend_df = self.analysis_dow_vectorized(period=period)
+
+        return self.pretreatment_df(target_df=analysis_trend_df)
+
+    def analysis_swings(
+            self,
+            period: int = PERIOD,
+        ) -> 'SwingRecords':
+        """
+        analysis_dowと同じスイングハイ、スイングロウを、DataFrameを作らずに
+        型付きの配列のSwingRecordsで返す関数
+        """
+        high = self.target_klines_df['高値'].to_numpy(dtype=np.float64)
+        low = self.target_klines_df['安値'].to_numpy(dtype=np.float64)
+
+        is_swing_high, is_swing_low = self.detect_swings(
+                                        high=high,
+                                        low=low,
+                                        period=period
+                                    )
+
+        swing_index = np.flatnonzero(is_swing_high | is_swing_low)
+        swing_index = swing_index[self.merge_swings(
+            is_high=is_swing_high[swing_index],
+            highs=high[swing_index],
+            lows=low[swing_index]
+        )]
+
+        #開始時刻をint64(ns)に変換してローソク足データの保存されている日付だけを残す
+        start_time = pd.to_datetime(
+            self.target_klines_df['開始時刻'].to_numpy(dtype=object)[swing_index]
+        ).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        klines_start_time = pd.to_datetime(
+            self.target_klines_df['開始時刻'].to_numpy(dtype=object)[[0, -1]]
+        ).to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+        is_in_range = (klines_start_time[0] <= start_time) & (start_time <= klines_start_time[-1])
+        swing_index = swing_index[is_in_range]
+        is_high = is_swing_high[swing_index]
+
+        return SwingRecords(
+            start_time=start_time[is_in_range],
+            category=np.where(is_high, 0, 1).astype(np.int8),
+            high=np.where(is_high, high[swing_index], np.nan),
+            low=np.where(is_high, np.nan, low[swing_index]),
+        )
+
+    def analysis_dow_vectorized(
+            self,
+            period: int = PERIOD,
+        ) -> pd.DataFrame:
+        """
+        高値と安値の左右period期間の最大値と最小値をスライディングウィンドウでまとめて計算して、
+        swing_high、swing_lowと同じ条件でスイングハイ、スイングロウを判定したDataframeを返す関数
+        左右どちらかの期間のデータがない場合はNaNとして片方の期間とだけ比べる
+        """
+        high = self.target_klines_df['高値'].to_numpy(dtype=np.float64)
+        low = self.target_klines_df['安値'].to_numpy(dtype=np.float64)
+
+        is_swing_high, is_swing_low = self.detect_swings(
+                                        high=high,
+                                        low=low,
+                                        period=period
+                                    )
+
+        swing_index = np.flatnonzero(is_swing_high | is_swing_low)
+        is_high = is_swing_high[swing_index]
+
+        #従来の結果と同じくobject型の配列にしてNoneを入れる
+        analysis_trend_array = np.full(
+            (swing_index.size, len(self.ANALYSIS_TREND_COLUMNS)),
+            None,
+            dtype=object
+        )
+        analysis_trend_array[:, 0] = self.target_klines_df['開始時刻'].to_numpy(dtype=object)[swing_index]
+        analysis_trend_array[:, 1] = np.where(is_high, 'スイングハイ', 'スイングロウ')
+        analysis_trend_array[is_high, 2] = high[swing_index[is_high]]
+        analysis_trend_array[~is_high, 3] = low[swing_index[~is_high]]
+
+        return pd.DataFrame(
+            data=analysis_trend_array,
+            columns=self.ANALYSIS_TREND_COLUMNS
+        )
+
+    def detect_swings(
+            self,
+            high: np.ndarray,
+            low: np.ndarray,
+            period: int = PERIOD,
+            #2次元配列の行ごとのデータ数(後ろをNaNで埋めた行がある場合)。Noneの場合はすべての行が最後の軸の長さ
+            lengths: np.ndarray | None = None,
+        ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        高値と安値の配列を渡すと、スイングハイとスイングロウの位置をTrueにした配列を返す関数
+        スイングハイとスイングロウの両方の条件を満たす場合はswing_highを優先してスイングハイにする
+        """
+        max_left_redicted_values, max_right_redicted_values = self.sliding_extrema(
+                                                                    values=high,
+                                                                    period=period,
+                                                                    func=np.max,
+                                                                    lengths=lengths
+                                                                )
+        min_left_redicted_values, min_right_redicted_values = self.sliding_extrema(
+                                                                    values=low,
+                                                                    period=period,
+                                                                    func=np.min,
+                                                                    lengths=lengths
+                                                                )
+
+        #NaNとの比較はFalseになるため、期間のデータがない側は検証から外れる
+        is_swing_high = ~((high < max_left_redicted_values) | (high < max_right_redicted_values))
+        is_swing_low = ~((low > min_left_redicted_values) | (low > min_right_redicted_values)) & ~is_swing_high
+
+        return is_swing_high, is_swing_low
+
+    def sliding_extrema(
+            self,
+            values: np.ndarray,
+            period: int,
+            func,
+            #2次元配列の行ごとのデータ数(後ろをNaNで埋めた行がある場合)。Noneの場合はすべての行が最後の軸の長さ
+            lengths: np.ndarray | None = None,
+        ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        各データの左側period期間と右側period期間にfunc(np.maxかnp.min)を適用した配列を返す関数
+        左側はperiod期間分のデータがない場合、右側はi + period がデータ数を超える場合にNaNを入れる
+        (右端から数えてperiod番目のデータは従来のループと同じくperiod - 1期間分で比べる)
+        2次元配列(シンボル × 時間)の場合は最後の軸に沿って行ごとに計算する
+        lengthsを渡した場合は、行ごとにそのデータ数の右端から数えてperiod番目のデータを
+        period - 1期間分で比べ直す(後ろの埋めたNaNの位置はNaNのまま残る)
+        """
+        total_data_count = values.shape[-1]
+        left_redicted_values = np.full(values.shape, np.nan)
+        right_redicted_values = np.full(values.shape, np.nan)
+
+        if total_data_count > period:
+            #windows[..., j]はvalues[..., j : j + period]の値
+            windows = func(np.lib.stride_tricks.sliding_window_view(values, period, axis=-1), axis=-1)
+            left_redicted_values[..., period:] = windows[..., :-1]
+            right_redicted_values[..., :total_data_count - period] = windows[..., 1:]
+
+        if period <= 1:
+            return left_redicted_values, right_redicted_values
+
+        #右側のデータがperiod - 1期間分しかない位置
+        if lengths is None:
+            last_index = total_data_count - period
+            if 0 <= last_index:
+                right_redicted_values[..., last_index] = func(values[..., last_index + 1:], axis=-1)
+
+        else:
+            rows = np.flatnonzero(lengths >= period)
+            last_index = lengths[rows] - period
+            windows = values[rows[:, np.newaxis], last_index[:, np.newaxis] + np.arange(1, period)]
+            right_redicted_values[rows, last_index] = func(windows, axis=-1)
+
+        return left_redicted_values, right_redicted_values
+
+    def analysis_dow_reference(
+            self,
+            period: int = PERIOD,
+        ) -> pd.DataFrame:
+        """
         分析するローソク足のDataframeから一つずつ値を取り出して、
         取り出した期間の前後のデータと比べてスイングハイ、スイングロウを定義して、
         分析結果をDataframeにして返す関数
@@ -136,7 +428,7 @@ class Dow():
             columns=self.ANALYSIS_TREND_COLUMNS
         )
         
-        return self.pretreatment_df(target_df=analysis_trend_df)
+        return analysis_trend_df
     
     def swing_high(
             self,
@@ -218,49 +510,99 @@ class Dow():
         交互になるように加工してDataframeを返す関数
         """
 
-        i = 1
-        #データをすべて比較するまで実行
-        while (i < target_df.index.size):
-            #分類が同じ種類のものであれば値を比較する
-            #違うものなら、データを残したまま次の期間のデータを比較する
-            if target_df.iloc[i - 1]['分類'] == target_df.iloc[i]['分類']:
-                
-                match target_df.iloc[i]['分類']:
-                    #分類がスイングハイならば高値を比較する
-                    case 'スイングハイ':
-                        #高値の低い方をdataframeから削除する
-                        if target_df.iloc[i - 1]['高値'] < target_df.iloc[i]['高値']:
-                            target_df = target_df.drop(target_df.index[i - 1])
-                        else:
-                            target_df = target_df.drop(target_df.index[i])
-
-                    #スイングロウならば安値
-                    case 'スイングロウ':
-                        #安値の高い方を削除
-                        if target_df.iloc[i - 1]['安値'] > target_df.iloc[i]['安値']:
-                            target_df = target_df.drop(target_df.index[i - 1])
-                        else:
-                            target_df = target_df.drop(target_df.index[i])
-
-                    case _:
-                        print(target_df.iloc[i])
-                        pass
-
-            else: #分類が違う場合はindexを次のデータに変えて比較する
-                i += 1
+        stack = self.merge_swings(
+            is_high=target_df['分類'].to_numpy() == 'スイングハイ',
+            highs=target_df['高値'].to_numpy(),
+            lows=target_df['安値'].to_numpy()
+        )
+
+        target_df = target_df.iloc[stack].copy()
 
         #開始時刻をdatetime型に変換してローソク足データの保存されている日付だけを残して削除する
         target_df['開始時刻'] = pd.to_datetime(
             target_df['開始時刻'], format="%Y-%m-%d %H:%M:%S"
         )
 
+        klines_start_time = pd.to_datetime(
+            self.target_klines_df['開始時刻'].to_numpy()[[0, -1]]
+        ).to_numpy()
+        start_time = target_df['開始時刻'].to_numpy()
+
         target_df = target_df[
-            (self.target_klines_df.iloc[0]['開始時刻'] <= target_df['開始時刻']) &
-            (target_df['開始時刻'] <= self.target_klines_df.iloc[-1]['開始時刻'])
+            (klines_start_time[0] <= start_time) &
+            (start_time <= klines_start_time[-1])
         ]
 
         return target_df
     
+    def merge_swings(
+            self,
+            #スイングハイの位置をTrueにした配列
+            is_high: np.ndarray,
+            highs: np.ndarray,
+            lows: np.ndarray,
+        ) -> list[int]:
+        """
+        連続するスイングハイ、スイングロウのうち、スイングハイならより高い方を、
+        スイングロウならより低い方を残して、ハイとロウが交互になるように残す位置のリストを返す関数
+        """
+        #残すデータの位置をスタックに積んでいき、直前のデータと分類が同じ場合は
+        #スイングハイならより高い方を、スイングロウならより低い方をスタックに残す
+        stack = []
+        for i in range(is_high.size):
+            if stack and is_high[stack[-1]] == is_high[i]:
+                latest = stack[-1]
+
+                #高値の低い方を削除する(同じ値の場合は前のデータを残す)
+                if is_high[i]:
+                    if highs[latest] < highs[i]:
+                        stack[-1] = i
+
+                #安値の高い方を削除する(同じ値の場合は前のデータを残す)
+                elif lows[latest] > lows[i]:
+                    stack[-1] = i
+
+            else: #分類が違う場合はそのまま残す
+                stack.append(i)
+
+        return stack
+
+    def merge_swings_batch(
+            self,
+            #スイングのシンボルの位置(昇順)
+            symbol_index: np.ndarray,
+            #スイングハイの位置をTrueにした配列
+            is_high: np.ndarray,
+            highs: np.ndarray,
+            lows: np.ndarray,
+        ) -> np.ndarray:
+        """
+        merge_swingsと同じく連続するスイングハイ、スイングロウのうちより高い高値、より低い安値を
+        (同じ値の場合は前のデータを)残す位置の配列を、すべてのシンボルについてまとめて返す関数
+        連続する同じ分類のかたまりごとに最も良い値のデータを1つだけ残す
+        """
+        if is_high.size == 0:
+            return np.empty(0, dtype=np.int64)
+
+        #分類かシンボルが変わるところで新しいかたまりにする
+        is_new_run = np.r_[True, (is_high[1:] != is_high[:-1]) | (symbol_index[1:] != symbol_index[:-1])]
+        run = np.cumsum(is_new_run)
+
+        #スイングハイは高値が高いほど、スイングロウは安値が低いほど小さくなる値で並べ替える
+        score = np.where(is_high, -highs, lows)
+        order = np.lexsort((np.arange(is_high.size), score, run))
+
+        return np.sort(order[np.r_[True, run[order][1:] != run[order][:-1]]])
+
+    def save(
+            self,
+            df: pd.DataFrame,
+    ) -> None:
+        """
+        分析結果を保存期間を過ぎたデータを削除してからストレージに保存する関数
+        """
+        self.storage.apply_retention(policy=self.retention, df=df)
+
     def save_csv(
             self,
             df: pd.DataFrame,
@@ -268,12 +610,10 @@ class Dow():
         """
         pathの位置にcsvにして保存する関数
         """
-        #dataframeのサイズが200以上あるときは新しいデータから200個分残して削除する
-        df = df.drop(df.iloc[: -200].index).reset_index(drop=True)
-
-        #上の階層のディレクトリがない場合は作成する
-        self.PATH.parent.mkdir(parents=True, exist_ok=True)
-        df.to_csv(self.PATH)
+        storage.CsvStorage(path=self.PATH.with_suffix('.csv')).apply_retention(
+            policy=self.retention,
+            df=df
+        )
 
     def environmental_awareness(
             self,
@@ -317,8 +657,8 @@ class Dow():
         if latest_data['分類'] == 'スイングロウ':
             #直近安値と直近高値
             latest_low = float(latest_data['安値'])
-            latest_second_low = float(self.df.iloc[count - 3]['安値'])
-            latest_high = float(self.df.iloc[count - 2]['高値'])
+            latest_second_low = float(self.swings[count - 3]['安値'])
+            latest_high = float(self.swings[count - 2]['高値'])
 
             #安値が切り上がっているか判定
             is_low_price_up = latest_second_low < latest_low
@@ -341,9 +681,9 @@ class Dow():
         #スイングハイのデータの場合は、下降トレンドであるか検証する
         else:
             #直近安値と直近高値
-            latest_low = float(self.df.iloc[count - 2]['安値'])
+            latest_low = float(self.swings[count - 2]['安値'])
             latest_high = float(latest_data['高値'])
-            latest_second_hign = float(self.df.iloc[count - 3]['高値'])
+            latest_second_hign = float(self.swings[count - 3]['高値'])
 
             #安値が切り下がっているか判定
             is_low_price_cut = latest_low > target_data
@@ -446,4 +786,805 @@ class Dow():
                 conversion_value = np.nan
                 current_target_value = np.nan
 
-        return conversion_value, current_target_value
\ No newline at end of file
+        return conversion_value, current_target_value
+
+
+#分析結果のスイングを型付きの配列で持つクラス
+#開始時刻はint64(ns)、分類とトレンドはint8のコード、価格はfloat64で持ち、
+#日本語のカラム名のDataFrameは保存や可視化のときだけto_frameで作成する
+class SwingRecords():
+
+    __slots__ = ('start_time', 'category', 'high', 'low', 'trend', 'conversion_value', 'target_value')
+
+    #分類のコード(0: スイングハイ、1: スイングロウ)
+    CATEGORIES = ['スイングハイ', 'スイングロウ']
+    #トレンドのコード(0: なし、1: 上昇、-1: 下降)
+    TRENDS = {1: '上昇', -1: '下降'}
+    TREND_CODES = {'上昇': 1, '下降': -1}
+
+    def __init__(
+            self,
+            start_time: np.ndarray,
+            category: np.ndarray,
+            high: np.ndarray,
+            low: np.ndarray,
+            trend: np.ndarray | None = None,
+            conversion_value: np.ndarray | None = None,
+            target_value: np.ndarray | None = None,
+        ) -> None:
+        super().__init__()
+
+        self.start_time = np.asarray(start_time, dtype=np.int64)
+        self.category = np.asarray(category, dtype=np.int8)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.low = np.asarray(low, dtype=np.float64)
+
+        size = self.start_time.size
+        self.trend = np.zeros(size, dtype=np.int8) if trend is None else np.asarray(trend, dtype=np.int8)
+        self.conversion_value = np.full(size, np.nan) if conversion_value is None else np.asarray(conversion_value, dtype=np.float64)
+        self.target_value = np.full(size, np.nan) if target_value is None else np.asarray(target_value, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return self.start_time.size
+
+    def __getitem__(
+            self,
+            index: int,
+        ) -> 'SwingRecord':
+        return SwingRecord(records=self, index=index % len(self))
+
+    def value(
+            self,
+            #['開始時刻', '分類', '高値', '安値', 'トレンド', '転換値', '直近目標値']のいずれか
+            key: str,
+            index: int,
+        ):
+        """
+        index番目のスイングのkeyの値を、DataFrameの行と同じ値にして返す関数
+        """
+        match key:
+            case '開始時刻':
+                return pd.Timestamp(self.start_time[index])
+            case '分類':
+                return self.CATEGORIES[self.category[index]]
+            case '高値':
+                return float(self.high[index])
+            case '安値':
+                return float(self.low[index])
+            case 'トレンド':
+                return self.TRENDS.get(int(self.trend[index]), np.nan)
+            case '転換値':
+                return float(self.conversion_value[index])
+            case '直近目標値':
+                return float(self.target_value[index])
+            case _:
+                raise KeyError(key)
+
+    def set_trend(
+            self,
+            index: int,
+            #'上昇'、'下降'、NaN
+            trend: str | float,
+            conversion_value: float,
+            target_value: float,
+        ) -> None:
+        """
+        index番目のスイングにトレンド、転換値、直近目標値を書き込む関数
+        """
+        self.trend[index] = self.TREND_CODES.get(trend, 0) if isinstance(trend, str) else 0
+        self.conversion_value[index] = conversion_value
+        self.target_value[index] = target_value
+
+    @classmethod
+    def from_frame(
+            cls,
+            df: pd.DataFrame,
+        ) -> 'SwingRecords':
+        """
+        分析結果のDataFrameからSwingRecordsを作成する関数
+        トレンド、転換値、直近目標値のカラムがない場合は空の値にする
+        """
+        size = len(df)
+
+        def numeric(column: str) -> np.ndarray:
+            if column not in df.columns:
+                return np.full(size, np.nan)
+            return pd.to_numeric(df[column]).to_numpy(dtype=np.float64)
+
+        trend = df['トレンド'].map(cls.TREND_CODES).fillna(0).to_numpy() if 'トレンド' in df.columns else None
+
+        return cls(
+            start_time=pd.to_datetime(df['開始時刻']).to_numpy(dtype='datetime64[ns]').view(np.int64),
+            category=np.where(df['分類'].to_numpy() == 'スイングハイ', 0, 1),
+            high=numeric('高値'),
+            low=numeric('安値'),
+            trend=trend,
+            conversion_value=numeric('転換値'),
+            target_value=numeric('直近目標値'),
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        日本語のカラム名の分析結果のDataFrameにして返す関数
+        """
+        trend = np.full(len(self), np.nan, dtype=object)
+        for code, label in self.TRENDS.items():
+            trend[self.trend == code] = label
+
+        return pd.DataFrame({
+            '開始時刻': self.start_time.view('datetime64[ns]'),
+            '分類': np.array(self.CATEGORIES, dtype=object)[self.category],
+            '高値': self.high,
+            '安値': self.low,
+            'トレンド': trend,
+            '転換値': self.conversion_value,
+            '直近目標値': self.target_value,
+        })
+
+
+#SwingRecordsの1つのスイングを、DataFrameの行と同じようにカラム名で参照するためのクラス
+class SwingRecord():
+
+    __slots__ = ('records', 'index')
+
+    def __init__(
+            self,
+            records: SwingRecords,
+            index: int,
+        ) -> None:
+        self.records = records
+        self.index = index
+
+    def __getitem__(
+            self,
+            key: str,
+        ):
+        return self.records.value(key=key, index=self.index)
+
+
+#直近のスイングのリストをSwingRecordsと同じ書き方で参照するためのクラス
+#1行ごとにDataFrameを作るとスイングごとの処理が重くなるため、行は列名をキーにしたdictで返す
+class SwingWindow():
+
+    def __init__(
+            self,
+            #[開始時刻, 分類, 高値, 安値, トレンド, 転換値, 直近目標値]のリストのdeque
+            swings: deque,
+        ) -> None:
+        super().__init__()
+
+        self.swings = swings
+
+    def __getitem__(
+            self,
+            index: int,
+        ) -> dict:
+        return dict(zip(Dow.ANALYSIS_TREND_COLUMNS, self.swings[index]))
+
+    def __len__(self) -> int:
+        return len(self.swings)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        直近のスイングをDataFrameにして返す関数
+        """
+        return pd.DataFrame(
+            data=list(self.swings),
+            columns=Dow.ANALYSIS_TREND_COLUMNS
+        )
+
+
+#確定したローソク足を1本ずつ受け取ってトレンドを更新するダウ理論
+class IncrementalDow(Dow):
+
+    #トレンドの判定に必要な直近のスイングの数
+    SWING_WINDOW = 4
+    #save_checkpointで保存するファイルの形式のバージョン
+    CHECKPOINT_VERSION = 1
+
+    def __init__(
+            self,
+            #検証する左右の期間数
+            period: int = Dow.PERIOD,
+        ) -> None:
+        #csvの読み込みや全期間の分析は行わずに状態だけを用意する
+        self.period = period
+
+        #スイングを検証するための直近period * 2 + 1本のローソク足
+        self.candles = deque(maxlen=period * 2 + 1)
+        #これまでに受け取ったローソク足の数
+        self.candle_count = 0
+
+        #連続するスイングをまとめたあとの直近のスイング
+        #[開始時刻, 分類, 高値, 安値, トレンド, 転換値, 直近目標値]のリスト
+        self.recent_swings = deque(maxlen=self.SWING_WINDOW)
+        #これまでに確定したスイングの数
+        self.swing_count = 0
+
+        #validate_trendなどがDowと同じように直近のスイングを参照できるようにする
+        self.swings = SwingWindow(swings=self.recent_swings)
+        self.trend = np.nan
+        self.conversion_value = np.nan
+        self.target_value = np.nan
+
+        #トレンドが変わったイベントの発行先(attachで設定する)
+        self.signal_bus = None
+        self.symbol = None
+        self.interval = None
+        #ローソク足1本の長さ(ms)
+        self.interval_ms = None
+
+    def attach(
+            self,
+            #signals.SignalBus
+            signal_bus,
+            symbol: str,
+            interval: str,
+            #ローソク足1本の長さ(ms)
+            interval_ms: int,
+        ) -> 'IncrementalDow':
+        """
+        スイングが確定してトレンドが変わったときに、signal_busにTrendChangeを発行するようにして自身を返す関数
+        右側の期間がそろって確定したスイングだけでトレンドを判定するため、
+        発行したトレンドが後のローソク足で取り消されることはない
+        """
+        self.signal_bus = signal_bus
+        self.symbol = symbol
+        self.interval = interval
+        self.interval_ms = interval_ms
+
+        return self
+
+    def update(
+            self,
+            #確定したローソク足(開始時刻、高値、安値を持つSeriesかdict)
+            candle: pd.Series | dict,
+        ) -> list | None:
+        """
+        確定したローソク足を1本渡すと、右側の期間がそろったローソク足がスイングハイ、
+        スイングロウであるかを検証して、スイングが確定した場合はトレンドを更新して
+        そのスイングのリストを返す関数
+        スイングが確定しない場合はNoneを返す
+        """
+        self.candles.append(candle)
+        self.candle_count += 1
+
+        #右側にperiod期間分のローソク足がそろっていない場合は検証できない
+        if self.candle_count <= self.period:
+            return None
+
+        #検証するローソク足のdeque内の位置と、全体での位置
+        center = len(self.candles) - 1 - self.period
+        predicted_index = self.candle_count - 1 - self.period
+        predicted_value = self.candles[center]
+
+        #左側にperiod期間分のデータがない場合はNaNを入れて右側の期間とだけ比べる
+        left_redicted_values = [
+            self.candles[i] for i in range(center - self.period, center)
+        ] if predicted_index >= self.period else []
+        right_redicted_values = [
+            self.candles[i] for i in range(center + 1, len(self.candles))
+        ]
+
+        max_left_redicted_value = max(
+            (value['高値'] for value in left_redicted_values), default=np.nan
+        )
+        min_left_redicted_value = min(
+            (value['安値'] for value in left_redicted_values), default=np.nan
+        )
+        max_right_redicted_value = max(value['高値'] for value in right_redicted_values)
+        min_right_redicted_value = min(value['安値'] for value in right_redicted_values)
+
+        swing = self.swing_high(
+                    predicted_value=predicted_value,
+                    left_redicted_value=max_left_redicted_value,
+                    right_redicted_value=max_right_redicted_value
+                )
+        if swing is None:
+            swing = self.swing_low(
+                        predicted_value=predicted_value,
+                        left_redicted_value=min_left_redicted_value,
+                        right_redicted_value=min_right_redicted_value
+                    )
+
+        if swing is None:
+            return None
+
+        return self.push_swing(swing=swing)
+
+    def push_swing(
+            self,
+            #[開始時刻, 分類, 高値, 安値, None, None, None]のリスト
+            swing: list,
+        ) -> list | None:
+        """
+        確定したスイングを渡すと、直前のスイングと分類が同じ場合はpretreatment_dfと同じく
+        より高い高値、より低い安値の方だけを残して、新しく残ったスイングにだけ
+        environmental_awarenessを適用してトレンド、転換値、直近目標値を更新する関数
+        直前のスイングの方が残る場合はNoneを返す
+        attachした場合は、トレンドが変わったときにスイングを確定したローソク足の確定時刻で発行する
+        """
+        swing = list(swing)
+        previous_trend = self.trend
+
+        if self.recent_swings and self.recent_swings[-1][1] == swing[1]:
+            latest_swing = self.recent_swings[-1]
+
+            match swing[1]:
+                #高値が前のスイング以下の場合は前のスイングを残す
+                case 'スイングハイ':
+                    if not latest_swing[2] < swing[2]:
+                        return None
+
+                #安値が前のスイング以上の場合は前のスイングを残す
+                case 'スイングロウ':
+                    if not latest_swing[3] > swing[3]:
+                        return None
+
+            #前のスイングを入れ替えるため、前のスイングで更新したトレンドを元に戻す
+            self.recent_swings.pop()
+            self.swing_count -= 1
+            self.trend = self.recent_swings[-1][4] if self.swing_count > 3 else np.nan
+            self.conversion_value = self.recent_swings[-1][5] if self.swing_count > 3 else np.nan
+            self.target_value = self.recent_swings[-1][6] if self.swing_count > 3 else np.nan
+
+        self.recent_swings.append(swing)
+        self.swing_count += 1
+
+        #現在のデータよりも前に最低３つデータが必要のため、ない場合はトレンドを判定しない
+        if self.swing_count > 3:
+            count = len(self.recent_swings) - 1
+            target_data = float(swing[2]) if swing[1] == 'スイングハイ' else float(swing[3])
+
+            conversion_value, target_value = self.environmental_awareness(
+                                                target_data=target_data,
+                                                latest_data=self.swings[count - 1],
+                                                count=count
+                                            )
+
+            swing[4] = self.trend
+            swing[5] = conversion_value
+            swing[6] = target_value
+            self.conversion_value = conversion_value
+            self.target_value = target_value
+
+        if self.signal_bus is not None and self.candles:
+            self.signal_bus.publish_trend(
+                symbol=self.symbol,
+                interval=self.interval,
+                previous=previous_trend,
+                dow=self,
+                closed_at=(self.last_start_time() / 1_000_000 + self.interval_ms) / 1000
+            )
+
+        return swing
+
+    def update_frame(
+            self,
+            #開始時刻、高値、安値を持つローソク足のDataFrame(開始時刻の昇順)
+            klines_df: pd.DataFrame,
+        ) -> list[list]:
+        """
+        ローソク足のDataFrameのうち、最後に受け取ったローソク足より新しいものだけを
+        順番にupdateに渡して、確定したスイングのリストを返す関数
+        """
+        if self.candles:
+            start_time = pd.to_datetime(klines_df['開始時刻']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+            klines_df = klines_df[start_time > self.last_start_time()]
+
+        swings = []
+        for candle in klines_df[['開始時刻', '高値', '安値']].to_dict('records'):
+            swing = self.update(candle=candle)
+            if swing is not None:
+                swings.append(swing)
+
+        return swings
+
+    def last_start_time(self) -> int | None:
+        """
+        最後に受け取ったローソク足の開始時刻(int64(ns))を返す関数
+        まだ受け取っていない場合はNoneを返す
+        """
+        if not self.candles:
+            return None
+
+        return pd.Timestamp(self.candles[-1]['開始時刻']).value
+
+    @staticmethod
+    def checkpoint_path(
+            #ローソク足のデータのpath(data/(通貨名)/(ローソク足の時間).(拡張子))
+            PATH: Path,
+        ) -> Path:
+        """
+        ローソク足のデータのpathから、分析の状態を保存するpath
+        (analysis/(通貨名)/(ローソク足の時間).npz)を返す関数
+        """
+        target = re.findall('data/(.*?)/(.*?)(\\.csv|\\.parquet|\\.feather|\\.bin)', Path(PATH).as_posix())
+
+        return Path('analysis', target[0][0], f'{target[0][1]}.npz')
+
+    def save_checkpoint(
+            self,
+            path: Path,
+        ) -> Path:
+        """
+        スイングの検証中のローソク足、直近のスイング、トレンド、転換値、直近目標値と
+        最後に受け取ったローソク足の開始時刻をnpzのファイルに保存する関数
+        途中まで書いたファイルを読まれないように、一時ファイルに書いてから置き換える
+        """
+        path = Path(path)
+        candles = list(self.candles)
+        swings = list(self.recent_swings)
+
+        def to_float(value) -> float:
+            return np.nan if value is None else float(value)
+
+        arrays = {
+            'version': np.array(self.CHECKPOINT_VERSION),
+            'period': np.array(self.period),
+            'candle_count': np.array(self.candle_count),
+            'swing_count': np.array(self.swing_count),
+            'trend': np.array(SwingRecords.TREND_CODES.get(self.trend, 0), dtype=np.int8),
+            'conversion_value': np.array(to_float(self.conversion_value)),
+            'target_value': np.array(to_float(self.target_value)),
+            'candle_start_time': np.array(
+                [pd.Timestamp(candle['開始時刻']).value for candle in candles], dtype=np.int64
+            ),
+            'candle_high': np.array([candle['高値'] for candle in candles], dtype=np.float64),
+            'candle_low': np.array([candle['安値'] for candle in candles], dtype=np.float64),
+            'swing_start_time': np.array(
+                [pd.Timestamp(swing[0]).value for swing in swings], dtype=np.int64
+            ),
+            'swing_category': np.array(
+                [SwingRecords.CATEGORIES.index(swing[1]) for swing in swings], dtype=np.int8
+            ),
+            'swing_high': np.array([to_float(swing[2]) for swing in swings]),
+            'swing_low': np.array([to_float(swing[3]) for swing in swings]),
+            'swing_trend': np.array(
+                [SwingRecords.TREND_CODES.get(swing[4], 0) for swing in swings], dtype=np.int8
+            ),
+            'swing_conversion_value': np.array([to_float(swing[5]) for swing in swings]),
+            'swing_target_value': np.array([to_float(swing[6]) for swing in swings]),
+        }
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(path.suffix + '.tmp')
+        with open(temporary_path, 'wb') as f:
+            np.savez(f, **arrays)
+        temporary_path.replace(path)
+
+        return path
+
+    @classmethod
+    def load_checkpoint(
+            cls,
+            path: Path,
+        ) -> 'IncrementalDow':
+        """
+        save_checkpointで保存したファイルから、保存したときと同じ状態のIncrementalDowを作成する関数
+        """
+        with np.load(path) as checkpoint:
+            if int(checkpoint['version']) != cls.CHECKPOINT_VERSION:
+                raise ValueError(f'対応していない分析の状態のファイルです: {path}')
+
+            dow = cls(period=int(checkpoint['period']))
+            dow.candle_count = int(checkpoint['candle_count'])
+            dow.swing_count = int(checkpoint['swing_count'])
+            dow.trend = SwingRecords.TRENDS.get(int(checkpoint['trend']), np.nan)
+            dow.conversion_value = float(checkpoint['conversion_value'])
+            dow.target_value = float(checkpoint['target_value'])
+
+            for start_time, high, low in zip(
+                    checkpoint['candle_start_time'],
+                    checkpoint['candle_high'].tolist(),
+                    checkpoint['candle_low'].tolist(),
+                ):
+                dow.candles.append({'開始時刻': pd.Timestamp(start_time), '高値': high, '安値': low})
+
+            #最初の3つのスイングはトレンドを判定していないため、push_swingと同じくNoneのままにする
+            first_index = dow.swing_count - checkpoint['swing_start_time'].size
+            for i, start_time in enumerate(checkpoint['swing_start_time']):
+                is_high = checkpoint['swing_category'][i] == 0
+                is_evaluated = first_index + i >= 3
+                dow.recent_swings.append([
+                    pd.Timestamp(start_time),
+                    SwingRecords.CATEGORIES[checkpoint['swing_category'][i]],
+                    float(checkpoint['swing_high'][i]) if is_high else None,
+                    None if is_high else float(checkpoint['swing_low'][i]),
+                    SwingRecords.TRENDS.get(int(checkpoint['swing_trend'][i]), np.nan) if is_evaluated else None,
+                    float(checkpoint['swing_conversion_value'][i]) if is_evaluated else None,
+                    float(checkpoint['swing_target_value'][i]) if is_evaluated else None,
+                ])
+
+        return dow
+
+    @classmethod
+    def resume(
+            cls,
+            #分析の状態を保存したファイルのpath
+            path: Path,
+            #分析するローソク足のDataFrame
+            klines_df: pd.DataFrame,
+            period: int = Dow.PERIOD,
+        ) -> tuple['IncrementalDow', list[list]]:
+        """
+        分析の状態を保存したファイルがある場合は読み込んで、保存したときより新しいローソク足だけを分析し、
+        (IncrementalDow, 確定したスイングのリスト)を返す関数
+        ファイルがない場合や検証する期間数が違う場合は、すべてのローソク足を分析する
+        """
+        dow = None
+        if Path(path).exists():
+            dow = cls.load_checkpoint(path=path)
+            if dow.period != period:
+                dow = None
+
+        if dow is None:
+            dow = cls(period=period)
+
+        return dow, dow.update_frame(klines_df=klines_df)
+
+    @classmethod
+    def advance(
+            cls,
+            #ジョブごとのIncrementalDow(初めてのジョブは追加する)
+            dows: dict,
+            #(カテゴリー, シンボル, ローソク足の時間)
+            job: tuple[str, str, str],
+            #確定したローソク足のDataFrame(開始時刻の昇順)
+            klines_df: pd.DataFrame,
+            #ローソク足のデータのpath
+            PATH: Path,
+            #トレンドが変わったイベントの発行先(signals.SignalBus)
+            signal_bus,
+            #ローソク足1本の長さ(ms)
+            interval_ms: int,
+        ) -> 'IncrementalDow':
+        """
+        ジョブのIncrementalDowに前回から増えた確定したローソク足だけを渡して、分析の状態を保存し、
+        IncrementalDowを返す関数
+        初めてのジョブは保存した分析の状態から再開してからsignal_busにattachするため、
+        再開までのスイングは発行せず、その後に確定したスイングでトレンドが変わったときだけ発行する
+        SchedulerとKlineStreamで同じ手順で分析の状態を保存して発行するために使う
+        """
+        checkpoint_path = cls.checkpoint_path(PATH=PATH)
+
+        if job in dows:
+            dow = dows[job]
+            dow.update_frame(klines_df=klines_df)
+        else:
+            dow, _ = cls.resume(path=checkpoint_path, klines_df=klines_df)
+            dows[job] = dow.attach(
+                signal_bus=signal_bus,
+                symbol=job[1],
+                interval=job[2],
+                interval_ms=interval_ms
+            )
+
+        dow.save_checkpoint(path=checkpoint_path)
+
+        return dow
+
+
+#複数のシンボルのローソク足を(シンボル × 本数)の2次元配列にまとめて一度に分析するダウ理論
+#Dowと同じく各シンボルのローソク足を時刻ではなく並び順で比べるため、欠けている時刻があっても結果が変わらない
+class BatchDow(Dow):
+
+    def __init__(
+            self,
+            #検証する左右の期間数
+            period: int = Dow.PERIOD,
+        ) -> None:
+        #csvの読み込みや保存は行わずに、runで渡されたローソク足をまとめて分析する
+        self.period = period
+
+    def load(
+            self,
+            #ローソク足のデータのpathのリスト(data/(通貨名)/(ローソク足の時間).(拡張子))
+            paths: list[Path],
+        ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        pathごとのローソク足の開始時刻、高値、安値を読み込んで、シンボルごとのローソク足を先頭からそろえて並べた
+        (シンボル × 本数)の開始時刻(int64(ns))、高値、安値の2次元配列と、シンボルごとのローソク足の数を返す関数
+        ローソク足の数が最も多いシンボルに合わせて、足りない後ろの位置の高値と安値はNaNにする
+        """
+        klines = [
+            storage.open_storage(path).read(columns=['開始時刻', '高値', '安値'])
+            for path in paths
+        ]
+        lengths = np.array([len(klines_df) for klines_df in klines], dtype=np.int64)
+        total_data_count = int(lengths.max()) if lengths.size else 0
+
+        start_time = np.zeros((len(klines), total_data_count), dtype=np.int64)
+        high = np.full((len(klines), total_data_count), np.nan)
+        low = np.full((len(klines), total_data_count), np.nan)
+
+        for i, klines_df in enumerate(klines):
+            start_time[i, :lengths[i]] = pd.to_datetime(klines_df['開始時刻']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+            high[i, :lengths[i]] = klines_df['高値'].to_numpy(dtype=np.float64)
+            low[i, :lengths[i]] = klines_df['安値'].to_numpy(dtype=np.float64)
+
+        return start_time, high, low, lengths
+
+    def run(
+            self,
+            paths: list[Path],
+        ) -> dict[Path, pd.DataFrame]:
+        """
+        pathごとのローソク足をまとめて分析して、{path: Dowのdfと同じ分析結果のDataFrame}を返す関数
+        """
+        start_time, high, low, lengths = self.load(paths=paths)
+        records = self.analysis_batch(start_time=start_time, high=high, low=low, lengths=lengths)
+
+        return {
+            Path(path): swings.to_frame()
+            for path, swings in zip(paths, records)
+        }
+
+    def analysis_batch(
+            self,
+            #(シンボル × 本数)の開始時刻(int64(ns))、高値、安値の2次元配列(シンボルごとに先頭からそろえる)
+            start_time: np.ndarray,
+            high: np.ndarray,
+            low: np.ndarray,
+            #シンボルごとのローソク足の数。Noneの場合はすべてのシンボルが同じ本数
+            lengths: np.ndarray | None = None,
+        ) -> list[SwingRecords]:
+        """
+        (シンボル × 本数)の高値と安値から、すべてのシンボルのスイングハイ、スイングロウを
+        スライディングウィンドウでまとめて判定し、連続するスイングをまとめてからシンボルごとに
+        トレンドを判定したSwingRecordsのリストを返す関数
+        """
+        is_swing_high, is_swing_low = self.detect_swings(
+                                        high=high,
+                                        low=low,
+                                        period=self.period,
+                                        lengths=lengths
+                                    )
+        #ローソク足の数に足りない後ろの位置はスイングにしない
+        if lengths is not None:
+            is_valid = np.arange(high.shape[-1]) < lengths[:, np.newaxis]
+            is_swing_high &= is_valid
+            is_swing_low &= is_valid
+
+        #スイングの(シンボル, 時刻)の位置を行ごとに時刻の順に並べる
+        symbol_index, time_index = np.nonzero(is_swing_high | is_swing_low)
+        is_high = is_swing_high[symbol_index, time_index]
+        highs = high[symbol_index, time_index]
+        lows = low[symbol_index, time_index]
+
+        keep = self.merge_swings_batch(
+            symbol_index=symbol_index,
+            is_high=is_high,
+            highs=highs,
+            lows=lows
+        )
+        symbol_index = symbol_index[keep]
+        time_index = time_index[keep]
+        is_high = is_high[keep]
+
+        #シンボルごとのスイングの範囲
+        bounds = np.searchsorted(symbol_index, np.arange(high.shape[0] + 1))
+        records = []
+
+        for symbol in range(high.shape[0]):
+            swing_range = slice(bounds[symbol], bounds[symbol + 1])
+            swing_time_index = time_index[swing_range]
+            swing_is_high = is_high[swing_range]
+
+            swings = SwingRecords(
+                start_time=start_time[symbol, swing_time_index],
+                category=np.where(swing_is_high, 0, 1).astype(np.int8),
+                high=np.where(swing_is_high, high[symbol, swing_time_index], np.nan),
+                low=np.where(swing_is_high, np.nan, low[symbol, swing_time_index]),
+            )
+            swings.trend, swings.conversion_value, swings.target_value = evaluate_trend(
+                category=swings.category,
+                high=swings.high,
+                low=swings.low
+            )
+            records.append(swings)
+
+        return records
+
+
+#memmapのローソク足のアーカイブ(MemmapStorage)を一定の本数ずつ読み込んで分析するダウ理論
+#長い期間のローソク足をすべてDataFrameにせずに、メモリの使用量をchunk_rows本分に抑える
+class ArchiveDow(Dow):
+
+    def __init__(
+            self,
+            #ローソク足のアーカイブのpath(data/(通貨名)/(ローソク足の時間).bin)
+            PATH: Path,
+            #分析する開始時刻の範囲。Noneの場合は最初(最後)まで
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+            #一度に読み込んで分析するローソク足の数
+            chunk_rows: int = 1_000_000,
+            #検証する左右の期間数
+            period: int = Dow.PERIOD,
+        ) -> None:
+        #分析結果の保存は行わずに、アーカイブのローソク足からスイングとトレンドだけを計算する
+        self.period = period
+        self.chunk_rows = chunk_rows
+        self.archive = storage.MemmapStorage(path=PATH)
+
+        self.swings = self.analysis_archive(start=start, end=end)
+        self.swings.trend, self.swings.conversion_value, self.swings.target_value = evaluate_trend(
+            category=self.swings.category,
+            high=self.swings.high,
+            low=self.swings.low
+        )
+
+        #現在の相場を分析結果から取得
+        self.trend = self.swings[-1]['トレンド'] if len(self.swings) > 0 else np.nan
+
+    def analysis_archive(
+            self,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+        ) -> SwingRecords:
+        """
+        アーカイブの開始時刻の範囲のローソク足をchunk_rows本ずつ読み込んで、analysis_swingsと同じ
+        スイングハイ、スイングロウをSwingRecordsで返す関数
+        左右の期間を検証できるように前後のperiod本を重ねて読み込み、連続するスイングは
+        まだ入れ替わる可能性がある最後の1つだけを次の読み込みに持ち越してまとめる
+        """
+        records = self.archive.records(start=start, end=end)
+        total_data_count = records.shape[0]
+
+        #確定したスイングの[開始時刻, スイングハイかどうか, 高値, 安値]の配列のリスト
+        parts = []
+        carry = [
+            np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=bool),
+            np.empty(0, dtype=np.float64),
+            np.empty(0, dtype=np.float64),
+        ]
+
+        for chunk_start in range(0, total_data_count, self.chunk_rows):
+            chunk_end = min(chunk_start + self.chunk_rows, total_data_count)
+            read_start = max(chunk_start - self.period, 0)
+            read_end = min(chunk_end + self.period, total_data_count)
+
+            chunk = records[read_start:read_end]
+            high = np.asarray(chunk['高値'], dtype=np.float64)
+            low = np.asarray(chunk['安値'], dtype=np.float64)
+
+            is_swing_high, is_swing_low = self.detect_swings(
+                                            high=high,
+                                            low=low,
+                                            period=self.period
+                                        )
+
+            #重ねて読み込んだ前後のローソク足は隣の読み込みで検証する
+            swing_index = np.flatnonzero(
+                (is_swing_high | is_swing_low)[chunk_start - read_start:chunk_end - read_start]
+            ) + chunk_start - read_start
+
+            swings = [
+                np.concatenate([carry[0], np.asarray(chunk['開始時刻'][swing_index]).view(np.int64)]),
+                np.concatenate([carry[1], is_swing_high[swing_index]]),
+                np.concatenate([carry[2], high[swing_index]]),
+                np.concatenate([carry[3], low[swing_index]]),
+            ]
+            keep = self.merge_swings_batch(
+                symbol_index=np.zeros(swings[1].size, dtype=np.int64),
+                is_high=swings[1],
+                highs=swings[2],
+                lows=swings[3]
+            )
+
+            parts.append([values[keep[:-1]] for values in swings])
+            carry = [values[keep[-1:]] for values in swings]
+
+        parts.append(carry)
+        start_time, is_high, high, low = [
+            np.concatenate([part[i] for part in parts]) for i in range(4)
+        ]
+
+        return SwingRecords(
+            start_time=start_time,
+            category=np.where(is_high, 0, 1).astype(np.int8),
+            high=np.where(is_high, high, np.nan),
+            low=np.where(is_high, np.nan, low),
+        )
@@ -0,0 +1,250 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+import analysis
+import storage
+
+
+class Backtester():
+    """
+    保存されたローソク足を1本ずつ再生してダウ理論のトレンドで売買をシミュレーションするクラス
+    スイングは右側のperiod本がそろった時点で確定させるため、未来のデータは使わない
+    上昇トレンドでは買い、下降トレンドでは売りのポジションを持ち、転換値を損切りに使う
+    """
+
+    TRADE_COLUMNS = ['エントリー時刻', '決済時刻', '売買', 'エントリー価格', '決済価格', '手数料', '損益', '決済理由']
+
+    def __init__(
+            self,
+            #スイングを検証する左右の期間数
+            period: int = analysis.Dow.PERIOD,
+            #約定金額に対する片道の手数料率
+            fee: float = 0.00055,
+            #約定価格に対して不利な方向に滑る割合
+            slippage: float = 0.0001,
+            #エントリーの条件
+            #'trend': トレンドが発生した次のローソク足の始値でエントリーする
+            #'breakout': トレンド中に直近目標値を超えたときにエントリーする
+            entry: str = 'trend',
+            #下降トレンドで売りのポジションを持つかどうか
+            allow_short: bool = True,
+            #1回の取引の数量
+            quantity: float = 1.0,
+        ) -> None:
+        super().__init__()
+
+        if entry not in ('trend', 'breakout'):
+            raise ValueError(f'対応していないエントリー条件です: {entry}')
+
+        self.period = period
+        self.fee = fee
+        self.slippage = slippage
+        self.entry = entry
+        self.allow_short = allow_short
+        self.quantity = quantity
+
+        #直近のシミュレーション結果
+        self.trades = pd.DataFrame(columns=self.TRADE_COLUMNS)
+        self.equity = pd.DataFrame(columns=['開始時刻', '損益'])
+
+    def load(
+            self,
+            #ローソク足のデータのpath
+            PATH: Path,
+            start: str | None = None,
+            end: str | None = None,
+        ) -> dict:
+        """
+        ストレージに保存されたローソク足(コールドストレージも含む)を読み込んでシミュレーションする関数
+        """
+        klines_df = storage.open_storage(PATH).read_all(start=start, end=end)
+
+        return self.run(klines_df=klines_df)
+
+    def run(
+            self,
+            #開始時刻の昇順に並んだローソク足のDataFrame
+            klines_df: pd.DataFrame,
+        ) -> dict:
+        """
+        ローソク足を1本ずつ再生して売買をシミュレーションし、損益、最大ドローダウン、勝率などを返す関数
+        取引の履歴はself.trades、ローソク足ごとの損益はself.equityに入れる
+        """
+        return self.run_arrays(
+            start_time=klines_df['開始時刻'].to_numpy(),
+            open_prices=klines_df['始値'].to_numpy(dtype=np.float64),
+            high=klines_df['高値'].to_numpy(dtype=np.float64),
+            low=klines_df['安値'].to_numpy(dtype=np.float64),
+            close=klines_df['終値'].to_numpy(dtype=np.float64),
+        )
+
+    def run_archive(
+            self,
+            #ローソク足のアーカイブ(MemmapStorage)
+            archive: storage.MemmapStorage,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+        ) -> dict:
+        """
+        アーカイブの開始時刻の範囲のローソク足を、ファイルをメモリにマップしたまま
+        run_arraysに渡してシミュレーションする関数
+        """
+        records = archive.records(start=start, end=end)
+
+        return self.run_arrays(
+            start_time=records['開始時刻'],
+            open_prices=records['始値'],
+            high=records['高値'],
+            low=records['安値'],
+            close=records['終値'],
+        )
+
+    def run_arrays(
+            self,
+            start_time: np.ndarray,
+            open_prices: np.ndarray,
+            high: np.ndarray,
+            low: np.ndarray,
+            close: np.ndarray,
+        ) -> dict:
+        """
+        開始時刻、始値、高値、安値、終値の配列でrunと同じシミュレーションをする関数
+        共有メモリやmemmapの配列をコピーせずにそのまま渡せる
+        """
+        total_data_count = close.size
+
+        dow = analysis.IncrementalDow(period=self.period)
+        is_swing_high, is_swing_low = dow.detect_swings(
+                                        high=high,
+                                        low=low,
+                                        period=self.period
+                                    )
+
+        trades = []
+        equity = np.zeros(total_data_count)
+        realized = 0.0
+
+        #ポジションの向き(1: 買い、-1: 売り、0: なし)とエントリー時の情報
+        position = 0
+        entry_price = np.nan
+        entry_fee = 0.0
+        entry_index = 0
+        #次のローソク足の始値で実行する注文(1: 買い、-1: 売り、0: 決済)
+        pending = None
+        previous_trend = np.nan
+
+        def fill(price: float, side: int) -> float:
+            #買いは高く、売りは安く約定させる
+            return price * (1 + self.slippage * side)
+
+        def close_position(index: int, price: float, reason: str) -> None:
+            nonlocal position, realized
+            exit_price = fill(price, -position)
+            exit_fee = exit_price * self.quantity * self.fee
+            pnl = (exit_price - entry_price) * position * self.quantity - entry_fee - exit_fee
+            realized += pnl
+            trades.append([
+                start_time[entry_index],
+                start_time[index],
+                '買い' if position == 1 else '売り',
+                entry_price,
+                exit_price,
+                entry_fee + exit_fee,
+                pnl,
+                reason,
+            ])
+            position = 0
+
+        def open_position(index: int, price: float, side: int) -> None:
+            nonlocal position, entry_price, entry_fee, entry_index
+            position = side
+            entry_price = fill(price, side)
+            entry_fee = entry_price * self.quantity * self.fee
+            entry_index = index
+
+        for i in range(total_data_count):
+            #前のローソク足の終値までで決まった注文を始値で実行する
+            if pending is not None:
+                if position != 0:
+                    close_position(i, open_prices[i], 'トレンド終了')
+                if pending != 0:
+                    open_position(i, open_prices[i], pending)
+                pending = None
+
+            conversion_value = dow.conversion_value
+            target_value = dow.target_value
+
+            #転換値を超えた場合は損切りする(始値で超えている場合は始値で約定)
+            if position == 1 and low[i] <= conversion_value:
+                close_position(i, min(open_prices[i], conversion_value), '転換値')
+            elif position == -1 and high[i] >= conversion_value:
+                close_position(i, max(open_prices[i], conversion_value), '転換値')
+
+            #トレンド中に直近目標値を超えた場合にエントリーする
+            elif position == 0 and self.entry == 'breakout':
+                if dow.trend == '上昇' and high[i] >= target_value:
+                    open_position(i, max(open_prices[i], target_value), 1)
+                elif self.allow_short and dow.trend == '下降' and low[i] <= target_value:
+                    open_position(i, min(open_prices[i], target_value), -1)
+
+            #このローソク足で右側の期間がそろったスイングを確定させる
+            swing_index = i - self.period
+            if swing_index >= 0 and (is_swing_high[swing_index] or is_swing_low[swing_index]):
+                dow.push_swing(swing=[
+                    start_time[swing_index],
+                    'スイングハイ' if is_swing_high[swing_index] else 'スイングロウ',
+                    high[swing_index] if is_swing_high[swing_index] else None,
+                    low[swing_index] if is_swing_low[swing_index] else None,
+                    None,
+                    None,
+                    None,
+                ])
+
+            trend = dow.trend
+            #保有しているポジションとトレンドの向きが合わなくなった場合は次の始値で決済する
+            if (position == 1 and trend != '上昇') or (position == -1 and trend != '下降'):
+                pending = 0
+
+            #トレンドが発生した場合は次の始値でエントリーする
+            if self.entry == 'trend' and trend != previous_trend and (position == 0 or pending == 0):
+                if trend == '上昇':
+                    pending = 1
+                elif self.allow_short and trend == '下降':
+                    pending = -1
+
+            previous_trend = trend if isinstance(trend, str) else np.nan
+            equity[i] = realized + (
+                (fill(close[i], -position) - entry_price) * position * self.quantity - entry_fee
+                if position != 0 else 0.0
+            )
+
+        #最後まで保有しているポジションは最後の終値で決済する
+        if position != 0:
+            close_position(total_data_count - 1, close[-1], '期間終了')
+            equity[-1] = realized
+
+        self.trades = pd.DataFrame(trades, columns=self.TRADE_COLUMNS)
+        self.equity = pd.DataFrame({'開始時刻': start_time, '損益': equity})
+
+        return self.summary()
+
+    def summary(self) -> dict:
+        """
+        直近のシミュレーション結果から損益、最大ドローダウン、取引回数、勝率などを返す関数
+        """
+        equity = self.equity['損益'].to_numpy(dtype=np.float64)
+        pnl = self.trades['損益'].to_numpy(dtype=np.float64)
+
+        #損益の最高値からの下落幅の最大値
+        max_drawdown = float(np.max(np.maximum.accumulate(np.r_[0.0, equity]) - np.r_[0.0, equity])) if equity.size else 0.0
+
+        return {
+            'pnl': float(pnl.sum()),
+            'max_drawdown': max_drawdown,
+            'trade_count': int(pnl.size),
+            'win_rate': float((pnl > 0).mean()) if pnl.size else np.nan,
+            'fee': float(self.trades['手数料'].sum()),
+            'profit_factor': float(pnl[pnl > 0].sum() / -pnl[pnl < 0].sum()) if (pnl < 0).any() else np.nan,
+        }
@@ -0,0 +1,367 @@
+import argparse
+import gc
+import json
+import numpy as np
+import os
+import pandas as pd
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import analysis
+import scrape
+import storage
+
+#計測するデータの行数
+SIZES = {
+    '1k': 1_000,
+    '100k': 100_000,
+    '10m': 10_000_000,
+}
+#作成するローソク足の値動き
+SHAPES = ['random_walk', 'trending', 'ranging']
+#計測する処理
+CASES = ['analysis_dow', 'pretreatment_df', 'trend_loop', 'save_csv', 'get_kline']
+#読み込む時間を計測するモジュール
+IMPORTS = ['main', 'analysis', 'visualization']
+#計測したマシンの速さの違いを除くため、読み込む時間はこのモジュールを読み込む時間との比で基準と比べる
+REFERENCE_IMPORT = 'pandas'
+#CASESの時間はreference_workloadの時間との比で基準と比べる
+REFERENCE_CASE = 'reference'
+#IMPORTSのモジュールを読み込んだだけでは読み込まれてはいけない(使うときに読み込む)モジュール
+LAZY_MODULES = ['matplotlib', 'mplfinance', 'requests']
+#基準の計測結果を保存するpath
+BASELINE_PATH = Path(__file__).resolve().parent / 'benchmark_baseline.json'
+
+
+def generate_klines(
+        #'random_walk'、'trending'、'ranging'のいずれか
+        shape: str,
+        rows: int,
+        seed: int = 0,
+    ) -> pd.DataFrame:
+    """
+    1分足のローソク足のDataFrameを乱数で作成して返す関数
+    random_walkは平均0の変化、trendingは一方向に偏った変化、rangingは一定の価格に戻る変化で終値を作る
+    """
+    rng = np.random.default_rng(seed)
+    change = rng.normal(0, 50, rows)
+
+    match shape:
+        case 'random_walk':
+            close = 100000 + np.cumsum(change)
+        case 'trending':
+            close = 100000 + np.cumsum(change + 5)
+        case 'ranging':
+            #変化を指数平滑して、100000の周りを上下する値動きにする
+            close = 100000 + pd.Series(change).ewm(alpha=0.02).mean().to_numpy() * 50
+        case _:
+            raise ValueError(f'対応していない値動きです: {shape}')
+
+    #取引所の価格と同じように0.1刻みにして、同じ高値や安値がある場合も計測する
+    close = np.round(close, 1)
+    open_prices = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_prices, close) + np.round(np.abs(rng.normal(0, 20, rows)), 1)
+    low = np.minimum(open_prices, close) - np.round(np.abs(rng.normal(0, 20, rows)), 1)
+    volume = np.round(np.abs(rng.normal(10, 3, rows)), 3)
+
+    return pd.DataFrame({
+        '開始時刻': pd.date_range('2025-01-01', periods=rows, freq='min'),
+        '始値': open_prices,
+        '高値': high,
+        '安値': low,
+        '終値': close,
+        '取引量': volume,
+        '取引総額': volume * close,
+    })
+
+
+def reference_workload() -> None:
+    """
+    マシンの速さを測るために、CASESと同じくnumpyとpandasを使う決まった処理を行う関数
+    """
+    rng = np.random.default_rng(0)
+    values = pd.Series(rng.normal(0, 1, 200_000))
+    values.rolling(window=11, center=True).max()
+    np.sort(values.to_numpy())
+    #save_csvやget_klineと同じく文字列との変換も含める
+    values.iloc[:20_000].astype(str).astype(float)
+
+
+class StubResponse():
+    """
+    apiのレスポンスの代わりに、渡されたjsonの本文を返すクラス
+    """
+
+    def __init__(
+            self,
+            content: bytes,
+        ) -> None:
+        super().__init__()
+
+        self.content = content
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> dict:
+        return json.loads(self.content)
+
+
+class StubSession():
+    """
+    ネットワークに接続せずに、apiと同じ形式(新しい順の文字列のリスト)のローソク足のjsonを返すセッション
+    get_klineのjsonの変換とDataFrameへの変換だけを計測するために使う
+    """
+
+    def __init__(
+            self,
+            klines_df: pd.DataFrame,
+        ) -> None:
+        super().__init__()
+
+        start_time = klines_df['開始時刻'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+        values = klines_df[scrape.ScrapeMarketData.COLUMNS[1:]].to_numpy()
+
+        data = np.column_stack([start_time.astype(str), values.astype(str)])[::-1].tolist()
+        self.content = json.dumps(
+            {'retCode': 0, 'retMsg': 'OK', 'result': {'list': data}}
+        ).encode()
+
+    def get(
+            self,
+            url: str,
+            params: dict | None = None,
+        ) -> StubResponse:
+        return StubResponse(content=self.content)
+
+
+def measure(
+        func,
+        #時間を計測する回数(最も短い時間を使う)
+        repeat: int,
+    ) -> dict:
+    """
+    funcを実行して、経過時間(秒)とtracemallocで計測したメモリのピーク(MB)を返す関数
+    tracemallocは処理を遅くするため、時間とメモリは別々に計測する
+    最初の実行は使うときに読み込むモジュールやキャッシュの準備を含むため計測しない
+    timeitと同じく、前の処理で作られたオブジェクトのガベージコレクションが時間に入らないように止めて計測する
+    """
+    func()
+
+    wall_times = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            started_at = time.perf_counter()
+            func()
+            wall_times.append(time.perf_counter() - started_at)
+        finally:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_time': min(wall_times),
+        'peak_memory': peak / 1024 / 1024,
+    }
+
+
+def run_cases(
+        shape: str,
+        size: str,
+        repeat: int,
+    ) -> dict:
+    """
+    1つの値動きと行数のローソク足で、CASESの処理をそれぞれ計測した結果を返す関数
+    保存先のdataとanalysisは一時ディレクトリに作成する
+    """
+    klines_df = generate_klines(shape=shape, rows=SIZES[size])
+    retention = storage.RetentionPolicy()
+    results = {}
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            dow = analysis.Dow(
+                PATH=Path('data', 'BENCH-linear', '1MinutesKlines.csv'),
+                backtest=True,
+                retention=retention,
+                klines_df=klines_df
+            )
+            analysis_trend_df = dow.analysis_dow_vectorized(period=dow.period)
+            swings = dow.analysis_swings(period=dow.period)
+
+            scraper = scrape.ScrapeMarketData(
+                symbol='BENCH',
+                backtest=True,
+                session=StubSession(klines_df=klines_df),
+                retention=retention
+            )
+
+            cases = {
+                'analysis_dow': lambda: dow.analysis_dow(period=dow.period),
+                'pretreatment_df': lambda: dow.pretreatment_df(target_df=analysis_trend_df),
+                'trend_loop': lambda: analysis.evaluate_trend(
+                    category=swings.category,
+                    high=swings.high,
+                    low=swings.low
+                ),
+                'save_csv': lambda: scraper.save_csv(df=klines_df),
+                'get_kline': lambda: scraper.get_kline(start=0, end=0, limit=SIZES[size]),
+            }
+
+            for case, func in cases.items():
+                results[f'{case}/{shape}/{size}'] = measure(func=func, repeat=repeat)
+
+        finally:
+            os.chdir(cwd)
+
+    return results
+
+
+def measure_import(
+        module: str,
+        repeat: int,
+    ) -> dict:
+    """
+    新しいPythonのプロセスでmoduleを読み込む時間(秒)とtracemallocで計測したメモリのピーク(MB)、
+    読み込まれたLAZY_MODULESのリストを返す関数
+    同じプロセスでは2回目以降の読み込みが計測できないため、毎回プロセスを起動する
+    measureと同じく、時間とメモリは別々のプロセスで計測し、最初のプロセスはファイルの読み込みのキャッシュを
+    準備するため計測しない
+    """
+    def run(trace: bool) -> dict:
+        script = (
+            'import json, sys, time, tracemalloc\n'
+            f'if {trace}: tracemalloc.start()\n'
+            'started_at = time.perf_counter()\n'
+            f'import {module}\n'
+            'wall_time = time.perf_counter() - started_at\n'
+            '_, peak = tracemalloc.get_traced_memory()\n'
+            f'print(json.dumps({{"wall_time": wall_time, "peak": peak, '
+            f'"loaded": [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))\n'
+        )
+        completed = subprocess.run(
+            [sys.executable, '-c', script],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+
+        return json.loads(completed.stdout.splitlines()[-1])
+
+    run(trace=False)
+    results = [run(trace=False) for _ in range(repeat)]
+    traced = run(trace=True)
+
+    return {
+        'wall_time': min(result['wall_time'] for result in results),
+        'peak_memory': traced['peak'] / 1024 / 1024,
+        'loaded': results[0]['loaded'],
+    }
+
+
+def compare(
+        results: dict,
+        baseline: dict,
+        #基準からの増加をこの割合まで許容する
+        tolerance: float,
+        #これより短い時間は誤差が大きいため比較しない(秒)
+        min_wall_time: float = 0.05,
+    ) -> list[str]:
+    """
+    計測結果を基準と比べて、経過時間かメモリのピークが許容範囲を超えて増えた処理のメッセージのリストを返す関数
+    経過時間は同じ実行で計測したREFERENCE_IMPORTかREFERENCE_CASEとの比で比べるため、
+    基準を計測したマシンと速さが違っても結果が変わらない(どちらかにない場合は比べない)
+    読み込まれてはいけないモジュールは基準によらず常に報告する
+    """
+    regressions = []
+
+    for key, result in results.items():
+        if result.get('loaded'):
+            regressions.append(f'{key} 読み込まれてはいけないモジュール: {", ".join(result["loaded"])}')
+
+        if key not in baseline:
+            continue
+
+        reference = f'import/{REFERENCE_IMPORT}' if key.startswith('import/') else REFERENCE_CASE
+
+        for metric, unit in [('wall_time', 's'), ('peak_memory', 'MB')]:
+            limit = baseline[key][metric] * (1 + tolerance)
+            if metric == 'wall_time':
+                if result[metric] < min_wall_time or key == reference:
+                    continue
+                if reference not in results or reference not in baseline:
+                    continue
+
+                #基準の時間をこの実行のマシンの速さに合わせる
+                limit *= results[reference][metric] / baseline[reference][metric]
+
+            if result[metric] > limit:
+                regressions.append(
+                    f'{key} {metric}: {result[metric]:.4f}{unit} > {limit:.4f}{unit} '
+                    f'(基準 {baseline[key][metric]:.4f}{unit})'
+                )
+
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    """
+    ベンチマークを実行して結果を表示し、基準より遅くなった処理がある場合は1を返す関数
+    """
+    parser = argparse.ArgumentParser(description='スクレイピングから分析までの処理のベンチマーク')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['1k', '100k'])
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=SHAPES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true', help='計測結果を基準として保存する')
+    parser.add_argument('--skip-imports', action='store_true', help='モジュールの読み込み時間を計測しない')
+    args = parser.parse_args(argv)
+
+    results = {}
+    if not args.skip_imports:
+        for module in [REFERENCE_IMPORT, *IMPORTS]:
+            results[f'import/{module}'] = measure_import(module=module, repeat=args.repeat)
+
+    #ほかの処理の時間を割る値のため、repeatが少ない場合も3回以上計測して誤差を減らす
+    results[REFERENCE_CASE] = measure(func=reference_workload, repeat=max(args.repeat, 3))
+    for size in args.sizes:
+        for shape in args.shapes:
+            results.update(run_cases(shape=shape, size=size, repeat=args.repeat))
+
+    for key, result in results.items():
+        print(f'{key:<40} {result["wall_time"] * 1000:>12.2f} ms {result["peak_memory"]:>10.2f} MB')
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+
+    if args.update_baseline:
+        baseline.update({
+            key: {metric: result[metric] for metric in ['wall_time', 'peak_memory']}
+            for key, result in results.items()
+        })
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+        return 0
+
+    regressions = compare(results=results, baseline=baseline, tolerance=args.tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
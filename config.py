@@ -1,6 +1,31 @@
-from dotenv import load_dotenv
-load_dotenv()
-
 import os
+from pathlib import Path
+
+#python-dotenvは読み込みに時間がかかるため、このファイルのディレクトリか親のディレクトリに.envがある場合だけ読み込む
+if any((directory / '.env').is_file() for directory in Path(__file__).resolve().parents):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 APIKEY = os.getenv('APIKEY')
+
+
+#シンボルとローソク足の時間ごとに保存しておくデータの量
+#{(シンボル, interval): {'rows': 残す行数, 'days': 残す日数, 'cold': 古いデータを別のファイルに残すかどうか, 'slack': 整理するまでに増やせる行数}}
+#rowsとdaysがどちらもない場合はすべてのデータを残す
+RETENTION = {}
+#RETENTIONに登録されていない場合の保存期間
+DEFAULT_RETENTION = {'rows': 200}
+
+#スケジューラーで監視する(カテゴリー, シンボル, ローソク足の時間)のリスト
+WATCHLIST = [
+    ('linear', 'BTCUSDT', '1'),
+    ('linear', 'BTCUSDT', '60'),
+]
+
+#読み込んだローソク足や分析結果のDataFrameをメモリにキャッシュしておく上限(byte)
+FRAME_CACHE_BYTES = int(os.getenv('FRAME_CACHE_BYTES', 256 * 1024 * 1024))
+
+#1回の実行だけプロファイルを取るときに設定する('cprofile'、'tracemalloc'をカンマ区切りで指定)
+PROFILE = os.getenv('PROFILE', '')
+#cProfileの結果を保存するディレクトリ
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profile')
@@ -1,29 +1,16 @@
 import config
-import datetime
-import scrape
-import time
+import metrics
+import scheduler
 
 APIKEY = config.APIKEY
 
-def transform_timestamp(
-        year: int,
-        month: int,
-        day: int
-    ) -> float:
-    #指定した日付のdateオブジェクト
-    date = datetime.date(year, month, day)
-
-    #combineメソッドでdatetimeオブジェクトに変換してtimestampを返す
-    #単位がsecondなのでmsに変換
-    return datetime.datetime.combine(date, datetime.time()).timestamp() * 1000
-
-#テスト用データ
-start = transform_timestamp(2025, 5, 1)
-end = transform_timestamp(2025, 5, 20)
-
 if __name__ == '__main__':
-    one_BTC = scrape.ScrapeMarketData()
-    one_BTC.get_kline(
-        start=start,
-        end=end
-        )
\ No newline at end of file
+    #configのウォッチリストのローソク足が確定するたびに取得と分析を行う
+    #Ctrl+C(SIGINT)かSIGTERMで実行中の処理が終わってから止まる
+    #環境変数PROFILEを設定した場合はcProfileやtracemallocで計測する
+    trade_scheduler = scheduler.Scheduler(watchlist=config.WATCHLIST)
+    with metrics.profile('main'):
+        trade_scheduler.run()
+
+    for job, job_metrics in trade_scheduler.job_metrics().items():
+        print(job, job_metrics)
@@ -0,0 +1,360 @@
+from collections import deque
+from contextlib import contextmanager
+import cProfile
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import threading
+import time
+import tracemalloc
+
+import config
+
+logger = logging.getLogger('auto_trade.metrics')
+
+
+class MetricsSink():
+    """
+    処理時間(スパン)とカウンターを受け取るクラスの基底クラス
+    何も記録しないため、計測を止めたいときにそのまま使える
+    """
+
+    def record_span(
+            self,
+            name: str,
+            #処理時間(秒)
+            seconds: float,
+            labels: dict,
+        ) -> None:
+        pass
+
+    def increment(
+            self,
+            name: str,
+            value: float,
+            labels: dict,
+        ) -> None:
+        pass
+
+    def flush(self) -> None:
+        """
+        ためている計測結果を書き出す関数
+        """
+        pass
+
+
+class InMemorySink(MetricsSink):
+    """
+    計測結果をメモリに記録して、summaryで集計できるようにするクラス
+    """
+
+    def __init__(
+            self,
+            #スパンごとに記録しておく処理時間の数
+            history: int = 1000,
+        ) -> None:
+        super().__init__()
+
+        self.history = history
+        #{(名前, ラベルのタプル): 処理時間(秒)のdeque}
+        self.spans = {}
+        #{(名前, ラベルのタプル): 値}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def record_span(
+            self,
+            name: str,
+            seconds: float,
+            labels: dict,
+        ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.spans:
+                self.spans[key] = deque(maxlen=self.history)
+            self.spans[key].append(seconds)
+
+    def increment(
+            self,
+            name: str,
+            value: float,
+            labels: dict,
+        ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def summary(self) -> dict:
+        """
+        スパンごとの件数、平均、95パーセンタイル、最大値(ms)とカウンターの値を返す関数
+        """
+        with self.lock:
+            spans = {key: np.array(seconds) * 1000 for key, seconds in self.spans.items()}
+            counters = dict(self.counters)
+
+        return {
+            'spans': {
+                key: {
+                    'count': int(latencies.size),
+                    'mean': float(latencies.mean()),
+                    'p95': float(np.percentile(latencies, 95)),
+                    'max': float(latencies.max()),
+                }
+                for key, latencies in spans.items()
+            },
+            'counters': counters,
+        }
+
+    def reset(self) -> None:
+        """
+        記録した計測結果を削除する関数
+        """
+        with self.lock:
+            self.spans.clear()
+            self.counters.clear()
+
+
+class LoggingSink(MetricsSink):
+    """
+    計測結果を1件ずつloggingに出力するクラス
+    """
+
+    def __init__(
+            self,
+            level: int = logging.INFO,
+            target_logger: logging.Logger | None = None,
+        ) -> None:
+        super().__init__()
+
+        self.level = level
+        self.logger = target_logger if target_logger is not None else logger
+
+    def record_span(
+            self,
+            name: str,
+            seconds: float,
+            labels: dict,
+        ) -> None:
+        self.logger.log(self.level, '%s %.2fms %s', name, seconds * 1000, labels)
+
+    def increment(
+            self,
+            name: str,
+            value: float,
+            labels: dict,
+        ) -> None:
+        self.logger.log(self.level, '%s +%s %s', name, value, labels)
+
+
+class PrometheusTextSink(InMemorySink):
+    """
+    計測結果をPrometheusのnode_exporterのtextfile collectorで読めるテキスト形式でファイルに書き出すクラス
+    スパンは合計時間と件数を1つのsummary、カウンターは累計値をcounterとして書き出す
+    """
+
+    #書き出すメトリクスの名前の先頭につける文字列
+    PREFIX = 'auto_trade_'
+
+    def __init__(
+            self,
+            #書き出すファイルのpath(.promの拡張子にする)
+            path: Path,
+            #この秒数ごとに記録のたびにファイルを書き直す
+            flush_interval: float = 10.0,
+        ) -> None:
+        super().__init__(history=1)
+
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.flushed_at = time.monotonic()
+        #{(名前, ラベルのタプル): [合計時間(秒), 件数]}
+        self.totals = {}
+
+    def record_span(
+            self,
+            name: str,
+            seconds: float,
+            labels: dict,
+        ) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            total = self.totals.setdefault(key, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+        self.flush_if_due()
+
+    def increment(
+            self,
+            name: str,
+            value: float,
+            labels: dict,
+        ) -> None:
+        super().increment(name=name, value=value, labels=labels)
+
+        self.flush_if_due()
+
+    def reset(self) -> None:
+        super().reset()
+        with self.lock:
+            self.totals.clear()
+
+    def flush_if_due(self) -> None:
+        """
+        前回書き出してからflush_interval秒以上たっている場合にファイルを書き直す関数
+        """
+        if time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        すべての計測結果をファイルに書き出す関数
+        途中まで書いたファイルを読まれないように、一時ファイルに書いてから置き換える
+        """
+        with self.lock:
+            totals = {key: list(total) for key, total in self.totals.items()}
+            counters = dict(self.counters)
+            self.flushed_at = time.monotonic()
+
+        lines = []
+
+        #スパンは合計時間と件数を1つのsummaryとして書き出す
+        families = {}
+        for (name, labels), total in sorted(totals.items()):
+            families.setdefault(self.PREFIX + name.replace('.', '_') + '_seconds', []).append((labels, total))
+        for metric, samples in families.items():
+            lines.append(f'# TYPE {metric} summary')
+            for labels, total in samples:
+                lines.append(f'{metric}_sum{self.format_labels(labels=labels)} {total[0]}')
+                lines.append(f'{metric}_count{self.format_labels(labels=labels)} {total[1]}')
+
+        families = {}
+        for (name, labels), value in sorted(counters.items()):
+            families.setdefault(self.PREFIX + name.replace('.', '_') + '_total', []).append((labels, value))
+        for metric, samples in families.items():
+            lines.append(f'# TYPE {metric} counter')
+            for labels, value in samples:
+                lines.append(f'{metric}{self.format_labels(labels=labels)} {value}')
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        temporary_path.write_text('\n'.join(lines) + '\n')
+        temporary_path.replace(self.path)
+
+    @staticmethod
+    def format_labels(
+            #(ラベル名, 値)のタプル
+            labels: tuple,
+        ) -> str:
+        """
+        ラベルを{key="value",...}の形式の文字列にして返す関数
+        値のバックスラッシュ、ダブルクォート、改行はテキスト形式の決まりに従ってエスケープする
+        """
+        label_texts = []
+        for key, value in labels:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            label_texts.append(f'{key}="{value}"')
+
+        return '{' + ','.join(label_texts) + '}'
+
+
+#計測結果を送る先(set_sinkで差し替える)
+_sink = InMemorySink()
+
+
+def set_sink(
+        sink: MetricsSink,
+    ) -> MetricsSink:
+    """
+    計測結果を送る先を差し替えて、前の送り先を返す関数
+    """
+    global _sink
+    previous, _sink = _sink, sink
+
+    return previous
+
+
+def get_sink() -> MetricsSink:
+    """
+    現在の計測結果の送り先を返す関数
+    """
+    return _sink
+
+
+@contextmanager
+def span(
+        name: str,
+        **labels,
+    ):
+    """
+    withで囲んだ処理の時間を計測して送り先に記録する関数
+    例外で抜けた場合も記録する
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        _sink.record_span(name=name, seconds=time.perf_counter() - started_at, labels=labels)
+
+
+def increment(
+        name: str,
+        value: float = 1,
+        **labels,
+    ) -> None:
+    """
+    カウンターにvalueを足す関数
+    """
+    _sink.increment(name=name, value=value, labels=labels)
+
+
+@contextmanager
+def profile(
+        name: str,
+        #'cprofile'、'tracemalloc'をカンマ区切りで指定する。Noneの場合はconfigのPROFILE(環境変数)
+        mode: str | None = None,
+    ):
+    """
+    withで囲んだ処理をcProfileやtracemallocで計測する関数
+    環境変数PROFILEを設定して実行したときだけ有効になるため、コードを変更せずに1回の実行だけ計測できる
+    cProfileの結果はPROFILE_DIR/(name)-(時刻).profに保存し、tracemallocの結果はメモリを多く確保した行をloggingに出力する
+    """
+    modes = {
+        mode.strip()
+        for mode in (mode if mode is not None else config.PROFILE).split(',')
+        if mode.strip()
+    }
+
+    profiler = cProfile.Profile() if 'cprofile' in modes else None
+    is_tracing = 'tracemalloc' in modes and not tracemalloc.is_tracing()
+
+    if is_tracing:
+        tracemalloc.start()
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            #ほかのスレッドでcProfileが有効になっている場合(Python 3.12以降)は計測しない
+            logger.warning('%s ほかのcProfileが有効なため計測しません', name)
+            profiler = None
+
+    try:
+        yield
+
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            path = Path(config.PROFILE_DIR, f'{name}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.prof')
+            path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(path)
+            logger.info('cProfileの結果を保存しました: %s', path)
+
+        if is_tracing:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            logger.info('%s メモリのピーク: %.2fMB', name, peak / 1024 / 1024)
+            for stat in snapshot.statistics('lineno')[:10]:
+                logger.info('%s %s', name, stat)
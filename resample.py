@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+import storage
+
+#1分足のローソク足から上位の時間足のローソク足を作るクラス
+class KlineResampler():
+
+    COLUMNS = [
+            '開始時刻',
+            '始値',
+            '高値',
+            '安値',
+            '終値',
+            '取引量',
+            '取引総額'
+        ]
+    #作成できる時間足と1本の長さ(ms)
+    INTERVAL_MS = {
+            '5': 5 * 60 * 1000,
+            '15': 15 * 60 * 1000,
+            '60': 60 * 60 * 1000,
+            '240': 240 * 60 * 1000,
+            'D': 24 * 60 * 60 * 1000,
+        }
+    #元データの1分足1本の長さ(ms)
+    SOURCE_MS = 60 * 1000
+
+    def __init__(
+            self,
+            #作成する時間足
+            interval: str = '60',
+            category: str = 'linear',
+            symbol: str = 'BTCUSDT',
+            #保存する形式(csv、parquet、feather、bin)
+            storage_format: str = 'csv',
+            #保存しておくデータの量。Noneの場合はconfigのRETENTIONから決める
+            retention: storage.RetentionPolicy | None = None,
+        ) -> None:
+        super().__init__()
+
+        if interval not in self.INTERVAL_MS:
+            raise ValueError(f'対応していない時間足です: {interval}')
+
+        self.interval = interval
+        self.step = self.INTERVAL_MS[interval]
+
+        #ScrapeMarketDataと同じpathに保存してDowでそのまま分析できるようにする
+        self.PATH = Path(
+            'data',
+            symbol + '-' + category,
+            interval + 'MinutesKlines.' + storage_format
+        )
+        self.storage = storage.open_storage(self.PATH)
+        self.retention = retention if retention is not None else storage.retention_for(
+            symbol=symbol,
+            interval=interval
+        )
+
+        #作成した上位足のローソク足(最後の1本は途中の場合がある)
+        self.df = None
+        #self.dfの上位足ごとに、開始時刻の1分足から受け取ったかどうか
+        #(最初に受け取った1分足が上位足の途中からの場合は、その上位足を確定させない)
+        self.opened = np.empty(0, dtype=bool)
+        #これまでに受け取った1分足の最新の開始時刻(ms)
+        self.latest_source_time = None
+        #保存した上位足の最新の開始時刻(ms)
+        self.latest_saved_time = None
+
+    def resample(
+            self,
+            #開始時刻の昇順に並んだ1分足のDataFrame
+            df: pd.DataFrame,
+        ) -> pd.DataFrame:
+        """
+        1分足のDataFrameを渡すと、開始時刻を時間足の長さで切り捨てた時刻ごとにまとめて、
+        始値は最初、高値は最大、安値は最小、終値は最後、取引量と取引総額は合計した
+        上位足のDataFrameを返す関数
+        """
+        start_time = self.to_epoch_ms(df['開始時刻'])
+        bucket = start_time - start_time % self.step
+
+        if bucket.size == 0:
+            return pd.DataFrame(columns=self.COLUMNS)
+
+        #時間足が切り替わる位置
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        ends = np.r_[starts[1:], bucket.size] - 1
+
+        return pd.DataFrame({
+            '開始時刻': bucket[starts].astype('datetime64[ms]').astype('datetime64[ns]'),
+            '始値': df['始値'].to_numpy(dtype=np.float64)[starts],
+            '高値': np.maximum.reduceat(df['高値'].to_numpy(dtype=np.float64), starts),
+            '安値': np.minimum.reduceat(df['安値'].to_numpy(dtype=np.float64), starts),
+            '終値': df['終値'].to_numpy(dtype=np.float64)[ends],
+            '取引量': np.add.reduceat(df['取引量'].to_numpy(dtype=np.float64), starts),
+            '取引総額': np.add.reduceat(df['取引総額'].to_numpy(dtype=np.float64), starts),
+        })
+
+    def update(
+            self,
+            #新しく取得した1分足のDataFrame
+            df: pd.DataFrame,
+        ) -> pd.DataFrame:
+        """
+        新しい1分足を渡すと、作成中の最後の上位足に結合して上位足を更新し、
+        更新または追加した上位足のDataFrameを返す関数
+        すでに受け取った開始時刻の1分足は無視する
+        """
+        start_time = self.to_epoch_ms(df['開始時刻'])
+        if self.latest_source_time is not None:
+            df = df[start_time > self.latest_source_time]
+            start_time = start_time[start_time > self.latest_source_time]
+
+        if df.empty:
+            return pd.DataFrame(columns=self.COLUMNS)
+
+        bars = self.resample(df=df)
+        changed_count = len(bars)
+
+        bucket = start_time - start_time % self.step
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        opened = start_time[starts] == bucket[starts]
+
+        #最初の上位足が作成中の上位足と同じ時間の場合は結合する
+        if self.df is not None and not self.df.empty and bars.iloc[0]['開始時刻'] == self.df.iloc[-1]['開始時刻']:
+            latest = self.df.index[-1]
+            self.df.loc[latest, '高値'] = max(self.df.loc[latest, '高値'], bars.iloc[0]['高値'])
+            self.df.loc[latest, '安値'] = min(self.df.loc[latest, '安値'], bars.iloc[0]['安値'])
+            self.df.loc[latest, '終値'] = bars.iloc[0]['終値']
+            self.df.loc[latest, '取引量'] += bars.iloc[0]['取引量']
+            self.df.loc[latest, '取引総額'] += bars.iloc[0]['取引総額']
+            bars = bars.iloc[1:]
+            opened = opened[1:]
+
+        self.df = bars.reset_index(drop=True) if self.df is None else pd.concat(
+            [self.df, bars], axis=0
+        ).reset_index(drop=True)
+        self.opened = np.r_[self.opened, opened]
+        self.latest_source_time = int(start_time.max())
+
+        return self.df.iloc[-changed_count:]
+
+    def complete(self) -> pd.DataFrame:
+        """
+        作成した上位足のうち、最初の1分足から最後の1分足まで受け取って確定した上位足を返す関数
+        1分足が上位足の途中から始まる場合、その上位足は一部の1分足しか含まないため返さない
+        """
+        if self.df is None or self.latest_source_time is None:
+            return pd.DataFrame(columns=self.COLUMNS)
+
+        is_complete = self.to_epoch_ms(self.df['開始時刻']) + self.step <= self.latest_source_time + self.SOURCE_MS
+        is_complete &= self.opened
+
+        return self.df[is_complete]
+
+    def save(self) -> pd.DataFrame:
+        """
+        確定した上位足のうち、まだ保存していないものをストレージに追加して、
+        追加した上位足を返す関数
+        """
+        df = self.complete()
+        if self.latest_saved_time is not None:
+            df = df[self.to_epoch_ms(df['開始時刻']) > self.latest_saved_time]
+
+        if df.empty:
+            return df
+
+        self.storage.append(df=df)
+        self.storage.apply_retention(policy=self.retention)
+        self.latest_saved_time = int(self.to_epoch_ms(df['開始時刻']).max())
+
+        #保存期間を過ぎた上位足はインスタンス変数のdfからも削除する
+        is_kept = ~self.retention.expired(self.df['開始時刻'])
+        self.df = self.df[is_kept].reset_index(drop=True)
+        self.opened = self.opened[is_kept]
+
+        return df
+
+    def to_epoch_ms(
+            self,
+            start_time: pd.Series,
+        ) -> np.ndarray:
+        """
+        開始時刻をエポックミリ秒のint64の配列に変換して返す関数
+        """
+        return pd.to_datetime(start_time, format='ISO8601').to_numpy().astype('datetime64[ms]').astype(np.int64)
@@ -0,0 +1,309 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import numpy as np
+from pathlib import Path
+import signal
+import threading
+import time
+
+import analysis
+import metrics
+import scrape
+import signals
+
+logger = logging.getLogger('auto_trade.scheduler')
+
+
+class Clock():
+    """
+    現在時刻の取得と待機をまとめたクラス
+    テストのときは時刻を自由に進められるクラスに差し替える
+    """
+
+    def now(self) -> float:
+        """
+        現在時刻をunix時間(秒)で返す関数
+        """
+        return time.time()
+
+    def sleep(
+            self,
+            seconds: float,
+            #セットされた場合は待機を途中で終える
+            stop_event: threading.Event,
+        ) -> None:
+        """
+        seconds秒待機する関数
+        """
+        stop_event.wait(max(seconds, 0))
+
+
+class Scheduler():
+    """
+    (カテゴリー, シンボル, ローソク足の時間)のウォッチリストを受け取り、
+    ローソク足が確定する時刻に合わせてデータを取得してダウ理論で分析するクラス
+    シンボルごとにスレッドで並列に処理するため、遅いシンボルがほかのシンボルを待たせない
+    """
+
+    def __init__(
+            self,
+            #[(カテゴリー, シンボル, ローソク足の時間)]のリスト
+            watchlist: list[tuple[str, str, str]],
+            clock: Clock | None = None,
+            #同時に処理するジョブの数。Noneの場合はウォッチリストの数
+            max_workers: int | None = None,
+            #ローソク足が確定してからapiにリクエストするまでの待ち時間(秒)
+            delay: float = 2.0,
+            #取り逃したローソク足を補うために毎回さかのぼって取得する本数
+            lookback: int = 10,
+            #トレンドが変わったイベントを発行する先。Noneの場合は新しく作成する(self.signalsで購読する)
+            signal_bus: signals.SignalBus | None = None,
+            #ScrapeMarketDataに渡す引数(endpoint、session、storage_formatなど)
+            **scrape_kwargs,
+        ) -> None:
+        super().__init__()
+
+        self.watchlist = [tuple(job) for job in watchlist]
+        self.clock = clock if clock is not None else Clock()
+        self.delay = delay
+        self.lookback = lookback
+        self.scrape_kwargs = scrape_kwargs
+
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers if max_workers is not None else max(len(self.watchlist), 1),
+            thread_name_prefix='scheduler',
+        )
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+        #ジョブごとのScrapeMarketData
+        self.scrapers = {}
+        #ジョブごとに次にローソク足が確定する時刻(ms)
+        self.next_close = {}
+        #実行中のジョブ
+        self.running = set()
+        #ジョブごとの処理時間(秒)と最後のエラー
+        self.latencies = {job: deque(maxlen=1000) for job in self.watchlist}
+        self.errors = {}
+        #ジョブごとにローソク足が確定するたびに更新する分析結果(IncrementalDow)
+        self.dows = {}
+        #トレンドが変わったイベントの発行先
+        self.signals = signal_bus if signal_bus is not None else signals.SignalBus()
+
+    def interval_ms(
+            self,
+            job: tuple[str, str, str],
+        ) -> int:
+        """
+        ジョブのローソク足1本の長さ(ms)を返す関数
+        """
+        return scrape.ScrapeMarketData.INTERVAL_MS[job[2]]
+
+    def close_time(
+            self,
+            job: tuple[str, str, str],
+            #unix時間(ms)
+            now: int,
+        ) -> int:
+        """
+        nowの後に次にローソク足が確定する時刻(ms)を返す関数
+        """
+        step = self.interval_ms(job)
+
+        return (now // step + 1) * step
+
+    def run(
+            self,
+            #Trueの場合はSIGINTとSIGTERMで止まるようにする(メインスレッドからのみ)
+            handle_signals: bool = True,
+        ) -> None:
+        """
+        stopが呼ばれるまでローソク足が確定するたびにジョブを実行する関数
+        """
+        if handle_signals and threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_: self.stop())
+
+        now = int(self.clock.now() * 1000)
+        for job in self.watchlist:
+            self.next_close[job] = self.close_time(job=job, now=now)
+
+        try:
+            while not self.stop_event.is_set():
+                now = int(self.clock.now() * 1000)
+                self.run_pending(now=now)
+
+                #次に確定するローソク足の時刻まで待機する
+                wake_at = min(self.next_close.values()) + self.delay * 1000
+                self.clock.sleep(
+                    seconds=(wake_at - now) / 1000,
+                    stop_event=self.stop_event
+                )
+        finally:
+            self.shutdown()
+
+    def run_pending(
+            self,
+            #unix時間(ms)
+            now: int,
+        ) -> list:
+        """
+        ローソク足が確定して待ち時間が過ぎたジョブをスレッドで実行して、
+        実行を始めたジョブのFutureのリストを返す関数
+        前回の処理が終わっていないジョブは次の確定まで実行しない
+        """
+        futures = []
+
+        for job in self.watchlist:
+            close = self.next_close[job]
+            if now < close + self.delay * 1000:
+                continue
+
+            self.next_close[job] = self.close_time(job=job, now=now)
+
+            with self.lock:
+                if job in self.running:
+                    continue
+                self.running.add(job)
+
+            futures.append(self.executor.submit(self.run_job, job, close))
+
+        return futures
+
+    def run_job(
+            self,
+            job: tuple[str, str, str],
+            #確定したローソク足の終了時刻(ms)
+            close: int,
+        ) -> None:
+        """
+        processを実行して、処理時間と最後のエラーを記録する関数
+        環境変数PROFILEを設定した場合はジョブごとにプロファイルを取る
+        """
+        started_at = time.perf_counter()
+        try:
+            with metrics.profile(f'{job[1]}-{job[2]}'):
+                self.process(job=job, close=close)
+            self.errors.pop(job, None)
+
+        except Exception as e:
+            #1つのジョブの失敗でスケジューラーを止めないように、記録して次の確定で再び実行する
+            logger.exception('%sの処理に失敗しました', job)
+            self.errors[job] = e
+
+        finally:
+            self.latencies[job].append(time.perf_counter() - started_at)
+            with self.lock:
+                self.running.discard(job)
+
+    def process(
+            self,
+            job: tuple[str, str, str],
+            #確定したローソク足の終了時刻(ms)
+            close: int,
+        ) -> None:
+        """
+        確定したローソク足までのデータを取得して保存し、ダウ理論で分析する関数
+        """
+        with metrics.span('scheduler.job', symbol=job[1], interval=job[2]):
+            scraper = self.scraper(job=job)
+            step = self.interval_ms(job)
+
+            #確定していないローソク足を含めないように、最後に確定したローソク足の開始時刻までを取得する
+            df = scraper.get_kline(
+                start=close - step * self.lookback,
+                end=close - step
+            )
+            scraper.save(df=df)
+            #取り逃したローソク足がlookbackより前にある場合は欠けている期間だけを取得する
+            scraper.repair_gaps()
+
+            analysis.IncrementalDow.advance(
+                dows=self.dows,
+                job=job,
+                klines_df=scraper.df,
+                PATH=scraper.PATH,
+                signal_bus=self.signals,
+                interval_ms=self.interval_ms(job)
+            )
+
+    def scraper(
+            self,
+            job: tuple[str, str, str],
+        ) -> scrape.ScrapeMarketData:
+        """
+        ジョブのScrapeMarketDataを返す関数
+        """
+        if job not in self.scrapers:
+            self.scrapers[job] = scrape.ScrapeMarketData(
+                category=job[0],
+                symbol=job[1],
+                interval=job[2],
+                **self.scrape_kwargs
+            )
+
+        return self.scrapers[job]
+
+    def render_charts(
+            self,
+            #画像を保存するディレクトリ
+            directory: Path = Path('charts'),
+            #'png'か'svg'
+            format: str = 'png',
+            #Visualization.renderに渡す引数(width、heightなど)
+            **render_kwargs,
+        ) -> list[Path]:
+        """
+        分析が終わったジョブのローソク足とトレンドラインを、GUIを使わずに
+        (ディレクトリ)/(シンボル)-(カテゴリー)/(ローソク足の時間).(format)にまとめて描画して、
+        保存したpathのリストを返す関数
+        IncrementalDowは直近のスイングしか持たないため、描画するときだけ全期間を分析する
+        """
+        import visualization
+
+        chart = visualization.Visualization(headless=True)
+        paths = []
+
+        for job in list(self.dows):
+            scraper = self.scrapers[job]
+            paths.append(chart.render(
+                df=scraper.df,
+                path=Path(directory, f'{job[1]}-{job[0]}', f'{job[2]}.{format}'),
+                analysis_df=analysis.Dow(PATH=scraper.PATH, backtest=True, klines_df=scraper.df).df,
+                **render_kwargs
+            ))
+
+        return paths
+
+    def job_metrics(self) -> dict:
+        """
+        ジョブごとの実行回数、処理時間の平均、95パーセンタイル、最大値(ms)と最後のエラーを返す関数
+        """
+        summary = {}
+
+        for job in self.watchlist:
+            latencies = np.array(self.latencies[job]) * 1000
+            summary[job] = {
+                'count': int(latencies.size),
+                'mean': float(latencies.mean()) if latencies.size else None,
+                'p95': float(np.percentile(latencies, 95)) if latencies.size else None,
+                'max': float(latencies.max()) if latencies.size else None,
+                'error': repr(self.errors[job]) if job in self.errors else None,
+            }
+
+        return summary
+
+    def stop(self) -> None:
+        """
+        スケジューラーを止める関数
+        実行中のジョブは終わるまで待つ
+        """
+        self.stop_event.set()
+
+    def shutdown(self) -> None:
+        """
+        実行中のジョブが終わるのを待ってからスレッドを終了して、イベントの購読を閉じる関数
+        """
+        self.executor.shutdown(wait=True)
+        self.signals.close()
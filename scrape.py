@@ -1,12 +1,211 @@
-import datetime
-import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import itertools
+import logging
+import metrics
+import numpy as np
 import pandas as pd
 from pathlib import Path
-import requests
+import storage
+import threading
+import time
+
+#orjsonがインストールされている場合はレスポンスのjsonの変換に使う
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger('auto_trade.scrape')
+
+
+class HttpSession():
+    """
+    コネクションプールを持つrequests.Sessionをまとめたクラス
+    同じホストへの接続を使い回してリクエストごとのTCP、TLSのハンドシェイクを省き、
+    リクエストごとのレイテンシを記録する
+    """
+
+    #すべてのScrapeMarketDataで共有するセッション
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+            self,
+            #接続先ホストごとのプールの数
+            pool_connections: int = 10,
+            #1つのホストに対して保持する接続数
+            pool_maxsize: int = 10,
+            #(接続、読み込み)のタイムアウト(秒)
+            timeout: float | tuple[float, float] = (3.05, 10),
+            #接続エラーや5xxのときにurllib3で再試行する回数
+            #ScrapeMarketDataはRateLimiterを通して自分で再試行するため、重ねて再試行しないように0にしておく
+            retries: int = 0,
+            #再試行するまでの待ち時間の係数(秒)
+            backoff_factor: float = 0.5,
+            #接続を使い回すかどうか
+            keep_alive: bool = True,
+            #記録しておくレイテンシの数
+            latency_history: int = 1000,
+        ) -> None:
+        super().__init__()
+
+        #requestsは読み込みに時間がかかるため、セッションを作成するときに初めて読み込む
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.timeout = timeout
+        self.session = requests.Session()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            #429はRateLimiterを通さずに再試行しないように含めない
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+
+        #(url, レイテンシ(秒))のタプル
+        self.latencies = deque(maxlen=latency_history)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> 'HttpSession':
+        """
+        共有しているセッションを返す関数
+        まだ作成されていない場合はデフォルトの設定で作成する
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @classmethod
+    def configure(cls, **kwargs) -> 'HttpSession':
+        """
+        渡された設定で共有するセッションを作り直して返す関数
+        """
+        session = cls(**kwargs)
+        with cls._shared_lock:
+            previous, cls._shared = cls._shared, session
+
+        if previous is not None:
+            previous.close()
+
+        return session
+
+    def get(
+            self,
+            url: str,
+            params: dict | None = None,
+        ) -> 'requests.Response':
+        """
+        GETリクエストを送ってレスポンスを返す関数
+        リクエストにかかった時間を記録する
+        """
+        started_at = time.perf_counter()
+        try:
+            return self.session.get(url=url, params=params, timeout=self.timeout)
+        finally:
+            with self.lock:
+                self.latencies.append((url, time.perf_counter() - started_at))
+
+    def latency_summary(self) -> dict:
+        """
+        記録したレイテンシの件数、平均、中央値、95パーセンタイル、最大値(ms)を返す関数
+        """
+        with self.lock:
+            latencies = np.array([latency for _, latency in self.latencies]) * 1000
+
+        if latencies.size == 0:
+            return {'count': 0}
+
+        return {
+            'count': int(latencies.size),
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'max': float(latencies.max()),
+        }
+
+    def close(self) -> None:
+        """
+        プールしている接続を閉じる関数
+        """
+        self.session.close()
+
+
+class RateLimiter():
+    """
+    トークンバケットでAPIへのリクエスト数を制限するクラス
+    1秒あたりrate個のトークンが補充され、最大capacity個までためておける
+    """
+
+    def __init__(
+            self,
+            #1秒あたりのリクエスト数
+            rate: float = 10,
+            #連続して送れるリクエスト数
+            capacity: int | None = None,
+        ) -> None:
+        super().__init__()
+
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        トークンを1つ取得する関数
+        トークンがない場合は補充されるまで待つ
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
 
 class ScrapeMarketData():
     #apiのエンドポイント
     ENDPOINT = 'https://api.bybit.com/v5/market'
+    #1回のリクエストで取得できるローソク足の最大数
+    LIMIT = 1000
+    #intervalごとのローソク足1本の長さ(ms)
+    #月足は日数が変わるため一番長い31日で計算する
+    INTERVAL_MS = {
+            **{
+                interval: int(interval) * 60 * 1000
+                for interval in ['1', '3', '5', '15', '30', '60', '120', '240', '360', '720']
+            },
+            'D': 24 * 60 * 60 * 1000,
+            'W': 7 * 24 * 60 * 60 * 1000,
+            'M': 31 * 24 * 60 * 60 * 1000,
+        }
     COLUMNS = [
             '開始時刻',
             '始値',
@@ -23,88 +222,459 @@ class ScrapeMarketData():
             symbol: str = 'BTCUSDT',
             interval: str = '1',
             backtest: bool = False,       
+            #apiのエンドポイント(ローカルのスタブサーバーで確認するときに変更する)
+            endpoint: str = ENDPOINT,
+            #リクエストに使うセッション。Noneの場合は共有のセッションを使う
+            session: HttpSession | None = None,
+            #保存する形式(csv、parquet、feather、bin)
+            storage_format: str = 'csv',
+            #保存しておくデータの量。Noneの場合はconfigのRETENTIONから決める
+            retention: storage.RetentionPolicy | None = None,
         ) -> None:
         super().__init__()
 
         self.category = category
         self.symbol = symbol
         self.interval = interval
+        self.endpoint = endpoint
+        self.session = session if session is not None else HttpSession.shared()
 
-        #csvを保存するpath
+        #ローソク足を保存するpath
         self.PATH = Path(
             'data',
             self.symbol + '-' + self.category,
-            self.interval + 'MinutesKlines.csv'
+            self.interval + 'MinutesKlines.' + storage_format
+        )
+        self.storage = storage.open_storage(self.PATH)
+        self.retention = retention if retention is not None else storage.retention_for(
+            symbol=self.symbol,
+            interval=self.interval
         )
+        #計測結果につけるラベル
+        self.labels = {'symbol': self.symbol, 'interval': self.interval}
 
-        #pathのcsvファイルがすでに存在する場合はcsvをDataFrameに変換
+        #pathにデータがすでに保存されている場合はDataFrameに変換
         #バックテストの時とファイルがない場合はNone
-        if not backtest and os.path.isfile(self.PATH):
-            self.df = pd.read_csv(
-                self.PATH,
-                header=0,
-                index_col=0,
-            )
+        if not backtest and self.storage.exists():
+            with metrics.span('scrape.read', **self.labels):
+                self.df = self.storage.read()
         else:
             self.df = None
 
-    def save_csv(
+    def save(
             self,
             df: pd.DataFrame,
     ) -> None:
+        """
+        ストレージにローソク足のデータを保存する関数
+        csvの場合はsave_csvでファイル全体を書き直し、
+        それ以外の形式の場合はまだ保存されていないデータだけを追加する
+        """
+        self.ensure_utc(df=df)
+
+        if isinstance(self.storage, storage.CsvStorage):
+            self.df = self.save_csv(df=df)
+            return
+
+        with metrics.span('scrape.save', **self.labels):
+            self.storage.append(df=df)
+            self.storage.apply_retention(policy=self.retention)
+
+        df = self.merge(df=df)
+
+        #保存期間を過ぎたデータはインスタンス変数のdfからも削除する
+        self.df = df[~self.retention.expired(df['開始時刻'])].reset_index(drop=True)
+
+    def save_csv(
+            self,
+            df: pd.DataFrame,
+    ) -> pd.DataFrame:
         """
         インスタンス変数のdfがあれば結合し、ない場合はそのままで、
-        pathの位置にcsvにして保存する関数
+        pathの位置にcsvにして保存して、保存したDataFrameを返す関数
+        """
+        df = self.merge(df=df)
+
+        #保存期間を過ぎたデータを削除して(coldの場合はコールドストレージに移して)保存する
+        with metrics.span('scrape.save', **self.labels):
+            return storage.CsvStorage(path=self.PATH.with_suffix('.csv')).apply_retention(
+                policy=self.retention,
+                df=df
+            )
+
+    def merge(
+            self,
+            df: pd.DataFrame,
+    ) -> pd.DataFrame:
+        """
+        インスタンス変数のdfがあれば結合し、開始時刻が重複しているものは初めのデータを使用して、
+        開始時刻の昇順に並べたDataFrameを返す関数
+        欠けていた期間のデータを後から追加した場合も時系列の順番を保つ
         """
         #self.dfがある場合は結合させる
-        #dfのサイズが0より大きい場合はすでにcsvに保存されているデータがある
-        if self.df.size > 0:
-            concat_df = pd.concat([self.df, df], axis=0)
-            #indexが重複しているものは初めのデータを使用する
-            df = concat_df[~concat_df.duplicated(keep='first', subset='開始時刻')]
+        #dfのサイズが0より大きい場合はすでに保存されているデータがある
+        if self.df is not None and self.df.size > 0:
+            df = pd.concat([self.df, df], axis=0)
+
+        #csvから読み込んだ開始時刻は文字列のため、datetime型にそろえてから重複を判定する
+        df = df.reset_index(drop=True)
+        df['開始時刻'] = pd.to_datetime(df['開始時刻'])
+        df = df[~df.duplicated(keep='first', subset='開始時刻')]
+
+        return df.sort_values(by='開始時刻', kind='stable').reset_index(drop=True)
+
+    def ensure_utc(
+            self,
+            #これから保存するローソク足(UTC)
+            df: pd.DataFrame,
+    ) -> None:
+        """
+        保存されたローソク足の開始時刻がUTCかどうかを、シリーズごとに一度だけ確認する関数
+        以前の実装はローカル時刻で保存していたため、UTCで取得したローソク足と結合すると
+        欠けている期間や重複を正しく判定できなくなる
+        保存されたローソク足と同じローソク足から時差を検出して、ずれている場合はUTCに変換して書き直す
+        同じローソク足がなく時差を検出できない場合は、このマシンのタイムゾーンがUTCでなければ
+        結合せずにValueErrorを送出する
+        """
+        integrity = self.storage.integrity()
+        if integrity.time_base == 'utc':
+            return
+
+        if self.storage.exists():
+            stored = self.storage.read()
+            offset = storage.detect_time_offset(stored=stored, fetched=df)
+
+            if offset is None:
+                if (storage.local_utc_offset(start_time=stored['開始時刻']) != pd.Timedelta(0)).any():
+                    raise ValueError(
+                        f'{self.PATH}の開始時刻がUTCかローカル時刻か判定できないため結合しません。'
+                        'ローカル時刻で保存したデータの場合はconvert_to_utc()を、'
+                        'UTCで保存したデータの場合はconvert_to_utc(offset=pd.Timedelta(0))を実行してください'
+                    )
 
-        #dataframeのサイズが200以上あるときは新しいデータから200個分残して削除する
-        df = df.drop(df.iloc[: -200].index).reset_index(drop=True)
+            elif offset != pd.Timedelta(0):
+                logger.warning('%sの開始時刻がUTCから%sずれているため、UTCに変換して書き直します', self.PATH, offset)
+                self.convert_to_utc(offset=offset)
+                return
 
-        #上の階層のディレクトリがない場合は作成する
-        self.PATH.parent.mkdir(parents=True, exist_ok=True)
-        df.to_csv(self.PATH)
+        integrity.time_base = 'utc'
+        integrity.save()
+
+    def convert_to_utc(
+            self,
+            #ローカル時刻 - UTCの時差。Noneの場合は夏時間も含めてこのマシンのタイムゾーンから求める
+            #0の場合は書き直さずに、UTCで保存されていることだけを記録する
+            offset: pd.Timedelta | None = None,
+    ) -> None:
+        """
+        ローカル時刻で保存されたローソク足と分析結果(コールドストレージを含む)の開始時刻を
+        UTCに変換して書き直し、UTCで保存されていることを記録する関数
+        以前の実装はdatetime.datetime.fromtimestampでローカル時刻にしていたため、
+        同じマシンで保存したデータはoffsetを渡さずに変換できる
+        """
+        if offset is None or offset != pd.Timedelta(0):
+            #分析結果はanalysis/(分析する通貨名)/(ローソク足の時間).(拡張子)に保存されている(.binの場合はcsv)
+            analysis_storage = storage.open_storage(Path(
+                'analysis',
+                self.PATH.parent.name,
+                self.PATH.name if self.PATH.suffix != '.bin' else self.PATH.with_suffix('.csv').name
+            ))
+
+            for target in [self.storage, self.storage.cold_storage(), analysis_storage, analysis_storage.cold_storage()]:
+                if not target.exists():
+                    continue
+
+                #キャッシュのDataFrameを書き換えないようにコピーしてから変換する
+                df = target.read().copy()
+                df['開始時刻'] = storage.to_utc(start_time=df['開始時刻'], offset=offset)
+                target.write(df=df)
+
+            if self.df is not None:
+                self.df = self.storage.read()
+
+        integrity = self.storage.integrity()
+        integrity.time_base = 'utc'
+        integrity.save()
 
 
     def get_kline(
             self,
             start: int,
-            end: int
+            end: int,
+            limit: int = LIMIT,
+            #失敗したときに再試行する回数
+            retries: int = 3,
+            #再試行するまでの待ち時間(秒)。再試行のたびに2倍にする
+            backoff: float = 0.5,
         ) -> pd.DataFrame:
         """
         取得したい期間をtimestampで渡すとその期間のローソク足データを
         DataFrameにして返す関数
+        1回のリクエストで取得するため、limitより多いローソク足は含まれない
         """
-        url = self.ENDPOINT + '/kline'
+        data = self.request_kline_with_retry(
+            start=start,
+            end=end,
+            limit=limit,
+            retries=retries,
+            backoff=backoff
+        )
+
+        return self.to_dataframe(data=data)
+
+    def request_kline(
+            self,
+            start: int,
+            end: int,
+            limit: int = LIMIT,
+        ) -> list:
+        """
+        期間をtimestampで渡すとapiにリクエストしてレスポンスの中のローソク足のデータを返す関数
+        """
+        url = self.endpoint + '/kline'
         params = {
             'category': self.category,
             'symbol': self.symbol,
             'interval': self.interval,
             'start': int(start),
-            'end': int(end)
+            'end': int(end),
+            'limit': limit
         }
 
-        r = requests.get(url=url, params=params)
+        metrics.increment('scrape.api_calls', **self.labels)
+        with metrics.span('scrape.http', **self.labels):
+            r = self.session.get(url=url, params=params)
+        r.raise_for_status()
+
+        with metrics.span('scrape.json', **self.labels):
+            response = orjson.loads(r.content) if orjson is not None else r.json()
+
+        #retCodeが0以外の場合はエラーメッセージを返しているため例外にする
+        if response.get('retCode', 0) != 0:
+            raise RuntimeError(f'{response.get("retCode")}: {response.get("retMsg")}')
+
         #responseの中のローソク足のデータ
-        data = r.json()['result']['list']
-
-        #dataframeに変換して時間をdatetime型に変更
-        #開始時刻を昇順に並べ替え
-        df = pd.DataFrame(
-                data,
-                columns=self.COLUMNS
-            ).sort_values(by='開始時刻').reset_index(drop=True)
-        
-        df['開始時刻'] = [
-            #ミリ秒を秒数に変換してからdatetime型
-            datetime.datetime.fromtimestamp(float(timestamp) / 1000) for timestamp in df['開始時刻']]
-        
-        #開始時刻以外のカラムをfloat型に変換
-        df[df.columns[df.columns != '開始時刻']] = df[df.columns[df.columns != '開始時刻']].astype(float)
-        
-        return df
\ No newline at end of file
+        return response['result']['list']
+
+    def request_kline_with_retry(
+            self,
+            start: int,
+            end: int,
+            limit: int = LIMIT,
+            #リクエストの前にトークンを取得するRateLimiter。Noneの場合は制限しない
+            limiter: RateLimiter | None = None,
+            retries: int = 3,
+            backoff: float = 0.5,
+        ) -> list:
+        """
+        request_klineが失敗したときに、backoff秒(再試行のたびに2倍)待ってretries回まで再試行する関数
+        HttpSessionでは再試行しないため、ここが唯一の再試行になり、1つの期間のリクエストは最大retries + 1回になる
+        再試行もlimiterのトークンを取得してから送るため、429のときもリクエスト数の上限を超えない
+        """
+        import requests
+
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                limiter.acquire()
+
+            try:
+                return self.request_kline(start=start, end=end, limit=limit)
+            except (requests.RequestException, RuntimeError, ValueError):
+                if attempt == retries:
+                    raise
+                metrics.increment('scrape.retries', **self.labels)
+                time.sleep(backoff * 2 ** attempt)
+
+    def to_dataframe(
+            self,
+            data: list,
+        ) -> pd.DataFrame:
+        """
+        apiから取得したローソク足のデータをDataFrameに変換して返す関数
+        """
+        metrics.increment('scrape.rows', len(data), **self.labels)
+
+        with metrics.span('scrape.parse', **self.labels):
+            #[開始時刻(ms), 始値, 高値, 安値, 終値, 取引量, 取引総額]の文字列のリストを
+            #1回の走査でfloat64の2次元配列に変換する(エポックミリ秒はfloat64で誤差なく表せる)
+            values = np.fromiter(
+                map(float, itertools.chain.from_iterable(data)),
+                dtype=np.float64,
+                count=len(data) * len(self.COLUMNS)
+            ).reshape(-1, len(self.COLUMNS))
+
+            #開始時刻はエポックミリ秒からUTCのdatetime型(タイムゾーンなし)に一括で変換し、昇順に並べ替える
+            start_time = values[:, 0].astype(np.int64)
+            order = np.argsort(start_time, kind='stable')
+
+            df = pd.DataFrame(
+                values[order, 1:],
+                columns=self.COLUMNS[1:]
+            )
+            df.insert(0, '開始時刻', start_time[order].astype('datetime64[ms]').astype('datetime64[ns]'))
+
+        return df
+
+    def split_range(
+            self,
+            start: int,
+            end: int,
+            limit: int = LIMIT,
+        ) -> list[tuple[int, int]]:
+        """
+        取得したい期間をtimestampで渡すと、1回のリクエストでlimit本以内に収まる
+        (開始, 終了)の期間のリストに分割して返す関数
+        """
+        step = self.INTERVAL_MS[self.interval] * limit
+        start = int(start)
+        end = int(end)
+
+        return [
+            (window_start, min(window_start + step - 1, end))
+            for window_start in range(start, end + 1, step)
+        ]
+
+    def backfill_kline(
+            self,
+            start: int,
+            end: int,
+            limit: int = LIMIT,
+            #同時にリクエストするスレッド数
+            max_workers: int = 4,
+            #1秒あたりのリクエスト数の上限
+            rate: float = 10,
+            #失敗したときに再試行する回数
+            retries: int = 3,
+            #再試行するまでの待ち時間(秒)。再試行のたびに2倍にする
+            backoff: float = 0.5,
+            #取得した期間の数を表示するかどうか
+            progress: bool = True,
+        ) -> pd.DataFrame:
+        """
+        取得したい期間をtimestampで渡すと、limit本ずつの期間に分割して並列でリクエストし、
+        開始時刻の重複を除いて昇順に並べたローソク足のDataFrameを返す関数
+        """
+        windows = self.split_range(start=start, end=end, limit=limit)
+
+        return self.fetch_windows(
+            windows=windows,
+            limit=limit,
+            max_workers=max_workers,
+            rate=rate,
+            retries=retries,
+            backoff=backoff,
+            progress=progress
+        )
+
+    def fetch_windows(
+            self,
+            #[(開始, 終了)]の期間のリスト(1つの期間はlimit本以内)
+            windows: list[tuple[int, int]],
+            limit: int = LIMIT,
+            max_workers: int = 4,
+            rate: float = 10,
+            retries: int = 3,
+            backoff: float = 0.5,
+            progress: bool = True,
+        ) -> pd.DataFrame:
+        """
+        期間のリストを並列でリクエストし、開始時刻の重複を除いて昇順に並べたローソク足のDataFrameを返す関数
+        """
+        limiter = RateLimiter(rate=rate)
+
+        def fetch(window: tuple[int, int]) -> list:
+            return self.request_kline_with_retry(
+                start=window[0],
+                end=window[1],
+                limit=limit,
+                limiter=limiter,
+                retries=retries,
+                backoff=backoff
+            )
+
+        data = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fetch, window) for window in windows]
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                data.extend(future.result())
+
+                if progress:
+                    print(f'\r{self.symbol} {self.interval}: {done}/{len(windows)}', end='', flush=True)
+
+        if progress:
+            print()
+
+        df = self.to_dataframe(data=data)
+
+        #期間の境目で重複したローソク足は初めのデータを使用する
+        return df[~df.duplicated(keep='first', subset='開始時刻')].reset_index(drop=True)
+
+    def find_gaps(self) -> np.ndarray:
+        """
+        インスタンス変数のdf(ない場合は保存されたデータ)の開始時刻から、
+        [[欠けている最初の開始時刻(ms), 欠けている最後の開始時刻(ms)]]の配列を返す関数
+        """
+        if self.interval == 'M':
+            raise ValueError('月足は1本の長さが一定でないため欠けている期間を判定できません')
+
+        step = self.INTERVAL_MS[self.interval]
+
+        if self.df is not None:
+            return storage.find_gaps(start_time=self.df['開始時刻'], step=step)
+
+        return self.storage.gaps(step=step)
+
+    def repair_gaps(
+            self,
+            limit: int = LIMIT,
+            max_workers: int = 4,
+            rate: float = 10,
+            retries: int = 3,
+            backoff: float = 0.5,
+            progress: bool = False,
+            #この回数リクエストしても埋まらない期間は取引所にデータがないとみなして、次からリクエストしない
+            max_attempts: int = 3,
+        ) -> pd.DataFrame:
+        """
+        保存されたデータの欠けている期間だけをまとめてリクエストして保存し、
+        取得したローソク足のDataFrameを返す関数
+        欠けている期間がない場合や、埋まらないと判定した期間だけの場合はリクエストしない
+        """
+        step = self.INTERVAL_MS[self.interval]
+        integrity = self.storage.integrity()
+
+        gaps = integrity.exclude(gaps=self.find_gaps(), step=step)
+        metrics.increment('scrape.gaps', len(gaps), **self.labels)
+
+        if len(gaps) == 0:
+            return self.to_dataframe(data=[])
+
+        windows = [
+            window
+            for gap_start, gap_end in gaps
+            for window in self.split_range(start=gap_start, end=gap_end, limit=limit)
+        ]
+        df = self.fetch_windows(
+            windows=windows,
+            limit=limit,
+            max_workers=max_workers,
+            rate=rate,
+            retries=retries,
+            backoff=backoff,
+            progress=progress
+        )
+
+        if not df.empty:
+            self.save(df=df)
+
+        #リクエストしても埋まらなかった期間の回数を数えて、max_attempts回に達した期間を記録する
+        #保存したときに開始時刻の基準を記録している場合があるため読み込み直す
+        integrity = self.storage.integrity()
+        unfillable = integrity.record_attempts(
+            gaps=integrity.exclude(gaps=self.find_gaps(), step=step),
+            max_attempts=max_attempts
+        )
+        metrics.increment('scrape.unfillable', len(unfillable), **self.labels)
+
+        return df
@@ -0,0 +1,369 @@
+from collections import deque
+import numpy as np
+import pandas as pd
+import threading
+import time
+
+import metrics
+
+
+#ダウ理論のトレンドが変わったことを知らせるイベント
+class TrendChange():
+
+    __slots__ = (
+        'symbol', 'interval', 'previous', 'trend', 'conversion_value', 'target_value',
+        'start_time', 'closed_at', 'published_at',
+    )
+
+    def __init__(
+            self,
+            symbol: str,
+            interval: str,
+            #変わる前と後のトレンド('上昇'、'下降'、NaN)
+            previous: str | float,
+            trend: str | float,
+            #最後のスイングの転換値と直近目標値
+            conversion_value: float,
+            target_value: float,
+            #最後のスイングの開始時刻
+            start_time: pd.Timestamp | None,
+            #トレンドが変わったローソク足が確定した時刻(unix時間(秒))
+            closed_at: float,
+        ) -> None:
+        self.symbol = symbol
+        self.interval = interval
+        self.previous = previous
+        self.trend = trend
+        self.conversion_value = conversion_value
+        self.target_value = target_value
+        self.start_time = start_time
+        self.closed_at = closed_at
+        #SignalBusが発行した時刻(unix時間(秒))
+        self.published_at = None
+
+    def __repr__(self) -> str:
+        return (
+            f'TrendChange({self.symbol} {self.interval} {self.previous}→{self.trend} '
+            f'転換値={self.conversion_value} 直近目標値={self.target_value} 開始時刻={self.start_time})'
+        )
+
+
+class Subscription():
+    """
+    SignalBusから受け取ったイベントを、上限の数までためておくスレッドセーフなキュー
+    いっぱいの場合はpolicyが'drop_oldest'なら最も古いイベントを捨て、
+    'block'なら空きができるまで(timeout秒まで)発行する側を待たせる
+    """
+
+    POLICIES = ['drop_oldest', 'block']
+
+    def __init__(
+            self,
+            #ためておくイベントの上限
+            maxsize: int = 1000,
+            #'drop_oldest'か'block'
+            policy: str = 'drop_oldest',
+            #policyが'block'のときに発行する側を待たせる上限(秒)。Noneの場合は空くまで待つ
+            #待っても空かない場合は新しいイベントを捨てる
+            timeout: float | None = None,
+            #記録しておくレイテンシの数
+            latency_history: int = 1000,
+        ) -> None:
+        super().__init__()
+
+        if policy not in self.POLICIES:
+            raise ValueError(f'対応していない方法です: {policy}')
+        if maxsize < 1:
+            raise ValueError(f'maxsizeは1以上にしてください: {maxsize}')
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.timeout = timeout
+
+        self.events = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.closed = False
+
+        #捨てたイベントの数
+        self.dropped = 0
+        #ローソク足の確定から受け取るまでの時間(秒)
+        self.latencies = deque(maxlen=latency_history)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def put(
+            self,
+            event: TrendChange,
+        ) -> bool:
+        """
+        イベントをキューに入れる関数
+        いっぱいの場合はpolicyに従って古いイベントを捨てるか空きができるまで待ち、
+        新しいイベントを捨てた場合はFalseを返す
+        """
+        with self.lock:
+            if self.closed:
+                return False
+
+            if len(self.events) >= self.maxsize:
+                if self.policy == 'drop_oldest':
+                    self.events.popleft()
+                    self.dropped += 1
+                    metrics.increment('signals.dropped', policy=self.policy)
+
+                elif not self.wait_not_full():
+                    self.dropped += 1
+                    metrics.increment('signals.dropped', policy=self.policy)
+                    return False
+
+            self.events.append(event)
+            self.notify()
+
+        return True
+
+    def wait_not_full(self) -> bool:
+        """
+        ロックを持った状態で呼び出し、キューに空きができるまで待つ関数
+        timeout秒を過ぎた場合や閉じられた場合はFalseを返す
+        """
+        return self.not_full.wait_for(
+            lambda: len(self.events) < self.maxsize or self.closed,
+            timeout=self.timeout
+        ) and not self.closed
+
+    def notify(self) -> None:
+        """
+        ロックを持った状態で呼び出し、イベントを待っている受け取る側を起こす関数
+        """
+        self.not_empty.notify()
+
+    def get(
+            self,
+            #待つ上限(秒)。Noneの場合はイベントが来るか閉じられるまで待つ
+            timeout: float | None = None,
+        ) -> TrendChange | None:
+        """
+        イベントを1つ取り出して返す関数
+        timeout秒までにイベントが来なかった場合や閉じられた場合はNoneを返す
+        """
+        with self.lock:
+            self.not_empty.wait_for(lambda: self.events or self.closed, timeout=timeout)
+            if not self.events:
+                return None
+
+            return self.deliver()
+
+    def deliver(self) -> TrendChange:
+        """
+        ロックを持った状態で呼び出し、最も古いイベントを取り出して、
+        ローソク足の確定から受け取るまでの時間を記録する関数
+        """
+        event = self.events.popleft()
+        self.not_full.notify()
+
+        latency = time.time() - event.closed_at
+        self.latencies.append(latency)
+        metrics.get_sink().record_span(
+            name='signals.latency',
+            seconds=latency,
+            labels={'symbol': event.symbol, 'interval': event.interval}
+        )
+
+        return event
+
+    def close(self) -> None:
+        """
+        キューを閉じて、待っている発行する側と受け取る側を起こす関数
+        閉じた後もたまっているイベントは取り出せる
+        """
+        with self.lock:
+            self.closed = True
+            self.not_full.notify_all()
+            self.not_empty.notify_all()
+            self.notify()
+
+    def latency_summary(self) -> dict:
+        """
+        記録したレイテンシの件数、平均、中央値、95パーセンタイル、最大値(ms)と捨てたイベントの数を返す関数
+        """
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            dropped = self.dropped
+
+        if latencies.size == 0:
+            return {'count': 0, 'dropped': dropped}
+
+        return {
+            'count': int(latencies.size),
+            'mean': float(latencies.mean()),
+            'p50': float(np.percentile(latencies, 50)),
+            'p95': float(np.percentile(latencies, 95)),
+            'max': float(latencies.max()),
+            'dropped': dropped,
+        }
+
+
+class AsyncSubscription(Subscription):
+    """
+    asyncioのイベントループでawaitして受け取るSubscription
+    ほかのスレッドから発行されたイベントもcall_soon_threadsafeでイベントループに知らせる
+    イベントループの中で作成する
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+
+        #asyncioは読み込みに時間がかかるため、asyncioで受け取るときに初めて読み込む
+        import asyncio
+
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.ready = asyncio.Event()
+
+    def wait_not_full(self) -> bool:
+        #イベントループのスレッドで待つと受け取る側が動けなくなるため、待たずに新しいイベントを捨てる
+        if threading.get_ident() == self.loop_thread:
+            return False
+
+        return super().wait_not_full()
+
+    def notify(self) -> None:
+        if threading.get_ident() == self.loop_thread:
+            self.ready.set()
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.ready.set)
+
+    async def get(self) -> TrendChange | None:
+        """
+        イベントを1つ取り出して返す関数
+        閉じられてたまっているイベントがない場合はNoneを返す
+        """
+        while True:
+            with self.lock:
+                if self.events:
+                    return self.deliver()
+                if self.closed:
+                    return None
+                self.ready.clear()
+
+            await self.ready.wait()
+
+
+class SignalBus():
+    """
+    分析したスレッドからトレンドが変わったイベントを発行して、購読しているすべてのキューに配るクラス
+    ファイルを監視せずに、複数の売買の処理がそれぞれのキューからイベントを受け取れる
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.subscriptions = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, **kwargs) -> Subscription:
+        """
+        スレッドで受け取るキューを作成して購読する関数
+        引数はSubscriptionと同じ
+        """
+        return self.add(subscription=Subscription(**kwargs))
+
+    def subscribe_async(self, **kwargs) -> AsyncSubscription:
+        """
+        asyncioで受け取るキューを作成して購読する関数(イベントループの中で呼び出す)
+        引数はSubscriptionと同じ
+        """
+        return self.add(subscription=AsyncSubscription(**kwargs))
+
+    def add(
+            self,
+            subscription: Subscription,
+        ) -> Subscription:
+        """
+        キューを購読する先に追加する関数
+        """
+        with self.lock:
+            self.subscriptions = [*self.subscriptions, subscription]
+
+        return subscription
+
+    def unsubscribe(
+            self,
+            subscription: Subscription,
+        ) -> None:
+        """
+        キューの購読をやめて閉じる関数
+        """
+        with self.lock:
+            self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+
+        subscription.close()
+
+    def publish(
+            self,
+            event: TrendChange,
+        ) -> int:
+        """
+        イベントを購読しているすべてのキューに入れて、入れられたキューの数を返す関数
+        """
+        event.published_at = time.time()
+        metrics.increment('signals.published', symbol=event.symbol, interval=event.interval)
+
+        #購読の追加や削除はリストを作り直すため、ロックを持たずに配る
+        return sum(subscription.put(event=event) for subscription in self.subscriptions)
+
+    def publish_trend(
+            self,
+            symbol: str,
+            interval: str,
+            #変わる前のトレンド('上昇'、'下降'、NaN)
+            previous: str | float,
+            #今回の分析結果(DowかIncrementalDow)
+            dow,
+            #分析したローソク足が確定した時刻(unix時間(秒))
+            closed_at: float,
+        ) -> TrendChange | None:
+        """
+        変わる前のトレンドと今回の分析のトレンドが違う場合に、最後のスイングの転換値と
+        直近目標値を持つTrendChangeを発行して返す関数
+        トレンドが変わっていない場合はNoneを返す
+        """
+        trend = dow.trend
+        if (isinstance(previous, float) and isinstance(trend, float)) or previous == trend:
+            return None
+
+        if len(dow.swings) > 0:
+            swing = dow.swings[-1]
+            conversion_value = swing['転換値']
+            target_value = swing['直近目標値']
+            start_time = swing['開始時刻']
+        else:
+            conversion_value = np.nan
+            target_value = np.nan
+            start_time = None
+
+        event = TrendChange(
+            symbol=symbol,
+            interval=interval,
+            previous=previous,
+            trend=trend,
+            conversion_value=conversion_value,
+            target_value=target_value,
+            start_time=start_time,
+            closed_at=closed_at
+        )
+        self.publish(event=event)
+
+        return event
+
+    def close(self) -> None:
+        """
+        すべてのキューを閉じて、受け取る側にNoneを返す関数
+        """
+        with self.lock:
+            subscriptions, self.subscriptions = self.subscriptions, []
+
+        for subscription in subscriptions:
+            subscription.close()
@@ -0,0 +1,950 @@
+from collections import OrderedDict
+from datetime import datetime
+import json
+import numpy as np
+import os
+import pandas as pd
+from pathlib import Path
+import threading
+
+import config
+
+#文字列として保存するカラム。それ以外の開始時刻以外のカラムはfloat型で保存する
+STRING_COLUMNS = ['分類', 'トレンド']
+
+
+def to_typed(
+        df: pd.DataFrame,
+    ) -> pd.DataFrame:
+    """
+    ローソク足や分析結果のDataFrameの開始時刻をdatetime型に、
+    分類とトレンドを文字列に、それ以外のカラムをfloat型に変換したDataFrameを返す関数
+    """
+    df = df.copy()
+
+    for column in df.columns:
+        if column == '開始時刻':
+            df[column] = pd.to_datetime(df[column])
+        elif column in STRING_COLUMNS:
+            #NaNやNoneは欠損値のまま残す
+            df[column] = df[column].where(df[column].notna(), None).astype(object)
+        else:
+            df[column] = pd.to_numeric(df[column]).astype(np.float64)
+
+    return df
+
+
+def find_gaps(
+        #開始時刻(datetime型かエポックミリ秒)
+        start_time: pd.Series | np.ndarray,
+        #ローソク足1本の長さ(ms)
+        step: int,
+    ) -> np.ndarray:
+    """
+    開始時刻の隣り合う差をまとめて計算して、1本の長さより離れている場所を欠けている期間として
+    [[欠けている最初の開始時刻(ms), 欠けている最後の開始時刻(ms)]]の配列で返す関数
+    """
+    start_time = np.asarray(start_time)
+    if start_time.dtype.kind != 'i':
+        start_time = pd.to_datetime(start_time).to_numpy().astype('datetime64[ms]').astype(np.int64)
+
+    start_time = np.unique(start_time)
+    is_gap = np.diff(start_time) > step
+    previous_time = start_time[:-1][is_gap]
+    next_time = start_time[1:][is_gap]
+
+    return np.column_stack([previous_time + step, next_time - step]).astype(np.int64)
+
+
+def local_utc_offset(
+        #ローカル時刻(タイムゾーンなし)の開始時刻
+        start_time: pd.Series,
+    ) -> pd.Series:
+    """
+    開始時刻ごとに、このマシンのタイムゾーンのUTCからの時差(夏時間を含む)を返す関数
+    時差は1時間の中では変わらないため、1時間ごとにまとめて求める
+    """
+    hours = pd.to_datetime(start_time).dt.floor('h')
+    offsets = {
+        hour: pd.Timedelta(hour.to_pydatetime().astimezone().utcoffset())
+        for hour in hours.unique()
+    }
+
+    return hours.map(offsets).astype('timedelta64[ns]')
+
+
+def to_utc(
+        #ローカル時刻(タイムゾーンなし)の開始時刻
+        start_time: pd.Series,
+        #ローカル時刻 - UTCの時差。Noneの場合はこのマシンのタイムゾーンから求める
+        offset: pd.Timedelta | None = None,
+    ) -> pd.Series:
+    """
+    ローカル時刻の開始時刻をUTC(タイムゾーンなし)に変換して返す関数
+    """
+    start_time = pd.to_datetime(start_time)
+
+    return start_time - (local_utc_offset(start_time=start_time) if offset is None else offset)
+
+
+def detect_time_offset(
+        #保存されたローソク足
+        stored: pd.DataFrame,
+        #UTCで取得したローソク足
+        fetched: pd.DataFrame,
+    ) -> pd.Timedelta | None:
+    """
+    始値、高値、安値、終値、取引量が同じローソク足どうしの開始時刻の差から、
+    保存されたローソク足の開始時刻がUTCからどれだけずれているかを返す関数
+    同じローソク足がない場合はNoneを返す
+    """
+    columns = ['始値', '高値', '安値', '終値', '取引量']
+    matched = pd.merge(
+        stored[['開始時刻', *columns]],
+        fetched[['開始時刻', *columns]],
+        on=columns,
+        suffixes=('_stored', '_fetched')
+    )
+
+    if matched.empty:
+        return None
+
+    #値が同じローソク足が別の時刻にもある場合があるため、最も多い差を時差とする
+    difference = pd.to_datetime(matched['開始時刻_stored']) - pd.to_datetime(matched['開始時刻_fetched'])
+
+    return difference.mode()[0]
+
+
+class FrameCache():
+    """
+    読み込んだDataFrameをpathごとにメモリに残しておくクラス
+    ファイルの更新時刻とサイズ(signature)が変わった場合は読み込み直し、
+    合計のメモリ使用量がmax_bytesを超えた場合は最も長く使われていないものから削除する
+    """
+
+    def __init__(
+            self,
+            #キャッシュしておくDataFrameの合計の上限(byte)
+            max_bytes: int,
+        ) -> None:
+        super().__init__()
+
+        self.max_bytes = max_bytes
+        #{path: (signature, DataFrame, byte数)}
+        self.frames = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(
+            self,
+            path: Path,
+            signature: tuple,
+            #キャッシュにない場合にDataFrameを読み込む関数
+            loader,
+        ) -> pd.DataFrame:
+        """
+        pathとsignatureが同じDataFrameがあればそのコピーを、なければloaderで読み込んで
+        キャッシュに入れてからコピーを返す関数
+        """
+        key = Path(path).resolve()
+
+        with self.lock:
+            cached = self.frames.get(key)
+            if cached is not None and cached[0] == signature:
+                self.frames.move_to_end(key)
+                self.hits += 1
+                return cached[1].copy()
+            self.misses += 1
+
+        df = loader()
+        self.put(path=path, signature=signature, df=df)
+
+        return df.copy()
+
+    def put(
+            self,
+            path: Path,
+            signature: tuple,
+            df: pd.DataFrame,
+        ) -> None:
+        """
+        DataFrameをキャッシュに入れて、上限を超えた分を古いものから削除する関数
+        上限より大きいDataFrameはキャッシュしない
+        """
+        key = Path(path).resolve()
+        size = int(df.memory_usage(deep=True).sum())
+
+        with self.lock:
+            self.discard(key)
+            if size > self.max_bytes:
+                return
+
+            self.frames[key] = (signature, df, size)
+            self.total_bytes += size
+
+            while self.total_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.frames.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def invalidate(
+            self,
+            path: Path,
+        ) -> None:
+        """
+        pathのDataFrameをキャッシュから削除する関数
+        """
+        with self.lock:
+            self.discard(Path(path).resolve())
+
+    def discard(
+            self,
+            key: Path,
+        ) -> None:
+        #ロックを取得してから呼び出す
+        cached = self.frames.pop(key, None)
+        if cached is not None:
+            self.total_bytes -= cached[2]
+
+    def clear(self) -> None:
+        """
+        キャッシュをすべて削除する関数
+        """
+        with self.lock:
+            self.frames.clear()
+            self.total_bytes = 0
+
+
+#すべてのストレージで共有するキャッシュ
+frame_cache = FrameCache(max_bytes=config.FRAME_CACHE_BYTES)
+
+
+class RetentionPolicy():
+    """
+    保存しておくデータの量を決めるクラス
+    rowsとdaysの両方がNoneの場合はすべてのデータを残す
+    coldがTrueの場合は削除するデータを別のファイル(コールドストレージ)に移して全期間のデータを残す
+    """
+
+    def __init__(
+            self,
+            #新しいデータから残す行数
+            rows: int | None = None,
+            #最新の開始時刻から残す日数
+            days: float | None = None,
+            #古いデータをコールドストレージに移すかどうか
+            cold: bool = False,
+            #削除する行数がこの値を超えるまでは整理しない(追記するストレージで毎回書き直さないため)
+            slack: int = 0,
+        ) -> None:
+        super().__init__()
+
+        self.rows = rows
+        self.days = days
+        self.cold = cold
+        self.slack = slack
+
+    def expired(
+            self,
+            #昇順に並んだ開始時刻
+            start_time: pd.Series,
+        ) -> np.ndarray:
+        """
+        開始時刻を渡すと、保存期間を過ぎたデータの位置をTrueにした配列を返す関数
+        """
+        start_time = pd.to_datetime(start_time).to_numpy()
+        expired = np.zeros(start_time.size, dtype=bool)
+
+        if self.rows is not None:
+            expired[: max(start_time.size - self.rows, 0)] = True
+
+        if self.days is not None and start_time.size > 0:
+            expired |= start_time < start_time[-1] - np.timedelta64(int(self.days * 24 * 60 * 60), 's')
+
+        return expired
+
+
+def retention_for(
+        symbol: str,
+        interval: str,
+    ) -> RetentionPolicy:
+    """
+    configのRETENTIONからシンボルとローソク足の時間に合った保存期間を返す関数
+    登録されていない場合はDEFAULT_RETENTIONを使う
+    """
+    return RetentionPolicy(
+        **config.RETENTION.get((symbol, interval), config.DEFAULT_RETENTION)
+    )
+
+
+class KlineStorage():
+    """
+    ローソク足や分析結果のDataFrameを保存するストレージの基底クラス
+    """
+
+    def __init__(
+            self,
+            #保存先のpath
+            path: Path,
+        ) -> None:
+        super().__init__()
+
+        self.path = Path(path)
+
+    def exists(self) -> bool:
+        """
+        保存されたデータがあるかどうかを返す関数
+        """
+        return self.path.exists()
+
+    def signature(self) -> tuple:
+        """
+        保存されたファイルの更新時刻とサイズをまとめたタプルを返す関数
+        ファイルが書き直された場合は値が変わるため、キャッシュが古いかどうかの判定に使う
+        """
+        stat = os.stat(self.path)
+
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def read(
+            self,
+            #この時刻以降のデータだけを読み込む
+            start: datetime | str | None = None,
+            #この時刻以前のデータだけを読み込む
+            end: datetime | str | None = None,
+            #読み込むカラム。Noneの場合はすべてのカラム
+            columns: list[str] | None = None,
+        ) -> pd.DataFrame:
+        """
+        保存されたデータを開始時刻の範囲とカラムを指定して読み込んでDataFrameで返す関数
+        """
+        raise NotImplementedError
+
+    def write(
+            self,
+            df: pd.DataFrame,
+        ) -> None:
+        """
+        保存されたデータをdfで置き換える関数
+        """
+        raise NotImplementedError
+
+    def append(
+            self,
+            df: pd.DataFrame,
+        ) -> pd.DataFrame:
+        """
+        dfのうち開始時刻がまだ保存されていないデータだけを追加して、追加したデータを返す関数
+        """
+        raise NotImplementedError
+
+    def export_csv(
+            self,
+            path: Path,
+        ) -> None:
+        """
+        保存されたデータをpathにcsvで書き出す関数
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.read().to_csv(path)
+
+    def cold_storage(self) -> 'KlineStorage':
+        """
+        保存期間を過ぎたデータを移すストレージを返す関数
+        (ローソク足の時間).cold.(拡張子)に保存する
+        """
+        return open_storage(
+            self.path.with_name(f'{self.path.stem}.cold{self.path.suffix}')
+        )
+
+    def integrity(self) -> 'IntegrityIndex':
+        """
+        保存されたデータの整合性の情報を(ローソク足の時間).integrity.jsonに記録するIntegrityIndexを返す関数
+        """
+        return IntegrityIndex(path=self.path.with_name(f'{self.path.stem}.integrity.json'))
+
+    def gaps(
+            self,
+            #ローソク足1本の長さ(ms)
+            step: int,
+        ) -> np.ndarray:
+        """
+        保存されたデータの開始時刻だけを読み込んで、欠けている期間の配列を返す関数
+        """
+        if not self.exists():
+            return np.empty((0, 2), dtype=np.int64)
+
+        return find_gaps(start_time=self.read(columns=['開始時刻'])['開始時刻'], step=step)
+
+    def read_all(
+            self,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+            columns: list[str] | None = None,
+        ) -> pd.DataFrame:
+        """
+        コールドストレージのデータも含めた全期間のデータを読み込んで返す関数
+        """
+        df = self.read(start=start, end=end, columns=columns)
+        cold_storage = self.cold_storage()
+
+        if not cold_storage.exists():
+            return df
+
+        cold_df = cold_storage.read(start=start, end=end, columns=columns)
+        df = pd.concat([cold_df, df], axis=0)
+
+        if '開始時刻' in df.columns:
+            df = df[~pd.to_datetime(df['開始時刻']).duplicated(keep='last')]
+
+        return df.reset_index(drop=True)
+
+    def apply_retention(
+            self,
+            policy: RetentionPolicy,
+            #保存するデータ。Noneの場合は保存されているデータを整理する
+            df: pd.DataFrame | None = None,
+        ) -> pd.DataFrame | None:
+        """
+        policyに従って保存期間を過ぎたデータを削除して(coldの場合はコールドストレージに移して)、
+        残ったデータを保存する関数
+        dfを渡した場合は必ず保存し、渡さない場合は削除するデータがslackを超えたときだけ書き直す
+        保存したデータを返し、書き直さなかった場合はNoneを返す
+        """
+        if df is None:
+            expired = policy.expired(self.read(columns=['開始時刻'])['開始時刻'])
+            if expired.sum() <= policy.slack:
+                return None
+            df = self.read()
+
+        df = df.reset_index(drop=True)
+        expired = policy.expired(df['開始時刻'])
+
+        if policy.cold and expired.any():
+            self.cold_storage().append(df=df[expired])
+
+        df = df[~expired].reset_index(drop=True)
+        self.write(df=df)
+
+        return df
+
+    def filter_range(
+            self,
+            df: pd.DataFrame,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+            columns: list[str] | None = None,
+        ) -> pd.DataFrame:
+        """
+        読み込んだDataFrameを開始時刻の範囲とカラムで絞り込んで返す関数
+        """
+        if start is not None or end is not None:
+            start_time = pd.to_datetime(df['開始時刻']).to_numpy()
+            mask = np.ones(start_time.size, dtype=bool)
+            if start is not None:
+                mask &= pd.Timestamp(start).to_datetime64() <= start_time
+            if end is not None:
+                mask &= start_time <= pd.Timestamp(end).to_datetime64()
+            df = df[mask].reset_index(drop=True)
+
+        if columns is not None:
+            df = df[columns]
+
+        return df
+
+
+class IntegrityIndex():
+    """
+    保存されたデータの整合性の情報をjsonファイルに記録するクラス
+    取引所にローソク足がなく、何度リクエストしても埋まらない欠けている期間を記録して、
+    欠けている期間を取得するときに同じ期間を繰り返しリクエストしないようにする
+    開始時刻がUTCで保存されているかどうかも記録する
+    """
+
+    def __init__(
+            self,
+            #記録するjsonファイルのpath
+            path: Path,
+        ) -> None:
+        super().__init__()
+
+        self.path = Path(path)
+        #埋まらないと判定した期間の[[最初の開始時刻(ms), 最後の開始時刻(ms)]]の配列
+        self.unfillable = np.empty((0, 2), dtype=np.int64)
+        #まだ埋まっていない欠けている期間ごとのリクエストした回数
+        self.attempts = {}
+        #開始時刻の基準('utc')。ローカル時刻で保存していた以前のデータかどうか確認していない場合はNone
+        self.time_base = None
+
+        if self.path.exists():
+            data = json.loads(self.path.read_text())
+            self.unfillable = np.array(data.get('unfillable', []), dtype=np.int64).reshape(-1, 2)
+            self.attempts = data.get('attempts', {})
+            self.time_base = data.get('time_base')
+
+    def exclude(
+            self,
+            #[[欠けている最初の開始時刻(ms), 欠けている最後の開始時刻(ms)]]の配列
+            gaps: np.ndarray,
+            #ローソク足1本の長さ(ms)
+            step: int,
+        ) -> np.ndarray:
+        """
+        欠けている期間から埋まらないと判定した期間を取り除いた期間の配列を返す関数
+        """
+        remaining = []
+
+        for gap_start, gap_end in gaps:
+            pieces = [(int(gap_start), int(gap_end))]
+            for unfillable_start, unfillable_end in self.unfillable:
+                pieces = [
+                    piece
+                    for start, end in pieces
+                    for piece in (
+                        (start, min(end, unfillable_start - step)),
+                        (max(start, unfillable_end + step), end),
+                    )
+                    if piece[0] <= piece[1]
+                ]
+            remaining.extend(pieces)
+
+        return np.array(remaining, dtype=np.int64).reshape(-1, 2)
+
+    def record_attempts(
+            self,
+            #リクエストした後もまだ欠けている期間の配列
+            gaps: np.ndarray,
+            #この回数リクエストしても埋まらない期間を埋まらないと判定する
+            max_attempts: int,
+        ) -> np.ndarray:
+        """
+        まだ欠けている期間のリクエストした回数を数えて、max_attempts回に達した期間を
+        埋まらない期間に移して保存し、新しく埋まらないと判定した期間の配列を返す関数
+        埋まった期間の回数は消す
+        """
+        attempts = {}
+        unfillable = []
+
+        for gap_start, gap_end in gaps:
+            key = f'{gap_start}-{gap_end}'
+            count = self.attempts.get(key, 0) + 1
+            if count >= max_attempts:
+                unfillable.append((int(gap_start), int(gap_end)))
+            else:
+                attempts[key] = count
+
+        unfillable = np.array(unfillable, dtype=np.int64).reshape(-1, 2)
+        self.attempts = attempts
+        self.unfillable = np.concatenate([self.unfillable, unfillable])
+        self.save()
+
+        return unfillable
+
+    def save(self) -> None:
+        """
+        記録をjsonファイルに保存する関数
+        途中まで書いたファイルを読まれないように、一時ファイルに書いてから置き換える
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        temporary_path.write_text(json.dumps({
+            'unfillable': self.unfillable.tolist(),
+            'attempts': self.attempts,
+            'time_base': self.time_base,
+        }))
+        temporary_path.replace(self.path)
+
+
+class CsvStorage(KlineStorage):
+    """
+    csvファイル1つに保存するストレージ
+    追加するたびにファイル全体を書き直す
+    """
+
+    def read(
+            self,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+            columns: list[str] | None = None,
+        ) -> pd.DataFrame:
+        #ファイルが変わっていない場合は前回読み込んで型を変換したDataFrameを使う
+        df = frame_cache.get(
+            path=self.path,
+            signature=self.signature(),
+            loader=lambda: to_typed(df=pd.read_csv(
+                self.path,
+                header=0,
+                index_col=0,
+            ).reset_index(drop=True))
+        )
+
+        return self.filter_range(df=df, start=start, end=end, columns=columns)
+
+    def write(
+            self,
+            df: pd.DataFrame,
+        ) -> None:
+        df = df.reset_index(drop=True)
+        typed_df = to_typed(df=df)
+
+        #開始時刻は日付だけの行があっても同じ形式になるように文字列にして保存する
+        if '開始時刻' in df.columns:
+            df['開始時刻'] = pd.to_datetime(df['開始時刻']).dt.strftime('%Y-%m-%d %H:%M:%S')
+
+        #上の階層のディレクトリがない場合は作成する
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(self.path)
+
+        #次に読み込むときにファイルを読まなくてよいように、書き込んだデータをキャッシュに入れる
+        frame_cache.put(path=self.path, signature=self.signature(), df=typed_df)
+
+    def append(
+            self,
+            df: pd.DataFrame,
+        ) -> pd.DataFrame:
+        if not self.exists():
+            self.write(df=df)
+            return df
+
+        stored_df = self.read()
+        new_df = df[~pd.to_datetime(df['開始時刻']).isin(pd.to_datetime(stored_df['開始時刻']))]
+
+        #欠けていた期間のデータを追加した場合も開始時刻の順に並べて保存する
+        concat_df = pd.concat([stored_df, new_df], axis=0)
+        self.write(df=concat_df.iloc[np.argsort(pd.to_datetime(concat_df['開始時刻']).to_numpy(), kind='stable')])
+
+        return new_df
+
+
+class ArrowStorage(KlineStorage):
+    """
+    pyarrowでParquetかFeatherのファイルを1つのディレクトリにまとめて保存するストレージ
+    開始時刻はdatetime型、価格はfloat型の列で保存して、追加するときは新しいデータだけを
+    別のファイルとして書き込む
+    読み込むときは開始時刻の範囲と列を指定して必要なデータだけを読み込む
+    """
+
+    #ファイル形式ごとの拡張子
+    FORMATS = {
+            'parquet': '.parquet',
+            'feather': '.feather',
+        }
+
+    def __init__(
+            self,
+            path: Path,
+            #parquetかfeather
+            format: str = 'parquet',
+        ) -> None:
+        super().__init__(path=path)
+
+        if format not in self.FORMATS:
+            raise ValueError(f'対応していない形式です: {format}')
+
+        self.format = format
+
+        try:
+            import pyarrow
+        except ImportError as e:
+            raise ImportError(
+                'ParquetやFeatherで保存するにはpyarrowをインストールしてください'
+            ) from e
+
+    def exists(self) -> bool:
+        return self.path.is_dir() and any(self.parts())
+
+    def signature(self) -> tuple:
+        return tuple(
+            (part.name, stat.st_mtime_ns, stat.st_size)
+            for part in self.parts()
+            for stat in [os.stat(part)]
+        )
+
+    def parts(self) -> list[Path]:
+        """
+        保存されているファイルを書き込んだ順番に並べて返す関数
+        """
+        return sorted(self.path.glob(f'part-*{self.FORMATS[self.format]}'))
+
+    def dataset(self):
+        """
+        保存されているファイルをまとめたpyarrowのDatasetを返す関数
+        """
+        import pyarrow.dataset as ds
+
+        return ds.dataset(
+            [str(part) for part in self.parts()],
+            format='parquet' if self.format == 'parquet' else 'ipc',
+        )
+
+    def read(
+            self,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+            columns: list[str] | None = None,
+        ) -> pd.DataFrame:
+        #全期間を読み込む場合はファイルが変わっていなければ前回読み込んだDataFrameを使う
+        if start is None and end is None:
+            df = frame_cache.get(
+                path=self.path,
+                signature=self.signature(),
+                loader=self.read_dataset
+            )
+            return df if columns is None else df[columns]
+
+        return self.read_dataset(start=start, end=end, columns=columns)
+
+    def read_dataset(
+            self,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+            columns: list[str] | None = None,
+        ) -> pd.DataFrame:
+        """
+        保存されたファイルから開始時刻の範囲とカラムを指定してDataFrameを読み込む関数
+        """
+        import pyarrow.dataset as ds
+
+        dataset = self.dataset()
+
+        #開始時刻の範囲はファイルの統計情報を使って読み込む前に絞り込む
+        expression = None
+        if start is not None:
+            expression = ds.field('開始時刻') >= pd.Timestamp(start).to_pydatetime()
+        if end is not None:
+            end_expression = ds.field('開始時刻') <= pd.Timestamp(end).to_pydatetime()
+            expression = end_expression if expression is None else expression & end_expression
+
+        #並べ替えのために開始時刻は必ず読み込む
+        read_columns = None if columns is None else list(dict.fromkeys(['開始時刻', *columns]))
+
+        df = dataset.to_table(
+            columns=read_columns,
+            filter=expression,
+        ).to_pandas()
+
+        df = df.sort_values(by='開始時刻', kind='stable').reset_index(drop=True)
+
+        return df if columns is None else df[columns]
+
+    def write(
+            self,
+            df: pd.DataFrame,
+        ) -> None:
+        #以前のファイルを削除してから1つのファイルとして書き込む
+        for part in self.parts():
+            part.unlink()
+
+        self.write_part(df=df, number=0)
+
+    def append(
+            self,
+            df: pd.DataFrame,
+        ) -> pd.DataFrame:
+        if not self.exists():
+            self.write(df=df)
+            return df
+
+        #保存済みの開始時刻の列だけを読み込んで重複しないデータを書き込む
+        stored_start_time = self.read(columns=['開始時刻'])['開始時刻']
+        new_df = df[~pd.to_datetime(df['開始時刻']).isin(stored_start_time)]
+
+        if not new_df.empty:
+            number = int(self.parts()[-1].stem.split('-')[-1]) + 1
+            self.write_part(df=new_df, number=number)
+
+        return new_df
+
+    def write_part(
+            self,
+            df: pd.DataFrame,
+            number: int,
+        ) -> None:
+        """
+        dfを型を変換してからnumber番目のファイルとして書き込む関数
+        """
+        import pyarrow as pa
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        part = self.path / f'part-{number:06d}{self.FORMATS[self.format]}'
+
+        table = pa.Table.from_pandas(
+            to_typed(df=df).reset_index(drop=True),
+            preserve_index=False,
+        )
+
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(table, part)
+        else:
+            import pyarrow.feather as feather
+            feather.write_feather(table, part)
+
+
+class MemmapStorage(KlineStorage):
+    """
+    ローソク足を固定長の数値のレコード(開始時刻はdatetime64[ns]、それ以外はfloat64)にして
+    開始時刻の順に1つのバイナリファイルに保存し、numpy.memmapで読み込むストレージ
+    開始時刻の列を時間の索引として二分探索するため、長い期間のデータからでも
+    ファイル全体を読み込まずに任意の期間をコピーせずに取り出せる
+    ローソク足のカラムだけを保存できる(分析結果は保存できない)
+    """
+
+    COLUMNS = ['開始時刻', '始値', '高値', '安値', '終値', '取引量', '取引総額']
+    #1本のローソク足のレコードの形式(リトルエンディアンの固定長)
+    DTYPE = np.dtype([('開始時刻', '<M8[ns]'), *[(column, '<f8') for column in COLUMNS[1:]]])
+
+    def records(
+            self,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+        ) -> np.ndarray:
+        """
+        保存されたローソク足のうち開始時刻の範囲のレコードを、ファイルをメモリにマップしたまま
+        (コピーせずに)返す関数
+        records['高値']のようにカラム名で列を参照できる
+        """
+        if not self.exists() or os.path.getsize(self.path) == 0:
+            return np.empty(0, dtype=self.DTYPE)
+
+        records = np.memmap(self.path, dtype=self.DTYPE, mode='r')
+
+        return records[self.index(records=records, start=start, end=end)]
+
+    def index(
+            self,
+            records: np.ndarray,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+        ) -> slice:
+        """
+        開始時刻の昇順に並んだレコードから、開始時刻の範囲の位置を二分探索してsliceで返す関数
+        """
+        start_time = records['開始時刻']
+        first = 0 if start is None else np.searchsorted(start_time, pd.Timestamp(start).to_datetime64(), side='left')
+        last = start_time.size if end is None else np.searchsorted(start_time, pd.Timestamp(end).to_datetime64(), side='right')
+
+        return slice(int(first), int(last))
+
+    def to_records(
+            self,
+            df: pd.DataFrame,
+        ) -> np.ndarray:
+        """
+        ローソク足のDataFrameを開始時刻の順に並べたレコードの配列にして返す関数
+        """
+        missing = [column for column in self.COLUMNS if column not in df.columns]
+        if missing:
+            raise ValueError(f'ローソク足のカラムがありません: {missing}')
+
+        records = np.empty(len(df), dtype=self.DTYPE)
+        records['開始時刻'] = pd.to_datetime(df['開始時刻']).to_numpy(dtype='datetime64[ns]')
+        for column in self.COLUMNS[1:]:
+            records[column] = pd.to_numeric(df[column]).to_numpy(dtype=np.float64)
+
+        return records[np.argsort(records['開始時刻'], kind='stable')]
+
+    def read(
+            self,
+            start: datetime | str | None = None,
+            end: datetime | str | None = None,
+            columns: list[str] | None = None,
+        ) -> pd.DataFrame:
+        records = self.records(start=start, end=end)
+
+        return pd.DataFrame({
+            column: np.array(records[column])
+            for column in (self.COLUMNS if columns is None else columns)
+        })
+
+    def write(
+            self,
+            df: pd.DataFrame,
+        ) -> None:
+        self.write_records(records=self.to_records(df=df))
+
+    def write_records(
+            self,
+            records: np.ndarray,
+        ) -> None:
+        """
+        レコードの配列でファイルを置き換える関数
+        途中まで書いたファイルを読まれないように、一時ファイルに書いてから置き換える
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        np.ascontiguousarray(records, dtype=self.DTYPE).tofile(temporary_path)
+        temporary_path.replace(self.path)
+
+    def append(
+            self,
+            df: pd.DataFrame,
+        ) -> pd.DataFrame:
+        if not self.exists():
+            self.write(df=df)
+            return df
+
+        stored = self.records()
+        start_time = pd.to_datetime(df['開始時刻']).to_numpy(dtype='datetime64[ns]')
+        new_df = df[~self.contains(records=stored, start_time=start_time)]
+        new_records = self.to_records(df=new_df)
+
+        if new_records.size == 0:
+            return new_df
+
+        #保存済みのデータより新しいローソク足だけの場合はファイルの後ろに書き足し、
+        #欠けていた期間のローソク足を追加する場合は開始時刻の順に並べて書き直す
+        if stored.size == 0 or stored['開始時刻'][-1] < new_records['開始時刻'][0]:
+            with open(self.path, 'ab') as f:
+                new_records.tofile(f)
+        else:
+            records = np.concatenate([stored, new_records])
+            self.write_records(records=records[np.argsort(records['開始時刻'], kind='stable')])
+
+        return new_df
+
+    def contains(
+            self,
+            #開始時刻の昇順に並んだレコード
+            records: np.ndarray,
+            start_time: np.ndarray,
+        ) -> np.ndarray:
+        """
+        開始時刻ごとに、レコードに同じ開始時刻があるかどうかを返す関数
+        ファイル全体をメモリに読み込まないように、保存済みの最後の開始時刻より新しい場合は
+        最後のレコードだけと比べ、それ以外は二分探索する
+        """
+        stored_time = records['開始時刻']
+        if stored_time.size == 0 or start_time.size == 0 or stored_time[-1] < start_time.min():
+            return np.zeros(start_time.size, dtype=bool)
+
+        positions = np.searchsorted(stored_time, start_time, side='left')
+        is_inside = positions < stored_time.size
+        is_stored = np.zeros(start_time.size, dtype=bool)
+        is_stored[is_inside] = stored_time[positions[is_inside]] == start_time[is_inside]
+
+        return is_stored
+
+
+def open_storage(
+        path: Path,
+    ) -> KlineStorage:
+    """
+    pathの拡張子に合わせたストレージを返す関数
+    .csvはCsvStorage、.parquetと.featherはArrowStorage、.binはMemmapStorage
+    """
+    path = Path(path)
+
+    match path.suffix:
+        case '.csv':
+            return CsvStorage(path=path)
+        case '.parquet':
+            return ArrowStorage(path=path, format='parquet')
+        case '.feather':
+            return ArrowStorage(path=path, format='feather')
+        case '.bin':
+            return MemmapStorage(path=path)
+        case _:
+            raise ValueError(f'対応していない拡張子です: {path.suffix}')
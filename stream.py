@@ -0,0 +1,395 @@
+import asyncio
+from collections import deque
+import json
+import logging
+import numpy as np
+import pandas as pd
+import time
+
+import analysis
+import metrics
+import scrape
+import signals
+
+#websocketsがインストールされている場合だけKlineStreamを使える
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+logger = logging.getLogger('auto_trade.stream')
+
+
+class KlineStream():
+    """
+    bybitのkline(ローソク足)のWebSocketを購読して、確定したローソク足(confirmがTrue)を
+    受け取るたびにストレージに保存してダウ理論で分析するクラス
+    カテゴリーごとに1つの接続で複数のシンボルを購読し、再接続したときは切断中の
+    ローソク足をREST APIで取得して補う
+    """
+
+    #WebSocketのエンドポイント(後ろにカテゴリーをつける)
+    ENDPOINT = 'wss://stream.bybit.com/v5/public'
+    #1回のsubscribeで送る購読の数
+    SUBSCRIBE_BATCH = 10
+
+    def __init__(
+            self,
+            #[(カテゴリー, シンボル, ローソク足の時間)]のリスト
+            watchlist: list[tuple[str, str, str]],
+            #WebSocketのエンドポイント(ローカルのスタブサーバーで確認するときに変更する)
+            endpoint: str = ENDPOINT,
+            #切断中のローソク足を取得するREST APIのエンドポイント
+            rest_endpoint: str = scrape.ScrapeMarketData.ENDPOINT,
+            #pingを送る間隔(秒)
+            ping_interval: float = 20.0,
+            #再接続するまでの最初の待ち時間(秒)。失敗するたびに2倍にする
+            reconnect_delay: float = 1.0,
+            #再接続するまでの待ち時間の上限(秒)
+            max_reconnect_delay: float = 30.0,
+            #トレンドが変わったイベントを発行する先。Noneの場合は新しく作成する(self.signalsで購読する)
+            signal_bus: signals.SignalBus | None = None,
+            #ScrapeMarketDataに渡す引数(session、storage_formatなど)
+            **scrape_kwargs,
+        ) -> None:
+        super().__init__()
+
+        if websockets is None:
+            raise ImportError(
+                'WebSocketでローソク足を受け取るにはwebsocketsをインストールしてください'
+            )
+
+        self.watchlist = [tuple(job) for job in watchlist]
+        self.endpoint = endpoint.rstrip('/')
+        self.rest_endpoint = rest_endpoint
+        self.ping_interval = ping_interval
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.scrape_kwargs = scrape_kwargs
+
+        #ジョブごとのScrapeMarketData
+        self.scrapers = {}
+        #ジョブごとに最後に処理した確定したローソク足の開始時刻(ms)
+        self.latest = {}
+        #ジョブごとにローソク足が確定するたびに更新する分析結果(IncrementalDow)
+        self.dows = {}
+        #トレンドが変わったイベントの発行先
+        self.signals = signal_bus if signal_bus is not None else signals.SignalBus()
+        #ジョブごとのローソク足の確定から処理が終わるまでの時間(秒)
+        self.latencies = {job: deque(maxlen=1000) for job in self.watchlist}
+        #再接続した回数
+        self.reconnect_count = 0
+        #ジョブごとの最後のエラーとエラーの回数
+        self.errors = {}
+        self.error_counts = {job: 0 for job in self.watchlist}
+        #切断中のローソク足を取得できず、次のローソク足を受け取ったときにもう一度取得するジョブ
+        self.unfilled = set()
+
+        self.stop_event = None
+        #ジョブごとにローソク足の保存と分析を順番に行うためのロック
+        self.locks = {}
+
+    def topic(
+            self,
+            job: tuple[str, str, str],
+        ) -> str:
+        """
+        ジョブのklineの購読名(kline.(ローソク足の時間).(シンボル))を返す関数
+        """
+        return f'kline.{job[2]}.{job[1]}'
+
+    def scraper(
+            self,
+            job: tuple[str, str, str],
+        ) -> scrape.ScrapeMarketData:
+        """
+        ジョブのScrapeMarketDataを返す関数
+        保存されたデータがある場合は最後のローソク足の開始時刻から処理を続ける
+        """
+        if job not in self.scrapers:
+            scraper = scrape.ScrapeMarketData(
+                category=job[0],
+                symbol=job[1],
+                interval=job[2],
+                endpoint=self.rest_endpoint,
+                **self.scrape_kwargs
+            )
+            self.scrapers[job] = scraper
+
+            if scraper.df is not None and not scraper.df.empty:
+                self.latest[job] = int(
+                    pd.to_datetime(scraper.df['開始時刻']).to_numpy().astype('datetime64[ms]').astype(np.int64)[-1]
+                )
+
+        return self.scrapers[job]
+
+    async def run(self) -> None:
+        """
+        stopが呼ばれるまで、カテゴリーごとにWebSocketに接続してローソク足を受け取る関数
+        止まるときはトレンドが変わったイベントの購読を閉じる
+        """
+        self.stop_event = asyncio.Event()
+        self.locks = {job: asyncio.Lock() for job in self.watchlist}
+
+        for job in self.watchlist:
+            self.scraper(job=job)
+
+        categories = {}
+        for job in self.watchlist:
+            categories.setdefault(job[0], []).append(job)
+
+        try:
+            await asyncio.gather(*[
+                self.run_category(category=category, jobs=jobs)
+                for category, jobs in categories.items()
+            ])
+        finally:
+            #受け取る側が待ち続けないように、イベントの購読を閉じる
+            self.signals.close()
+
+    def stop(self) -> None:
+        """
+        受信を止める関数
+        """
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    async def run_category(
+            self,
+            category: str,
+            jobs: list[tuple[str, str, str]],
+        ) -> None:
+        """
+        1つのカテゴリーのWebSocketに接続して購読し、切断された場合は待ち時間を増やしながら再接続する関数
+        """
+        url = f'{self.endpoint}/{category}'
+        delay = self.reconnect_delay
+
+        while not self.stop_event.is_set():
+            try:
+                async with websockets.connect(url, ping_interval=None) as websocket:
+                    await self.subscribe(websocket=websocket, jobs=jobs)
+
+                    #接続していなかった間に確定したローソク足をREST APIで取得する
+                    await asyncio.gather(*[self.fill_gap(job=job) for job in jobs])
+                    delay = self.reconnect_delay
+
+                    await self.receive(websocket=websocket, jobs=jobs)
+
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+                if self.stop_event.is_set():
+                    break
+
+                self.reconnect_count += 1
+                metrics.increment('stream.reconnects', category=category)
+                logger.warning('%s 再接続します(%.1f秒後): %r', url, delay, e)
+
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def subscribe(
+            self,
+            websocket,
+            jobs: list[tuple[str, str, str]],
+        ) -> None:
+        """
+        ジョブのklineをSUBSCRIBE_BATCH個ずつまとめて購読する関数
+        """
+        topics = [self.topic(job) for job in jobs]
+
+        for i in range(0, len(topics), self.SUBSCRIBE_BATCH):
+            await websocket.send(json.dumps({
+                'op': 'subscribe',
+                'args': topics[i:i + self.SUBSCRIBE_BATCH],
+            }))
+
+    async def receive(
+            self,
+            websocket,
+            jobs: list[tuple[str, str, str]],
+        ) -> None:
+        """
+        stopが呼ばれるか切断されるまでメッセージを受け取って処理する関数
+        ping_intervalごとにpingを送って接続を保つ
+        """
+        jobs_by_topic = {self.topic(job): job for job in jobs}
+        stop_task = asyncio.ensure_future(self.stop_event.wait())
+        receive_task = stop_task
+
+        try:
+            while not self.stop_event.is_set():
+                receive_task = asyncio.ensure_future(websocket.recv())
+                done, _ = await asyncio.wait(
+                    {receive_task, stop_task},
+                    timeout=self.ping_interval,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if receive_task not in done:
+                    receive_task.cancel()
+                    if not self.stop_event.is_set():
+                        await websocket.send(json.dumps({'op': 'ping'}))
+                    continue
+
+                #読み込めないメッセージは読み飛ばして受信を続ける
+                try:
+                    message = json.loads(receive_task.result())
+                except ValueError as e:
+                    metrics.increment('stream.invalid_messages')
+                    logger.warning('読み込めないメッセージを読み飛ばします: %r', e)
+                    continue
+
+                if not isinstance(message, dict):
+                    continue
+
+                job = jobs_by_topic.get(message.get('topic'))
+                if job is not None:
+                    await self.handle_kline(job=job, data=message.get('data', []))
+
+        finally:
+            stop_task.cancel()
+            if not receive_task.done():
+                receive_task.cancel()
+
+    async def handle_kline(
+            self,
+            job: tuple[str, str, str],
+            #klineのメッセージのdata
+            data: list[dict],
+        ) -> None:
+        """
+        klineのメッセージから確定したローソク足だけを取り出して処理する関数
+        切断中のローソク足を取得できていない場合は先に取得する
+        処理に失敗した場合はエラーを記録して、ほかのジョブの受信を続ける
+        """
+        try:
+            if job in self.unfilled:
+                await self.fill_gap(job=job)
+
+                #取得できなかった場合は欠けた期間の後のローソク足を保存せずに、次に取得するときにまとめて補う
+                if job in self.unfilled:
+                    return
+
+            closed = [
+                [
+                    kline['start'],
+                    kline['open'],
+                    kline['high'],
+                    kline['low'],
+                    kline['close'],
+                    kline['volume'],
+                    kline['turnover'],
+                ]
+                for kline in data
+                if kline.get('confirm')
+            ]
+
+            if closed:
+                await self.process(job=job, data=closed)
+
+        except Exception as e:
+            self.record_error(job=job, error=e)
+
+    async def fill_gap(
+            self,
+            job: tuple[str, str, str],
+        ) -> None:
+        """
+        最後に処理したローソク足の次から、最後に確定したローソク足までをREST APIで取得して処理する関数
+        まだ処理したローソク足がない場合は何もしない
+        取得や処理に失敗した場合はエラーを記録して、次のローソク足を受け取ったときにもう一度取得する
+        """
+        self.unfilled.discard(job)
+
+        if job not in self.latest:
+            return
+
+        step = scrape.ScrapeMarketData.INTERVAL_MS[job[2]]
+        start = self.latest[job] + step
+        #確定していないローソク足を含めないように、現在のローソク足の1本前までにする
+        end = int(time.time() * 1000) // step * step - step
+
+        if start > end:
+            return
+
+        scraper = self.scrapers[job]
+        try:
+            df = await asyncio.to_thread(
+                scraper.backfill_kline,
+                start=start,
+                end=end,
+                progress=False
+            )
+            metrics.increment('stream.gap_rows', len(df), symbol=job[1], interval=job[2])
+
+            await self.process(job=job, df=df)
+
+        except Exception as e:
+            self.unfilled.add(job)
+            self.record_error(job=job, error=e)
+
+    async def process(
+            self,
+            job: tuple[str, str, str],
+            #[開始時刻(ms), 始値, 高値, 安値, 終値, 取引量, 取引総額]のリスト
+            data: list | None = None,
+            df: pd.DataFrame | None = None,
+        ) -> None:
+        """
+        確定したローソク足のうち、まだ処理していないものを保存してダウ理論で分析する関数
+        保存と分析はイベントループを止めないようにスレッドで実行する
+        """
+        scraper = self.scrapers[job]
+
+        async with self.locks[job]:
+            if df is None:
+                df = scraper.to_dataframe(data=data)
+
+            start_time = df['開始時刻'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+            if job in self.latest:
+                df = df[start_time > self.latest[job]]
+                start_time = start_time[start_time > self.latest[job]]
+
+            if df.empty:
+                return
+
+            #ローソク足の確定(開始時刻 + 1本の長さ)の時刻(秒)
+            step = scrape.ScrapeMarketData.INTERVAL_MS[job[2]]
+            closed_at = (int(start_time.max()) + step) / 1000
+
+            def save_and_analyze() -> analysis.IncrementalDow:
+                #トレンドが変わったイベントもこのスレッドで発行するため、
+                #policyが'block'のキューで待つ場合もイベントループを止めない
+                with metrics.span('stream.process', symbol=job[1], interval=job[2]):
+                    scraper.save(df=df)
+                    return analysis.IncrementalDow.advance(
+                        dows=self.dows,
+                        job=job,
+                        klines_df=scraper.df,
+                        PATH=scraper.PATH,
+                        signal_bus=self.signals,
+                        interval_ms=step
+                    )
+
+            await asyncio.to_thread(save_and_analyze)
+            self.latest[job] = int(start_time.max())
+
+            #ローソク足の確定から分析が終わるまでの時間
+            self.latencies[job].append(time.time() - closed_at)
+
+    def record_error(
+            self,
+            job: tuple[str, str, str],
+            error: Exception,
+        ) -> None:
+        """
+        ジョブの処理中に起きたエラーをログに出力して数え、最後のエラーとして記録する関数
+        1つのジョブのエラーで接続やほかのジョブの処理が止まらないように、エラーは送出しない
+        """
+        logger.error('%s %s の処理に失敗しました: %r', job[1], job[2], error, exc_info=error)
+        self.errors[job] = error
+        self.error_counts[job] += 1
+        metrics.increment('stream.errors', symbol=job[1], interval=job[2])
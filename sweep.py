@@ -0,0 +1,160 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+import backtest
+import storage
+
+#共有メモリに入れるローソク足の列(開始時刻はint64、それ以外はfloat64で入れる)
+SHARED_COLUMNS = ['開始時刻', '始値', '高値', '安値', '終値']
+
+#ワーカープロセスで開いた共有メモリ({共有メモリの名前: (SharedMemory, 配列のdict)})
+_attached = {}
+
+
+def share_klines(
+        klines_df: pd.DataFrame,
+    ) -> tuple[shared_memory.SharedMemory, int]:
+    """
+    ローソク足のDataFrameを開始時刻と始値、高値、安値、終値の列に分けて共有メモリに1回だけ書き込み、
+    共有メモリと行数を返す関数
+    """
+    total_data_count = len(klines_df)
+    shm = shared_memory.SharedMemory(
+        create=True,
+        size=max(len(SHARED_COLUMNS) * total_data_count * 8, 1)
+    )
+
+    arrays = attach_arrays(buffer=shm.buf, total_data_count=total_data_count)
+    arrays['開始時刻'][:] = pd.to_datetime(klines_df['開始時刻']).to_numpy().astype('datetime64[ns]').astype(np.int64)
+    for column in SHARED_COLUMNS[1:]:
+        arrays[column][:] = klines_df[column].to_numpy(dtype=np.float64)
+
+    return shm, total_data_count
+
+
+def attach_arrays(
+        buffer: memoryview,
+        total_data_count: int,
+    ) -> dict:
+    """
+    共有メモリのバッファをコピーせずに列ごとのNumPy配列として返す関数
+    """
+    return {
+        column: np.ndarray(
+            (total_data_count,),
+            dtype=np.int64 if column == '開始時刻' else np.float64,
+            buffer=buffer,
+            offset=i * total_data_count * 8,
+        )
+        for i, column in enumerate(SHARED_COLUMNS)
+    }
+
+
+def run_task(
+        #共有メモリの名前
+        name: str,
+        total_data_count: int,
+        #Backtesterに渡す引数(periodとルールの組み合わせ)
+        params: dict,
+    ) -> dict:
+    """
+    ワーカープロセスで共有メモリのローソク足を開いてバックテストを実行し、結果を返す関数
+    共有メモリはプロセスごとに1回だけ開いて使い回す
+    """
+    if name not in _attached:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = (shm, attach_arrays(buffer=shm.buf, total_data_count=total_data_count))
+
+    arrays = _attached[name][1]
+
+    return backtest.Backtester(**params).run_arrays(
+        start_time=arrays['開始時刻'].view('datetime64[ns]'),
+        open_prices=arrays['始値'],
+        high=arrays['高値'],
+        low=arrays['安値'],
+        close=arrays['終値'],
+    )
+
+
+class ParameterSweep():
+    """
+    PERIODとトレードルールの組み合わせを、複数のシンボルとローソク足の時間に対して
+    プロセスプールで並列にバックテストして比較するクラス
+    ローソク足は1回だけ読み込んで共有メモリに置き、ワーカーにはコピーせずに渡す
+    """
+
+    #デフォルトで試すPERIODとルール
+    PERIODS = [3, 5, 8, 13]
+    VARIANTS = [{'entry': 'trend'}, {'entry': 'breakout'}]
+
+    def __init__(
+            self,
+            #試すPERIODのリスト。Noneの場合はPERIODS
+            periods: list[int] | None = None,
+            #試すルールのリスト(Backtesterに渡す引数のdict)。Noneの場合はVARIANTS
+            variants: list[dict] | None = None,
+            #プロセスの数。Noneの場合はCPUの数
+            max_workers: int | None = None,
+        ) -> None:
+        super().__init__()
+
+        self.periods = periods if periods is not None else self.PERIODS
+        self.variants = variants if variants is not None else self.VARIANTS
+        self.max_workers = max_workers
+
+    def run(
+            self,
+            #ローソク足のデータのpathのリスト(data/(通貨名)/(ローソク足の時間).(拡張子))
+            paths: list[Path],
+            start: str | None = None,
+            end: str | None = None,
+        ) -> pd.DataFrame:
+        """
+        すべてのpathとPERIODとルールの組み合わせでバックテストを実行して、
+        1行が1つの組み合わせの結果になっているDataFrameを損益の大きい順に返す関数
+        """
+        shared = {}
+        try:
+            #ローソク足はpathごとに1回だけ読み込んで共有メモリに置く
+            for path in paths:
+                klines_df = storage.open_storage(path).read_all(start=start, end=end)
+                shared[Path(path)] = share_klines(klines_df=klines_df)
+
+            tasks = [
+                (path, period, variant)
+                for path, period, variant in itertools.product(shared, self.periods, self.variants)
+            ]
+
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [
+                    executor.submit(
+                        run_task,
+                        shared[path][0].name,
+                        shared[path][1],
+                        {**variant, 'period': period},
+                    )
+                    for path, period, variant in tasks
+                ]
+                results = [future.result() for future in futures]
+
+        finally:
+            for shm, _ in shared.values():
+                shm.close()
+                shm.unlink()
+
+        rows = [
+            {
+                '通貨': path.parent.name,
+                'ローソク足': path.stem,
+                'period': period,
+                **variant,
+                **result,
+            }
+            for (path, period, variant), result in zip(tasks, results)
+        ]
+
+        return pd.DataFrame(rows).sort_values(by='pnl', ascending=False).reset_index(drop=True)
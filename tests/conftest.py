@@ -0,0 +1,116 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import sys
+import threading
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+#リポジトリ直下のモジュールを読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import scrape
+import storage
+
+
+class KlineApi():
+    """
+    bybitのkline apiと同じ形式(新しい順の文字列のリスト)のレスポンスを作るテスト用のクラス
+    ローソク足の値は開始時刻から決まるため、取得したデータを期待する値と比べられる
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        #受け取ったリクエストのパラメーター
+        self.requests = []
+        #ローソク足がない期間の[(最初の開始時刻(ms), 最後の開始時刻(ms))]
+        self.missing = []
+        #retCodeが0以外のレスポンスを返す残りの回数
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def values(
+            #開始時刻(ms)
+            start_time: int,
+        ) -> list[str]:
+        """
+        開始時刻から決まる[開始時刻, 始値, 高値, 安値, 終値, 取引量, 取引総額]を文字列のリストで返す関数
+        """
+        value = start_time // 60000 % 9973 + 100
+
+        return [str(start_time), *map(str, [value, value + 2, value - 1, value + 1, value * 3, value * 30])]
+
+    def response(
+            self,
+            params: dict,
+        ) -> dict:
+        """
+        リクエストのパラメーターからレスポンスのjsonを返す関数
+        """
+        with self.lock:
+            self.requests.append(params)
+            if self.failures > 0:
+                self.failures -= 1
+                return {'retCode': 10006, 'retMsg': 'Too many visits!', 'result': {}}
+
+        step = scrape.ScrapeMarketData.INTERVAL_MS[params['interval']]
+        start = int(params['start'])
+        end = int(params['end'])
+        limit = int(params.get('limit', scrape.ScrapeMarketData.LIMIT))
+
+        rows = [
+            self.values(start_time=start_time)
+            for start_time in range(-(-start // step) * step, end + 1, step)
+            if not any(first <= start_time <= last for first, last in self.missing)
+        ]
+
+        return {'retCode': 0, 'retMsg': 'OK', 'result': {'list': rows[-limit:][::-1]}}
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """
+    data/やanalysis/をテストごとの一時ディレクトリに作成するように作業ディレクトリを移し、
+    読み込んだDataFrameのキャッシュを空にする
+    """
+    monkeypatch.chdir(tmp_path)
+    storage.frame_cache.clear()
+    yield tmp_path
+    storage.frame_cache.clear()
+
+
+@pytest.fixture
+def kline_api() -> KlineApi:
+    return KlineApi()
+
+
+@pytest.fixture
+def kline_server(kline_api):
+    """
+    kline_apiのレスポンスを返すhttp.serverのスタブを起動して、エンドポイントを返す
+    """
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            params = {key: value[0] for key, value in parse_qs(urlparse(self.path).query).items()}
+            body = json.dumps(kline_api.response(params=params)).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True).start()
+
+    yield f'http://127.0.0.1:{server.server_address[1]}/v5/market'
+
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import scrape
+import storage
+
+#2025-01-01 00:00:00(UTC)
+START = 1735689600000
+MINUTE = 60000
+
+
+def make_scraper(endpoint: str, **kwargs) -> scrape.ScrapeMarketData:
+    return scrape.ScrapeMarketData(
+        interval='1',
+        endpoint=endpoint,
+        retention=storage.RetentionPolicy(),
+        **kwargs
+    )
+
+
+def expected_frame(kline_api, start: int, end: int) -> pd.DataFrame:
+    """
+    startからendまで1分ごとのローソク足の期待するDataFrameを返す関数
+    """
+    data = [kline_api.values(start_time=t) for t in range(start, end + 1, MINUTE)]
+
+    return scrape.ScrapeMarketData(interval='1', backtest=True).to_dataframe(data=data)
+
+
+def test_backfill_kline_splits_range_into_pages(kline_api, kline_server):
+    scraper = make_scraper(endpoint=kline_server, backtest=True)
+    end = START + MINUTE * 1049
+
+    df = scraper.backfill_kline(start=START, end=end, limit=100, rate=1000, backoff=0, progress=False)
+
+    pd.testing.assert_frame_equal(df, expected_frame(kline_api, start=START, end=end))
+    #1回のリクエストはlimit本以内で、期間が重ならない
+    assert len(kline_api.requests) == 11
+    windows = sorted((int(params['start']), int(params['end'])) for params in kline_api.requests)
+    assert all(window_end - window_start < MINUTE * 100 for window_start, window_end in windows)
+    assert all(previous[1] < window[0] for previous, window in zip(windows, windows[1:]))
+
+
+def test_backfill_kline_retries_errors(kline_api, kline_server):
+    scraper = make_scraper(endpoint=kline_server, backtest=True)
+    kline_api.failures = 2
+    end = START + MINUTE * 299
+
+    df = scraper.backfill_kline(start=START, end=end, limit=100, rate=1000, backoff=0, progress=False)
+
+    pd.testing.assert_frame_equal(df, expected_frame(kline_api, start=START, end=end))
+    assert len(kline_api.requests) == 3 + 2
+
+
+def test_backfill_kline_raises_after_retries(kline_api, kline_server):
+    scraper = make_scraper(endpoint=kline_server, backtest=True)
+    kline_api.failures = 10
+
+    with pytest.raises(RuntimeError, match='10006'):
+        scraper.backfill_kline(start=START, end=START + MINUTE * 99, retries=2, rate=1000, backoff=0, progress=False)
+
+    #HttpSessionでは再試行しないため、リクエストは1 + retries回になる
+    assert len(kline_api.requests) == 3
+
+
+def test_repair_gaps_fetches_only_missing_ranges(kline_api, kline_server):
+    scraper = make_scraper(endpoint=kline_server)
+    end = START + MINUTE * 499
+    kline_api.missing = [(START + MINUTE * 100, START + MINUTE * 149), (START + MINUTE * 300, START + MINUTE * 301)]
+
+    scraper.save(df=scraper.get_kline(start=START, end=end))
+    assert scraper.find_gaps().tolist() == [list(gap) for gap in kline_api.missing]
+
+    kline_api.missing = []
+    kline_api.requests.clear()
+    scraper.repair_gaps(rate=1000, backoff=0)
+
+    assert sorted((int(params['start']), int(params['end'])) for params in kline_api.requests) == [
+        (START + MINUTE * 100, START + MINUTE * 149),
+        (START + MINUTE * 300, START + MINUTE * 301),
+    ]
+    assert len(scraper.find_gaps()) == 0
+    pd.testing.assert_frame_equal(scraper.storage.read(), expected_frame(kline_api, start=START, end=end))
+
+
+def test_repair_gaps_skips_unfillable_ranges(kline_api, kline_server):
+    scraper = make_scraper(endpoint=kline_server)
+    kline_api.missing = [(START + MINUTE * 100, START + MINUTE * 109)]
+    scraper.save(df=scraper.get_kline(start=START, end=START + MINUTE * 199))
+
+    requests = []
+    for _ in range(5):
+        kline_api.requests.clear()
+        scraper.repair_gaps(rate=1000, backoff=0, max_attempts=3)
+        requests.append(len(kline_api.requests))
+
+    #max_attempts回リクエストしても埋まらない期間は次からリクエストしない
+    assert requests == [1, 1, 1, 0, 0]
+    assert scraper.storage.integrity().unfillable.tolist() == [list(kline_api.missing[0])]
+
+    #保存し直しても埋まらない期間の記録は残る
+    reopened = make_scraper(endpoint=kline_server)
+    kline_api.requests.clear()
+    reopened.repair_gaps(rate=1000, backoff=0)
+    assert kline_api.requests == []
+
+
+def test_repair_gaps_without_gaps_sends_no_requests(kline_api, kline_server):
+    scraper = make_scraper(endpoint=kline_server)
+    scraper.save(df=scraper.get_kline(start=START, end=START + MINUTE * 99))
+    kline_api.requests.clear()
+
+    df = scraper.repair_gaps(rate=1000, backoff=0)
+
+    assert df.empty
+    assert kline_api.requests == []
+    assert np.array_equal(scraper.find_gaps(), np.empty((0, 2), dtype=np.int64))
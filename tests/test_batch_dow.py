@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import analysis
+import storage
+
+
+def write_klines(
+        symbol: str,
+        rows: int,
+        #取り除くローソク足の割合
+        drop: float,
+        seed: int,
+    ) -> Path:
+    """
+    ランダムウォークのローソク足からdropの割合をランダムに取り除いて保存し、pathを返す関数
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, rows))
+    df = pd.DataFrame({
+        '開始時刻': pd.date_range('2025-01-01', periods=rows, freq='min'),
+        '始値': close,
+        '高値': close + rng.uniform(0, 1, rows),
+        '安値': close - rng.uniform(0, 1, rows),
+        '終値': close,
+        '取引量': 1.0,
+        '取引総額': 1.0,
+    })
+    df = df[rng.uniform(size=rows) >= drop].reset_index(drop=True)
+
+    path = Path('data', f'{symbol}-linear', '1MinutesKlines.csv')
+    storage.open_storage(path).write(df=df)
+
+    return path
+
+
+@pytest.mark.parametrize('period', [1, 2, 5])
+def test_batch_matches_dow_on_series_with_holes(period):
+    paths = [
+        write_klines(symbol='AAA', rows=3000, drop=0.0, seed=1),
+        write_klines(symbol='BBB', rows=3000, drop=0.05, seed=2),
+        write_klines(symbol='CCC', rows=2000, drop=0.3, seed=3),
+        write_klines(symbol='DDD', rows=800, drop=0.01, seed=4),
+    ]
+
+    results = analysis.BatchDow(period=period).run(paths=paths)
+
+    for path in paths:
+        expected = analysis.Dow(PATH=path, backtest=True, period=period).df
+        pd.testing.assert_frame_equal(results[path], expected)
+
+
+def test_sliding_extrema_with_lengths_matches_each_row():
+    dow = analysis.BatchDow(period=5)
+    rng = np.random.default_rng(0)
+    lengths = np.array([12, 5, 4, 9])
+    values = np.full((lengths.size, lengths.max()), np.nan)
+    for row, length in enumerate(lengths):
+        values[row, :length] = rng.normal(size=length)
+
+    left, right = dow.sliding_extrema(values=values, period=5, func=np.max, lengths=lengths)
+
+    for row, length in enumerate(lengths):
+        expected_left, expected_right = dow.sliding_extrema(values=values[row, :length], period=5, func=np.max)
+        np.testing.assert_array_equal(left[row, :length], expected_left)
+        np.testing.assert_array_equal(right[row, :length], expected_right)
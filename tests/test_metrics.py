@@ -0,0 +1,31 @@
+import re
+
+import metrics
+
+#テキスト形式のサンプルの行(名前{ラベル} 値)
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\["\\n])*",?)*\} \S+$')
+
+
+def test_prometheus_sink_writes_summary_and_escaped_labels(tmp_path):
+    sink = metrics.PrometheusTextSink(path=tmp_path / 'auto_trade.prom', flush_interval=3600)
+
+    sink.record_span(name='scheduler.job', seconds=0.5, labels={'symbol': 'BTCUSDT'})
+    sink.record_span(name='scheduler.job', seconds=0.25, labels={'symbol': 'BTCUSDT'})
+    sink.record_span(name='scheduler.job', seconds=1.0, labels={'symbol': 'A"B\\C\nD'})
+    sink.increment(name='scrape.retries', value=2, labels={'symbol': 'BTCUSDT'})
+    sink.flush()
+
+    lines = (tmp_path / 'auto_trade.prom').read_text().splitlines()
+
+    #合計時間と件数は1つのsummaryにまとめる
+    assert [line for line in lines if line.startswith('# TYPE')] == [
+        '# TYPE auto_trade_scheduler_job_seconds summary',
+        '# TYPE auto_trade_scrape_retries_total counter',
+    ]
+    assert 'auto_trade_scheduler_job_seconds_sum{symbol="BTCUSDT"} 0.75' in lines
+    assert 'auto_trade_scheduler_job_seconds_count{symbol="BTCUSDT"} 2' in lines
+    assert 'auto_trade_scheduler_job_seconds_sum{symbol="A\\"B\\\\C\\nD"} 1.0' in lines
+    assert 'auto_trade_scrape_retries_total{symbol="BTCUSDT"} 2' in lines
+
+    #ラベルの値に"や\や改行があってもすべての行を読める
+    assert all(SAMPLE.match(line) for line in lines if not line.startswith('#'))
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+import resample
+import storage
+
+
+def minute_klines(start: str, end: str) -> pd.DataFrame:
+    """
+    startからendの前までの1分足を、取引量を1にして作成して返す関数
+    """
+    start_time = pd.date_range(start, end, freq='min', inclusive='left')
+    close = np.arange(start_time.size, dtype=np.float64) + 100
+
+    return pd.DataFrame({
+        '開始時刻': start_time,
+        '始値': close,
+        '高値': close + 1,
+        '安値': close - 1,
+        '終値': close,
+        '取引量': 1.0,
+        '取引総額': close,
+    })
+
+
+def make_resampler() -> resample.KlineResampler:
+    return resample.KlineResampler(interval='60', retention=storage.RetentionPolicy())
+
+
+def test_source_starting_mid_bucket_is_not_saved():
+    resampler = make_resampler()
+
+    #10:30から始まる1分足では、10:00の1時間足は30分しか含まない
+    resampler.update(df=minute_klines(start='2025-01-01 10:30', end='2025-01-01 12:00'))
+
+    saved = resampler.save()
+
+    assert saved['開始時刻'].tolist() == [pd.Timestamp('2025-01-01 11:00')]
+    assert saved['取引量'].tolist() == [60.0]
+    assert resampler.storage.read()['開始時刻'].tolist() == [pd.Timestamp('2025-01-01 11:00')]
+
+
+def test_bucket_completed_over_several_updates():
+    resampler = make_resampler()
+
+    resampler.update(df=minute_klines(start='2025-01-01 10:00', end='2025-01-01 10:40'))
+    assert resampler.save().empty
+
+    resampler.update(df=minute_klines(start='2025-01-01 10:40', end='2025-01-01 11:10'))
+    saved = resampler.save()
+
+    assert saved['開始時刻'].tolist() == [pd.Timestamp('2025-01-01 10:00')]
+    assert saved['取引量'].tolist() == [60.0]
+    #11:00の1時間足はまだ確定していない
+    assert resampler.df['開始時刻'].tolist() == [pd.Timestamp('2025-01-01 10:00'), pd.Timestamp('2025-01-01 11:00')]
@@ -0,0 +1,200 @@
+import json
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+import scheduler
+import storage
+
+#2025-01-01 00:00:00(UTC)の30秒後から始める
+START = 1735689600000 + 30000
+MINUTE = 60000
+
+
+class FakeClock(scheduler.Clock):
+    """
+    sleepで待たずに時刻を進めて、stop_after回sleepしたらスケジューラーを止める時計
+    時刻を進める前に実行中のジョブが終わるのを待つため、ジョブが前回の処理の途中で飛ばされない
+    """
+
+    def __init__(
+            self,
+            #開始時刻(ms)
+            now: int,
+            stop_after: int,
+        ) -> None:
+        super().__init__()
+
+        self.time = now / 1000
+        self.stop_after = stop_after
+        #sleepで進めた秒数
+        self.sleeps = []
+        self.scheduler = None
+
+    def now(self) -> float:
+        return self.time
+
+    def sleep(
+            self,
+            seconds: float,
+            stop_event: threading.Event,
+        ) -> None:
+        while self.scheduler is not None and self.scheduler.running:
+            threading.Event().wait(0.001)
+
+        self.sleeps.append(seconds)
+        self.time += max(seconds, 0)
+
+        if len(self.sleeps) >= self.stop_after:
+            stop_event.set()
+
+
+class StubResponse():
+
+    def __init__(
+            self,
+            body: dict,
+        ) -> None:
+        super().__init__()
+
+        self.content = json.dumps(body).encode()
+
+    def raise_for_status(self) -> None:
+        pass
+
+    def json(self) -> dict:
+        return json.loads(self.content)
+
+
+class StubSession():
+    """
+    ネットワークに接続せずにkline_apiのレスポンスを返すセッション
+    failing_symbolsのシンボルのリクエストは例外にする
+    """
+
+    def __init__(
+            self,
+            kline_api,
+            failing_symbols: tuple = (),
+        ) -> None:
+        super().__init__()
+
+        self.kline_api = kline_api
+        self.failing_symbols = failing_symbols
+
+    def get(
+            self,
+            url: str,
+            params: dict | None = None,
+        ) -> StubResponse:
+        if params['symbol'] in self.failing_symbols:
+            raise KeyError(params['symbol'])
+
+        return StubResponse(body=self.kline_api.response(params=params))
+
+
+def make_scheduler(kline_api, watchlist, stop_after, **kwargs) -> tuple[scheduler.Scheduler, FakeClock]:
+    clock = FakeClock(now=START, stop_after=stop_after)
+    trade_scheduler = scheduler.Scheduler(
+        watchlist=watchlist,
+        clock=clock,
+        delay=2.0,
+        lookback=3,
+        session=StubSession(kline_api=kline_api, **kwargs),
+        retention=storage.RetentionPolicy()
+    )
+    clock.scheduler = trade_scheduler
+
+    return trade_scheduler, clock
+
+
+def test_close_time():
+    trade_scheduler = scheduler.Scheduler(watchlist=[('linear', 'BTCUSDT', '1'), ('linear', 'BTCUSDT', '60')])
+
+    assert trade_scheduler.close_time(job=('linear', 'BTCUSDT', '1'), now=START) == START - 30000 + MINUTE
+    assert trade_scheduler.close_time(job=('linear', 'BTCUSDT', '60'), now=START) == START - 30000 + 60 * MINUTE
+    #確定した時刻ちょうどの場合は次の確定の時刻を返す
+    assert trade_scheduler.close_time(job=('linear', 'BTCUSDT', '1'), now=START - 30000) == START - 30000 + MINUTE
+
+    trade_scheduler.shutdown()
+
+
+def test_run_processes_each_closed_candle(kline_api):
+    job = ('linear', 'BTCUSDT', '1')
+    trade_scheduler, clock = make_scheduler(kline_api=kline_api, watchlist=[job], stop_after=10)
+
+    trade_scheduler.run(handle_signals=False)
+
+    #最初は次の確定の時刻 + delayまで待ち、その後は1分ごとに起きる
+    assert clock.sleeps[0] == 32
+    assert clock.sleeps[1:] == [60] * 9
+
+    #確定したローソク足の開始時刻までを、確定するたびにリクエストする
+    closes = [START - 30000 + MINUTE * i for i in range(1, 10)]
+    assert [int(params['end']) for params in kline_api.requests] == [close - MINUTE for close in closes]
+
+    #確定していないローソク足は保存しない
+    df = trade_scheduler.scrapers[job].df
+    start_time = df['開始時刻'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+    assert start_time[-1] == closes[-1] - MINUTE
+    assert (np.diff(start_time) == MINUTE).all()
+    assert df['始値'].tolist() == [float(kline_api.values(start_time=t)[1]) for t in start_time]
+
+    job_metrics = trade_scheduler.job_metrics()[job]
+    assert job_metrics['count'] == 9
+    assert job_metrics['error'] is None
+    assert job in trade_scheduler.dows
+
+
+def test_run_handles_jobs_with_different_intervals(kline_api):
+    jobs = [('linear', 'BTCUSDT', '1'), ('linear', 'BTCUSDT', '5')]
+    trade_scheduler, clock = make_scheduler(kline_api=kline_api, watchlist=jobs, stop_after=11)
+
+    trade_scheduler.run(handle_signals=False)
+
+    job_metrics = trade_scheduler.job_metrics()
+    assert job_metrics[jobs[0]]['count'] == 10
+    #00:00:30から10分進めた間に5分足は2本確定する
+    assert job_metrics[jobs[1]]['count'] == 2
+    assert pd.Timestamp(trade_scheduler.scrapers[jobs[1]].df['開始時刻'].iloc[-1]) == pd.Timestamp('2025-01-01 00:05:00')
+
+
+def test_failing_job_does_not_stop_other_jobs(kline_api, caplog):
+    jobs = [('linear', 'BTCUSDT', '1'), ('linear', 'ETHUSDT', '1')]
+    trade_scheduler, clock = make_scheduler(
+        kline_api=kline_api,
+        watchlist=jobs,
+        stop_after=5,
+        failing_symbols=('ETHUSDT',)
+    )
+
+    with caplog.at_level(logging.ERROR, logger='auto_trade.scheduler'):
+        trade_scheduler.run(handle_signals=False)
+
+    job_metrics = trade_scheduler.job_metrics()
+    assert job_metrics[jobs[0]]['count'] == 4
+    assert job_metrics[jobs[0]]['error'] is None
+    assert job_metrics[jobs[1]]['count'] == 4
+    assert 'ETHUSDT' in job_metrics[jobs[1]]['error']
+    #失敗したジョブは毎回トレースバック付きでログに残す
+    failures = [record for record in caplog.records if record.exc_info is not None]
+    assert len(failures) == 4
+    assert all(isinstance(record.exc_info[1], KeyError) for record in failures)
+
+
+def test_stop_from_another_thread(kline_api):
+    job = ('linear', 'BTCUSDT', '1')
+    trade_scheduler = scheduler.Scheduler(
+        watchlist=[job],
+        session=StubSession(kline_api=kline_api),
+        retention=storage.RetentionPolicy()
+    )
+
+    thread = threading.Thread(target=trade_scheduler.run, kwargs={'handle_signals': False})
+    thread.start()
+    trade_scheduler.stop()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
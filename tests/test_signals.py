@@ -0,0 +1,95 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import analysis
+import benchmark
+import signals
+import storage
+
+MINUTE = 60000
+
+
+def trend_or_none(trend: str | float) -> str | None:
+    return trend if isinstance(trend, str) else None
+
+
+@pytest.mark.parametrize('shape', ['random_walk', 'trending', 'ranging'])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_incremental_dow_publishes_only_confirmed_swings(shape, seed):
+    df = benchmark.generate_klines(shape=shape, rows=3000, seed=seed)
+    path = Path('data', 'SIGUSDT-linear', '1MinutesKlines.csv')
+    storage.open_storage(path).write(df=df)
+
+    bus = signals.SignalBus()
+    subscription = bus.subscribe(maxsize=10000)
+    dow = analysis.IncrementalDow().attach(signal_bus=bus, symbol='SIGUSDT', interval='1', interval_ms=MINUTE)
+
+    #ローソク足が確定するたびに数本ずつ渡す
+    for end in range(7, len(df) + 7, 7):
+        dow.update_frame(klines_df=df.iloc[:end])
+
+    events = []
+    while (event := subscription.get(timeout=0)) is not None:
+        events.append(event)
+
+    #右側にperiod本のローソク足がそろったスイングだけで、全期間を分析したときと同じ順にトレンドが変わる
+    full = analysis.Dow(PATH=path, backtest=True, klines_df=df).df
+    full = full[full['開始時刻'] <= df['開始時刻'].iloc[-1 - dow.period]]
+    trends = [trend_or_none(trend) for trend in full['トレンド']]
+    expected = [
+        (previous, trend)
+        for previous, trend in zip([None, *trends], trends)
+        if previous != trend
+    ]
+    assert [(trend_or_none(event.previous), trend_or_none(event.trend)) for event in events] == expected
+    assert trend_or_none(dow.trend) == trends[-1]
+
+    for event in events:
+        #スイングの右側のローソク足が確定した後に発行する
+        assert event.closed_at * 1000 >= pd.Timestamp(event.start_time).value // 1_000_000 + MINUTE * (dow.period + 1)
+
+
+def collect(subscription: signals.Subscription) -> list[tuple]:
+    events = []
+    while (event := subscription.get(timeout=0)) is not None:
+        events.append((event.previous, event.trend, event.start_time, event.closed_at))
+
+    return events
+
+
+def test_advance_resumes_from_checkpoint_without_republishing():
+    df = benchmark.generate_klines(shape='trending', rows=3000, seed=0)
+    path = Path('data', 'SIGUSDT-linear', '1MinutesKlines.csv')
+    job = ('linear', 'SIGUSDT', '1')
+
+    def run(ends: range, dows: dict, bus: signals.SignalBus) -> None:
+        for end in ends:
+            analysis.IncrementalDow.advance(
+                dows=dows,
+                job=job,
+                klines_df=df.iloc[:end],
+                PATH=path,
+                signal_bus=bus,
+                interval_ms=MINUTE
+            )
+
+    #止めずに分析した場合
+    bus = signals.SignalBus()
+    subscription = bus.subscribe(maxsize=10000)
+    run(ends=range(500, 3001, 10), dows={}, bus=bus)
+    expected = collect(subscription=subscription)
+
+    #1500本目で止めて、保存した分析の状態から再開した場合
+    analysis.IncrementalDow.checkpoint_path(PATH=path).unlink()
+    run(ends=range(500, 1501, 10), dows={}, bus=signals.SignalBus())
+    bus = signals.SignalBus()
+    subscription = bus.subscribe(maxsize=10000)
+    run(ends=range(1500, 3001, 10), dows={}, bus=bus)
+
+    #再開した後に確定したスイングだけを、止めなかった場合と同じく発行する
+    restart_closed_at = (df['開始時刻'].iloc[1499].value // 1_000_000 + MINUTE) / 1000
+    resumed = collect(subscription=subscription)
+    assert resumed == [event for event in expected if event[3] > restart_closed_at]
+    assert len(resumed) > 0
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+
+def minute_klines(start: str, periods: int) -> pd.DataFrame:
+    start_time = pd.date_range(start, periods=periods, freq='min')
+    close = (start_time.astype(np.int64) // 60_000_000_000 % 1000).to_numpy(dtype=np.float64)
+
+    return pd.DataFrame({
+        '開始時刻': start_time,
+        '始値': close,
+        '高値': close + 1,
+        '安値': close - 1,
+        '終値': close,
+        '取引量': 1.0,
+        '取引総額': close,
+    })
+
+
+def test_memmap_append_skips_stored_rows_and_fills_holes():
+    memmap_storage = storage.open_storage(Path('data', 'BTCUSDT-linear', '1MinutesKlines.bin'))
+    df = minute_klines(start='2025-01-01', periods=300)
+    memmap_storage.write(df=df.drop(index=range(100, 120)))
+
+    #最後の開始時刻より新しいローソク足だけの場合はすべて追加する
+    tail = minute_klines(start='2025-01-01 05:00', periods=30)
+    assert len(memmap_storage.append(df=tail)) == 30
+
+    #保存済みのローソク足は追加せず、欠けていた期間だけを追加する
+    added = memmap_storage.append(df=pd.concat([df.iloc[90:130], tail.iloc[-5:]]))
+    assert added['開始時刻'].tolist() == df['開始時刻'].iloc[100:120].tolist()
+
+    expected = pd.concat([df, tail]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(memmap_storage.read(), expected)
+    assert memmap_storage.append(df=expected).empty
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import time
+
+import numpy as np
+import pytest
+
+websockets = pytest.importorskip('websockets')
+
+import storage
+import stream
+
+MINUTE = 60000
+
+
+def kline_message(kline_api, topic: str, start_time: int, confirm: bool) -> str:
+    """
+    kline_apiと同じ値のローソク足をWebSocketのklineのメッセージにして返す関数
+    """
+    values = kline_api.values(start_time=start_time)
+
+    return json.dumps({
+        'topic': topic,
+        'type': 'snapshot',
+        'data': [{
+            'start': start_time,
+            'end': start_time + MINUTE - 1,
+            'interval': '1',
+            'open': values[1],
+            'high': values[2],
+            'low': values[3],
+            'close': values[4],
+            'volume': values[5],
+            'turnover': values[6],
+            'confirm': confirm,
+            'timestamp': start_time,
+        }],
+    })
+
+
+class KlineServer():
+    """
+    購読したklineのメッセージを送るWebSocketのスタブ
+    最初の接続は古いローソク足を送った後に切断し、2回目以降の接続は最近のローソク足を送って接続を保つ
+    extra_messagesは2回目以降の接続でローソク足の前に送る
+    """
+
+    def __init__(
+            self,
+            kline_api,
+            #最後に確定したローソク足の開始時刻(ms)
+            latest: int,
+            extra_messages: list[str] = (),
+        ) -> None:
+        super().__init__()
+
+        self.kline_api = kline_api
+        self.latest = latest
+        self.extra_messages = extra_messages
+        self.connections = 0
+        self.subscriptions = []
+
+    async def handler(self, websocket) -> None:
+        self.connections += 1
+        connection = self.connections
+
+        subscription = json.loads(await websocket.recv())
+        self.subscriptions.append(subscription['args'])
+        await websocket.send(json.dumps({'success': True, 'op': 'subscribe'}))
+
+        if connection == 1:
+            #30分前から10本を送って切断する(切断中の20本はREST APIで補う)
+            start_times = range(self.latest - MINUTE * 30, self.latest - MINUTE * 20, MINUTE)
+        else:
+            for message in self.extra_messages:
+                await websocket.send(message)
+            start_times = range(self.latest - MINUTE * 2, self.latest + MINUTE, MINUTE)
+
+        for start_time in start_times:
+            for topic in subscription['args']:
+                #確定していないローソク足は処理されない
+                await websocket.send(kline_message(self.kline_api, topic=topic, start_time=start_time, confirm=False))
+                await websocket.send(kline_message(self.kline_api, topic=topic, start_time=start_time, confirm=True))
+
+        if connection == 1:
+            await websocket.close()
+        else:
+            await websocket.wait_closed()
+
+
+async def wait_until(condition, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        await asyncio.sleep(0.01)
+
+
+def run_stream(kline_api, kline_server, jobs, extra_messages=(), setup=None) -> stream.KlineStream:
+    """
+    KlineServerに接続したKlineStreamを、すべてのジョブが最後に確定したローソク足まで処理するまで動かして返す関数
+    """
+    latest = int(time.time() * 1000) // MINUTE * MINUTE - MINUTE
+
+    async def main() -> stream.KlineStream:
+        server = KlineServer(kline_api=kline_api, latest=latest, extra_messages=extra_messages)
+
+        async with websockets.serve(server.handler, '127.0.0.1', 0) as websocket_server:
+            port = websocket_server.sockets[0].getsockname()[1]
+            kline_stream = stream.KlineStream(
+                watchlist=jobs,
+                endpoint=f'ws://127.0.0.1:{port}',
+                rest_endpoint=kline_server,
+                reconnect_delay=0.05,
+                retention=storage.RetentionPolicy()
+            )
+            if setup is not None:
+                setup(kline_stream)
+
+            task = asyncio.create_task(kline_stream.run())
+            await wait_until(lambda: all(kline_stream.latest.get(job, 0) >= latest for job in jobs))
+            kline_stream.stop()
+            await asyncio.wait_for(task, timeout=5)
+
+        kline_stream.server = server
+        return kline_stream
+
+    kline_stream = asyncio.run(main())
+    kline_stream.expected_latest = latest
+
+    return kline_stream
+
+
+def assert_complete(kline_api, kline_stream, job) -> None:
+    """
+    最初に受け取ったローソク足から最後に確定したローソク足までが欠けずに保存されていることを確かめる関数
+    """
+    df = kline_stream.scrapers[job].storage.read()
+    start_time = df['開始時刻'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+
+    assert start_time[0] == kline_stream.expected_latest - MINUTE * 30
+    assert start_time[-1] >= kline_stream.expected_latest
+    assert (np.diff(start_time) == MINUTE).all()
+    assert df['終値'].tolist() == [float(kline_api.values(start_time=t)[4]) for t in start_time]
+
+
+def test_reconnects_and_fills_gap(kline_api, kline_server):
+    jobs = [('linear', 'BTCUSDT', '1'), ('linear', 'ETHUSDT', '1')]
+
+    kline_stream = run_stream(kline_api=kline_api, kline_server=kline_server, jobs=jobs)
+
+    assert kline_stream.reconnect_count >= 1
+    assert kline_stream.server.connections >= 2
+    #再接続したときも同じ購読を送る
+    assert kline_stream.server.subscriptions[0] == kline_stream.server.subscriptions[1] == ['kline.1.BTCUSDT', 'kline.1.ETHUSDT']
+    #切断中のローソク足をREST APIで取得する
+    assert {params['symbol'] for params in kline_api.requests} == {'BTCUSDT', 'ETHUSDT'}
+
+    for job in jobs:
+        assert_complete(kline_api, kline_stream, job)
+        assert kline_stream.error_counts[job] == 0
+        assert job in kline_stream.dows
+        assert len(kline_stream.latencies[job]) > 0
+
+
+def test_errors_do_not_stop_stream(kline_api, kline_server):
+    jobs = [('linear', 'BTCUSDT', '1'), ('linear', 'ETHUSDT', '1')]
+    #切断中のローソク足の取得は、確定したローソク足を受け取った後まで失敗する(retCodeが0以外)
+    kline_api.failures = 6
+    extra_messages = [
+        'not json',
+        json.dumps({'topic': 'kline.1.BTCUSDT', 'data': [{'confirm': True}]}),
+    ]
+
+    def setup(kline_stream: stream.KlineStream) -> None:
+        #再試行を待たずに失敗させる
+        for job in jobs:
+            scraper = kline_stream.scraper(job=job)
+            backfill_kline = scraper.backfill_kline
+            scraper.backfill_kline = lambda backfill_kline=backfill_kline, **kwargs: backfill_kline(retries=0, **kwargs)
+
+    kline_stream = run_stream(
+        kline_api=kline_api,
+        kline_server=kline_server,
+        jobs=jobs,
+        extra_messages=extra_messages,
+        setup=setup
+    )
+
+    #失敗した取得は次のローソク足を受け取ったときにもう一度行う
+    assert kline_stream.unfilled == set()
+    assert kline_stream.error_counts[jobs[0]] >= 3
+    assert kline_stream.error_counts[jobs[1]] >= 1
+    assert isinstance(kline_stream.errors[jobs[0]], RuntimeError)
+    for job in jobs:
+        assert_complete(kline_api, kline_stream, job)
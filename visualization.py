@@ -1,10 +1,33 @@
-import mplfinance as mpf
+import numpy as np
 import pandas as pd
+from pathlib import Path
 
 class Visualization:
 
     COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
 
+    def __init__(
+            self,
+            #Trueの場合はGUIを使わないAggバックエンドで描画する(ファイルへの書き出し専用)
+            headless: bool = False,
+        ) -> None:
+        super().__init__()
+
+        self.headless = headless
+
+    def mplfinance(self):
+        """
+        mplfinanceを読み込んで返す関数
+        matplotlibとmplfinanceは読み込みに時間がかかるため、描画するときに初めて読み込む
+        """
+        import matplotlib
+        if self.headless:
+            matplotlib.use('Agg', force=True)
+
+        import mplfinance
+
+        return mplfinance
+
     def visualization_ByBit_kline(
             self,
             df: pd.DataFrame,
@@ -22,6 +45,8 @@ class Visualization:
         df_copy['Date'] = pd.to_datetime(df_copy['Date'])
         df_copy.set_index('Date', inplace=True)
 
+        mpf = self.mplfinance()
+
         #alinesが渡されている場合はplotのオプションを使用する
         if alines != None:
             mpf.plot(
@@ -44,15 +69,117 @@ class Visualization:
         可視化したいローソク足のデータとそのローソク足の中のデータからスイングハイ、
         スイングロウを抜き出したデータを渡すとローソク足とトレンドラインを同時に描画する関数
         """
-        #(開始時刻の文字列, その時刻の高値もしくは安値のfloat型)の配列を作成
-        points = []
+        self.visualization_ByBit_kline(df=target_kline_df, alines=self.swing_points(analysis_df=analysis_df))
+
+    def swing_points(
+            self,
+            analysis_df: pd.DataFrame,
+        ) -> list[tuple]:
+        """
+        分析結果のDataFrameから(開始時刻, スイングロウなら安値、スイングハイなら高値のfloat型)の
+        リストをまとめて作成して返す関数
+        """
+        prices = np.where(
+            analysis_df['分類'].to_numpy() == 'スイングロウ',
+            analysis_df['安値'].to_numpy(dtype=np.float64),
+            analysis_df['高値'].to_numpy(dtype=np.float64)
+        )
+
+        return list(zip(analysis_df['開始時刻'], prices.tolist()))
+
+    def downsample(
+            self,
+            df: pd.DataFrame | np.ndarray,
+            #残すローソク足の最大数
+            max_candles: int,
+        ) -> pd.DataFrame:
+        """
+        ローソク足がmax_candles本より多い場合は、連続するローソク足を同じ本数ずつまとめて、
+        始値は最初、高値は最大、安値は最小、終値は最後、取引量は合計したローソク足にして
+        mplfinanceで描画できる[Open, High, Low, Close, Volume]のDataFrameで返す関数
+        """
+        #DataFrameのほかに、MemmapStorageのレコードの配列もコピーせずにそのまま渡せる
+        start_time = pd.to_datetime(df['開始時刻']).to_numpy()
+        open_prices = np.asarray(df['始値'], dtype=np.float64)
+        high = np.asarray(df['高値'], dtype=np.float64)
+        low = np.asarray(df['安値'], dtype=np.float64)
+        close = np.asarray(df['終値'], dtype=np.float64)
+        volume = np.asarray(df['取引量'], dtype=np.float64)
+
+        if len(df) > max_candles:
+            #まとめる位置(1つにまとめる本数は切り上げにして、max_candles本以内に収める)
+            size = -(-len(df) // max_candles)
+            starts = np.arange(0, len(df), size)
+            ends = np.r_[starts[1:], len(df)] - 1
+
+            start_time = start_time[starts]
+            open_prices = open_prices[starts]
+            high = np.maximum.reduceat(high, starts)
+            low = np.minimum.reduceat(low, starts)
+            close = close[ends]
+            volume = np.add.reduceat(volume, starts)
+
+        return pd.DataFrame(
+            {
+                'Open': open_prices,
+                'High': high,
+                'Low': low,
+                'Close': close,
+                'Volume': volume,
+            },
+            index=pd.DatetimeIndex(start_time, name='Date')
+        )
+
+    def render(
+            self,
+            df: pd.DataFrame | np.ndarray,
+            #保存するファイルのpath(拡張子が.pngか.svg)
+            path: Path,
+            #スイングハイ、スイングロウの分析結果。渡した場合はトレンドラインも描画する
+            analysis_df: pd.DataFrame | None = None,
+            #画像の幅と高さ(px)
+            width: int = 1600,
+            height: int = 900,
+            dpi: int = 100,
+            #ローソク足1本に使う幅(px)。画像の幅をこの値で割った本数まで間引く
+            candle_width: int = 3,
+        ) -> Path:
+        """
+        ローソク足を画像の幅で表示できる本数まで間引いて、GUIを使わずにpngかsvgのファイルに描画して
+        保存したpathを返す関数
+        """
+        path = Path(path)
+        if path.suffix not in ('.png', '.svg'):
+            raise ValueError(f'対応していない拡張子です: {path.suffix}')
+
+        max_candles = max(width // candle_width, 1)
+        plot_df = self.downsample(df=df, max_candles=max_candles)
 
-        for i in range(analysis_df.index.size):
-            target = analysis_df.iloc[i]
+        kwargs = {}
+        if analysis_df is not None and not analysis_df.empty:
+            #表示するローソク足の期間のスイングだけを線で結ぶ
+            start_time = pd.to_datetime(analysis_df['開始時刻']).to_numpy()
+            analysis_df = analysis_df[
+                (plot_df.index[0].to_datetime64() <= start_time) &
+                (start_time <= plot_df.index[-1].to_datetime64())
+            ]
+            if len(analysis_df) > 1:
+                #間引いた場合はスイングの数がローソク足より多くなるため細い線にする
+                kwargs['alines'] = {
+                    'alines': self.swing_points(analysis_df=analysis_df),
+                    'linewidths': 0.5 if len(df) > max_candles else 1.5,
+                    'alpha': 0.7,
+                }
 
-            if target['分類'] == 'スイングロウ':
-                points.append((target['開始時刻'], float(target['安値'])))
-            else:
-                points.append((target['開始時刻'], float(target['高値'])))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.mplfinance().plot(
+            plot_df,
+            type='candle',
+            figsize=(width / dpi, height / dpi),
+            warn_too_much_data=len(plot_df) + 1,
+            savefig={'fname': str(path), 'dpi': dpi},
+            closefig=True,
+            **kwargs
+        )
 
-        self.visualization_ByBit_kline(df=target_kline_df, alines=points)
\ No newline at end of file
+        return path